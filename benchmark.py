@@ -0,0 +1,170 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import fcd_data
+import fd_data
+from synthetic_data import write_outputs
+
+## Number of vehicles per hour of the synthetic link at each scale
+SCALES = {"small": 200, "medium": 1000, "large": 5000}
+# FD-timestep used for the FD benchmarks
+BENCH_TS = 2
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The benchmarked functions print their progress
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def measure(func, memory=True):
+    """
+    Run func() and return (result, seconds, peak traced memory [MB]).
+    The time is taken without tracemalloc, which slows Python code down; the peak memory
+    comes from a second, traced run.
+    """
+    with _quiet():
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            with _quiet():
+                func()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_scale(scale, n_vehicles, work_dir, memory=True):
+    """
+    BENCHMARK THE EXTRACTION HOT PATHS ON ONE SYNTHETIC OUTPUT OF n_vehicles (one hour).
+    Returns a list of result dicts (name, scale, seconds, rows, rows_per_s, mb_per_s, peak_mb).
+    """
+    out_dir = os.path.join(work_dir, scale)
+    with _quiet():
+        fcd_path = write_outputs(out_dir, n_vehicles=n_vehicles, duration=3600)
+    fd_path = os.path.join(out_dir, f"fd-{BENCH_TS}sec.xml")
+    results = []
+
+    def record(name, func, rows=len, path=None):
+        # rows: number of rows handled, or a function of the result giving it
+        result, seconds, peak = measure(func, memory)
+        rows = rows(result) if callable(rows) else rows
+        size = os.path.getsize(path) / 2**20 if path else None
+        results.append({"name": name, "scale": scale, "seconds": seconds, "rows": rows,
+                        "rows_per_s": rows / seconds if seconds > 0 else None,
+                        "mb_per_s": size / seconds if size and seconds > 0 else None,
+                        "peak_mb": peak})
+        return result
+
+    ## XML parsing
+    fcd = record("fcd_data.parse_xml", lambda: fcd_data.parse_xml(fcd_path), path=fcd_path)
+    record("fd_data.parse_xml", lambda: fd_data.parse_xml(fd_path, BENCH_TS), path=fd_path)
+
+    ## Lane subsets
+    fcd = fcd_data.convert_units(fcd)
+    detectlinks = fcd_data.LINK_PARAMS["DETECTION_LANE"]
+    probelinks = fcd_data.LINK_PARAMS["PROBE_LANE"]
+    carData = record("get_detectData", lambda: fcd_data.get_detectData(fcd, detectlinks), len(fcd))
+    probeData = record("get_probeData", lambda: fcd_data.get_probeData(fcd, probelinks), len(fcd))
+
+    ## Experiments, written in a scratch folder (generate_expData writes to cwd/exp/)
+    with _quiet():
+        for ts in fcd_data.FD_TIMESTEPS:
+            fd_data.convert_fd(os.path.join(out_dir, f"fd-{ts}sec.xml"), ts, n_lanes=1)
+    ids = fcd_data.sample_probe_ids(probeData, fcd_data.LINK_PARAMS["PENERATION_RATE"])
+    exp_dir = os.path.join(out_dir, "run")
+    cwd = os.getcwd()
+
+    def experiments():
+        shutil.rmtree(exp_dir, ignore_errors=True)
+        os.makedirs(exp_dir)
+        os.chdir(exp_dir)
+        try:
+            fcd_data.generate_expData(ids, probeData, carData, fd_windows=fcd_data.FDWindows(fd_dir=out_dir))
+        finally:
+            os.chdir(cwd)
+
+    record("generate_expData", experiments, len(ids))
+
+    ## Space-time plot of the longest experiment
+    runs, carSorted, positions = fcd_data.probe_runs(probeData, carData)
+    idx = (runs["detect_hi"] - runs["detect_lo"]).idxmax()
+    probe = probeData.iloc[positions[idx]]
+    traj = carSorted.iloc[runs.loc[idx, "detect_lo"]:runs.loc[idx, "detect_hi"]]
+    grid = fcd_data.create_space_time_grid(0.086, 3/3600, road_space=[0, 0.4],
+                                           time_space=[probe["time"].min(), probe["time"].max()])
+    for fast in (False, True):
+        record(f"plot_contineous_traj(fast={fast})",
+               lambda: fcd_data.plot_contineous_traj(probe, traj, grid, camView=True,
+                                                     probeViewDistance=[0, 0.140], fast=fast),
+               len(probe) + len(traj))
+    return results
+
+
+def print_report(results):
+    print(f"\n{'benchmark':<34}{'scale':<8}{'seconds':>10}{'rows':>10}{'rows/s':>12}{'MB/s':>8}{'peak MB':>9}")
+    print("-" * 91)
+    fmt = lambda value, spec: format(value, spec) if value is not None else "-"
+    for r in results:
+        print(f"{r['name']:<34}{r['scale']:<8}{r['seconds']:>10.3f}{r['rows']:>10}"
+              f"{fmt(r['rows_per_s'], '>12,.0f'):>12}{fmt(r['mb_per_s'], '>8.1f'):>8}{fmt(r['peak_mb'], '>9.1f'):>9}")
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Benchmarks slower than the baseline by more than tolerance (a fraction).
+    """
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["scale"]): r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        base = baseline.get((r["name"], r["scale"]))
+        if base is not None and r["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append((r["name"], r["scale"], base["seconds"], r["seconds"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the extraction hot paths on synthetic SUMO outputs.")
+    parser.add_argument("--scales", nargs="+", default=list(SCALES), choices=list(SCALES))
+    parser.add_argument("--no-memory", action="store_true", help="Skip the (slow) peak memory runs")
+    parser.add_argument("--json", default=None, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline")
+    parser.add_argument("--keep", default=None, help="Keep the synthetic outputs in this folder")
+    args = parser.parse_args()
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix="fcd-bench-")
+    results = []
+    try:
+        for scale in args.scales:
+            print(f"\n[X] Benchmarking {scale} ({SCALES[scale]} vehicles) ...", end=" ", flush=True)
+            results += bench_scale(scale, SCALES[scale], work_dir, memory=not args.no_memory)
+            print("Done!")
+    finally:
+        if args.keep is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for name, scale, before, after in regressions:
+            print(f"\nREGRESSION: {name} ({scale}) {before:.3f}s -> {after:.3f}s")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,93 @@
+import numpy as np
+
+## Range of the camera of a probe vehicle [km] (the camera band of the dashboard)
+VIEW_DISTANCE = [0, 0.140]
+# Field of view of the camera [deg], centred on the heading of the probe
+FIELD_OF_VIEW = 180
+
+
+def _timestep_codes(probe_time, car_time):
+    """
+    Common integer code of the timesteps of both tables (time in hours, matched to the ms).
+    """
+    ms = np.rint(np.concatenate([probe_time, car_time]) * 3600 * 1000).astype(np.int64)
+    codes = np.unique(ms, return_inverse=True)[1].reshape(-1)
+    return codes[:len(probe_time)], codes[len(probe_time):]
+
+
+def observed_trajectories(probeData, carData, ids=None, view_distance=VIEW_DISTANCE,
+                          field_of_view=FIELD_OF_VIEW):
+    """
+    DETECTED VEHICLES SEEN BY THE CAMERA OF THE PROBE VEHICLES, AT EVERY TIMESTEP.
+    A vehicle is seen by a probe in the same timestep if its distance to the probe is in
+    view_distance [km] and its bearing is within field_of_view [deg] of the probe heading
+    (SUMO angle: degrees clockwise from north). x and y are in meters.
+
+    The detected vehicles are put in a spatial hash of (timestep, cell) with cells as large as
+    the view range, so every probe row is only compared with the vehicles of its own and the
+    8 neighbouring cells. All probes are handled in a single vectorized pass.
+
+    ids: probe ids to use (e.g. the sampled probe ids), all probes if None.
+    Returns the rows of carData seen by each probe, with the columns probe_id, probe_row
+    (index of the probe row), distance [km] and bearing [deg], sorted by probe_id and time.
+    """
+    if ids is not None:
+        probeData = probeData[probeData["id"].isin(ids)]
+    # Rows without a location cannot be matched
+    probeData = probeData[probeData["x"].notnull() & probeData["y"].notnull()]
+    carData = carData[carData["x"].notnull() & carData["y"].notnull()]
+    probe_t, car_t = _timestep_codes(probeData["time"].to_numpy(dtype=float),
+                                     carData["time"].to_numpy(dtype=float))
+    px = probeData["x"].to_numpy(dtype=float) / 1000
+    py = probeData["y"].to_numpy(dtype=float) / 1000
+    cx = carData["x"].to_numpy(dtype=float) / 1000
+    cy = carData["y"].to_numpy(dtype=float) / 1000
+
+    ## Spatial hash of the detected vehicles
+    size = view_distance[1]
+    x0 = min(px.min(initial=np.inf), cx.min(initial=np.inf))
+    y0 = min(py.min(initial=np.inf), cy.min(initial=np.inf))
+    # One empty cell of margin on each side for the neighbours
+    car_i = np.floor((cx - x0) / size).astype(np.int64) + 1
+    car_j = np.floor((cy - y0) / size).astype(np.int64) + 1
+    probe_i = np.floor((px - x0) / size).astype(np.int64) + 1
+    probe_j = np.floor((py - y0) / size).astype(np.int64) + 1
+    n_i = max(car_i.max(initial=0), probe_i.max(initial=0)) + 2
+    n_j = max(car_j.max(initial=0), probe_j.max(initial=0)) + 2
+
+    car_key = (car_t * n_j + car_j) * n_i + car_i
+    order = np.argsort(car_key, kind="stable")
+    car_key = car_key[order]
+
+    ## Candidate pairs: the vehicles in the 3x3 cells around each probe row
+    probe_rows, car_rows = [], []
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            key = (probe_t * n_j + probe_j + dj) * n_i + probe_i + di
+            lo = np.searchsorted(car_key, key, side="left")
+            hi = np.searchsorted(car_key, key, side="right")
+            counts = hi - lo
+            probe_rows.append(np.repeat(np.arange(len(key)), counts))
+            car_rows.append(order[np.repeat(lo, counts) + np.arange(counts.sum())
+                                  - np.repeat(np.cumsum(counts) - counts, counts)])
+    p = np.concatenate(probe_rows)
+    c = np.concatenate(car_rows)
+
+    ## Distance and bearing of each candidate
+    dx, dy = cx[c] - px[p], cy[c] - py[p]
+    distance = np.hypot(dx, dy)
+    heading = probeData["angle"].to_numpy(dtype=float)[p]
+    bearing = (np.degrees(np.arctan2(dx, dy)) - heading + 180) % 360 - 180
+    seen = ((distance >= view_distance[0]) & (distance <= view_distance[1])
+            & (np.abs(bearing) <= field_of_view / 2))
+    # A probe does not see itself
+    seen &= probeData["id"].to_numpy()[p] != carData["id"].to_numpy()[c]
+    p, c = p[seen], c[seen]
+
+    observed = carData.iloc[c].copy()
+    observed.insert(0, "probe_id", probeData["id"].to_numpy()[p])
+    observed.insert(1, "probe_row", probeData.index.to_numpy()[p])
+    observed["distance"] = distance[seen]
+    observed["bearing"] = bearing[seen]
+    observed = observed.sort_values(["probe_id", "time", "id"], kind="stable")
+    return observed.reset_index(drop=True)
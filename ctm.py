@@ -0,0 +1,207 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from edie import num_space_cells, num_time_cells, edie_cells, edie_measures
+from fcd_data import LINK_PARAMS, CATALOG_FILE, FD_DIR, FDWindows
+
+## Number of probe windows simulated together (bounds the memory of one batch)
+WINDOW_BATCH = 4096
+
+
+def greenshields(rho, vf, rho_c):
+    """
+    Flow [veh/hr] of the Greenshields FD at density rho [veh/km]: vf*rho*(1 - rho/rho_j),
+    with the jam density rho_j = 2*rho_c.
+    """
+    return vf * rho * (1 - rho / (2 * rho_c))
+
+
+def demand(rho, vf, rho_c):
+    """
+    Sending flow of a cell: the FD flow up to the critical density, the capacity above it.
+    """
+    return greenshields(np.minimum(rho, rho_c), vf, rho_c)
+
+
+def supply(rho, vf, rho_c):
+    """
+    Receiving flow of a cell: the capacity up to the critical density, the FD flow above it.
+    """
+    return greenshields(np.clip(rho, rho_c, 2 * rho_c), vf, rho_c)
+
+
+def fd_values(fd_windows, ts, times, column):
+    """
+    Value of an FD column of the fd-{ts}sec data at the times [hr] (any shape);
+    0 where no FD interval covers the time.
+    """
+    values = np.nan_to_num(fd_windows.frame(ts)[column].to_numpy(dtype=float))
+    begin, end = fd_windows.begin[ts], fd_windows.end[ts]
+    k = np.searchsorted(begin, times, side="right") - 1
+    covered = (k >= 0) & (times < end[np.maximum(k, 0)])
+    return np.where(covered, values[np.maximum(k, 0)], 0.0)
+
+
+def _simulate(rho, inflow, outflow, vf, rho_c, dx, deltaT, n_sub, n_split):
+    """
+    Godunov (demand/supply) steps of one batch of windows.
+    rho: initial density of the sub-cells (n_windows, n_space * n_split) of length dx,
+         updated in place; every n_split consecutive sub-cells make one cell.
+    Returns the density and flow of every cell (n_windows, n_time_max, n_space), averaged over
+    its sub-cells and over the sub-steps of each time cell.
+    """
+    n_windows, n_cells = rho.shape
+    n_space = n_cells // n_split
+    n_time_max = inflow.shape[1]
+    density = np.zeros((n_windows, n_time_max, n_space))
+    flow = np.zeros((n_windows, n_time_max, n_space))
+    flux = np.empty((n_windows, n_cells + 1))
+    ratio = deltaT / n_sub / dx
+    for k in range(n_time_max):
+        for _ in range(n_sub):
+            D = demand(rho, vf, rho_c)
+            S = supply(rho, vf, rho_c)
+            # Upstream boundary: the FD inflow, as far as the first cell receives it
+            flux[:, 0] = np.minimum(inflow[:, k], S[:, 0])
+            flux[:, 1:-1] = np.minimum(D[:, :-1], S[:, 1:])
+            # Downstream boundary: the FD outflow, as far as the last cell sends it
+            flux[:, -1] = np.minimum(D[:, -1], outflow[:, k])
+            density[:, k] += rho.reshape(n_windows, n_space, n_split).sum(axis=2)
+            flow[:, k] += ((flux[:, :-1] + flux[:, 1:]) / 2).reshape(n_windows, n_space, n_split).sum(axis=2)
+            rho += ratio * (flux[:, :-1] - flux[:, 1:])
+    density /= n_sub * n_split
+    flow /= n_sub * n_split
+    return density, flow
+
+
+def ctm_estimate(windows, fd_windows, ts=None, deltaX=None, deltaT=None, road_space=None,
+                 vf=None, rho_c=None, rho0=None, sub_dx=None):
+    """
+    CELL-TRANSMISSION ESTIMATE OF THE TRAFFIC STATE IN THE CELLS OF MANY PROBE WINDOWS.
+    windows: array of [t_start, t_end] [hr] per experiment; each window gets the cells of
+             create_space_time_grid(deltaX, deltaT, road_space, [t_start, t_end]).
+    The link is a Greenshields CTM (jam density 2*rho_c) solved with the demand/supply
+    (Godunov) fluxes. The inflow and outflow [veh/hr] of the fd-{ts}sec FD data are the
+    upstream and downstream boundary flows; the initial density is the FD laneDensity at the
+    start of each window (or rho0). The cells are simulated as sub-cells of sub_dx [km]
+    (default: the first space step of SSteps, when it divides deltaX), whose density and flow
+    are averaged back to the cells; the time cell is split into sub-steps when vf*deltaT > sub_dx
+    (CFL condition). The windows are sorted by length and advanced together in batches of
+    WINDOW_BATCH, one time cell at a time; only the time cells inside each window are kept.
+    Defaults come from LinkParams.json: DELTAX [m], DELTAT [s], ROAD_LENGTH [m], SSteps [m] and the
+    estimated FD (ESTIM_VF [km/hr], ESTIM_RHO_C [veh/km]); ts defaults to DELTAT.
+
+    Returns dict with
+        density [veh/km], flow [veh/hr], speed [km/hr]: the cells of all the windows one after the
+            other, shape (sum(num_time), n_space); window_cells gives the cells of one window
+        num_time: number of time cells of each window
+        offsets: first row of each window, and the number of rows at the end
+    """
+    deltaX = LINK_PARAMS["DELTAX"] / 1000 if deltaX is None else deltaX
+    deltaT = LINK_PARAMS["DELTAT"] / 3600 if deltaT is None else deltaT
+    road_space = [0, LINK_PARAMS["ROAD_LENGTH"] / 1000] if road_space is None else road_space
+    vf = LINK_PARAMS["ESTIM_VF"] if vf is None else vf
+    rho_c = LINK_PARAMS["ESTIM_RHO_C"] if rho_c is None else rho_c
+    ts = LINK_PARAMS["DELTAT"] if ts is None else ts
+    sub_dx = LINK_PARAMS["SSteps"][0] / 1000 if sub_dx is None else sub_dx
+
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2)
+    t_start = windows[:, 0]
+    n_time = num_time_cells(deltaT, windows[:, 0], windows[:, 1])
+    n_space = num_space_cells(deltaX, road_space)
+    # Sub-cells per cell: one cell if the space step does not divide it
+    n_split = int(round(deltaX / sub_dx))
+    if n_split < 1 or not np.isclose(n_split * sub_dx, deltaX):
+        n_split = 1
+    n_sub = max(int(np.ceil(vf * deltaT / (deltaX / n_split))), 1)
+
+    ## Initial density of every window
+    if rho0 is None:
+        rho0 = fd_values(fd_windows, ts, t_start, "laneDensity")
+    rho0 = np.broadcast_to(np.clip(rho0, 0, 2 * rho_c), (len(windows),))
+
+    offsets = np.concatenate([[0], np.cumsum(n_time)])
+    density = np.zeros((offsets[-1], n_space))
+    flow = np.zeros((offsets[-1], n_space))
+    # Windows of similar length in the same batch: little padding after the short ones
+    order = np.argsort(n_time, kind="stable")
+    for start in range(0, len(windows), WINDOW_BATCH):
+        batch = order[start:start + WINDOW_BATCH]
+        n_time_max = int(n_time[batch].max())
+        # Boundary flows in the middle of every time cell of each window
+        t_mid = t_start[batch, None] + (np.arange(n_time_max) + 0.5) * deltaT
+        inflow = fd_values(fd_windows, ts, t_mid, "inflow")
+        outflow = fd_values(fd_windows, ts, t_mid, "outflow")
+        rho = np.repeat(rho0[batch, None], n_space * n_split, axis=1).astype(float)
+        batch_density, batch_flow = _simulate(rho, inflow, outflow, vf, rho_c, deltaX / n_split,
+                                              deltaT, n_sub, n_split)
+        # Time cells inside each window, to their rows
+        inside = np.arange(n_time_max)[None, :] < n_time[batch, None]
+        rows = (offsets[batch, None] + np.arange(n_time_max)[None, :])[inside]
+        density[rows] = batch_density[inside]
+        flow[rows] = batch_flow[inside]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(density > 0, flow / density, np.nan)
+    return dict(density=density, flow=flow, speed=speed, num_time=n_time, offsets=offsets,
+                deltaX=deltaX, deltaT=deltaT)
+
+
+def window_cells(estimate, i, measure="density"):
+    """
+    Cells (num_time, n_space) of the window i of ctm_estimate.
+    """
+    offsets = estimate["offsets"]
+    return estimate[measure][offsets[i]:offsets[i + 1]]
+
+
+def estimate_catalog(catalog, fd_windows, **kwargs):
+    """
+    CTM estimate of every experiment of the catalog (the window [t_min, t_max] of each probe run).
+    """
+    windows = catalog[["t_min", "t_max"]].to_numpy(dtype=float)
+    return ctm_estimate(windows, fd_windows, **kwargs)
+
+
+def estimate_errors(estimate, cells):
+    """
+    RMSE of the estimated density [veh/km] and flow [veh/hr] of each window against
+    the ground truth of edie_cells over the same windows.
+    """
+    truth = edie_measures(cells)
+    num_time = estimate["num_time"]
+    # The cells of edie_cells inside the windows, in the rows of the estimate
+    inside = np.arange(truth["density"].shape[1])[None, :] < num_time[:, None]
+    window = np.repeat(np.arange(len(num_time)), num_time)
+    n = np.maximum(num_time * estimate["density"].shape[1], 1)
+    rmse = {}
+    for measure in ("density", "flow"):
+        err = ((estimate[measure] - truth[measure][inside]) ** 2).sum(axis=1)
+        rmse[measure] = np.sqrt(np.bincount(window, weights=err, minlength=len(num_time)) / n)
+    return rmse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cell-transmission estimate of all the experiments of a catalog.")
+    parser.add_argument("--catalog", default=f"exp/{CATALOG_FILE}", help="Experiment catalog")
+    parser.add_argument("--fd-dir", default=FD_DIR, help="Directory of the fd-{ts}sec.feather files")
+    parser.add_argument("--ts", type=int, default=LINK_PARAMS["DELTAT"], help="FD-timestep of the boundary flows")
+    parser.add_argument("--detect", default=None, help="detect.feather of the link, to compare with Edie's measures")
+    parser.add_argument("--out", default="ctm-estimate.npz", help="Estimated density, flow and speed of every experiment")
+    args = parser.parse_args()
+
+    catalog = pd.read_feather(args.catalog)
+    print(f"\n[X] Estimating {len(catalog)} experiments ...", end=" ")
+    estimate = estimate_catalog(catalog, FDWindows(fd_dir=args.fd_dir), ts=args.ts)
+    np.savez_compressed(args.out, probe_id=catalog["probe_id"].to_numpy(dtype=str),
+                        **{key: estimate[key] for key in ("density", "flow", "speed", "num_time", "offsets")})
+    print("Done!")
+
+    if args.detect:
+        cells = edie_cells(pd.read_feather(args.detect), catalog[["t_min", "t_max"]].to_numpy(dtype=float),
+                           estimate["deltaX"], estimate["deltaT"], [0, LINK_PARAMS["ROAD_LENGTH"] / 1000])
+        rmse = estimate_errors(estimate, cells)
+        print("\nMEAN RMSE OVER THE EXPERIMENTS")
+        print("Density [veh/km]:", np.mean(rmse["density"]))
+        print("Flow    [veh/hr]:", np.mean(rmse["flow"]))
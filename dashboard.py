@@ -1,10 +1,15 @@
 import streamlit as st 
 import json
 import os
+import math
 import pandas as pd 
 
-from fd_data import plotlyfromjson
-from fcd_data import plot_contineous_traj, create_space_time_grid
+from fcd_data import CATALOG_FILE, read_links_params
+from dashboard_cache import (load_catalog, load_fd_figure, load_traj_figure, load_raster_figure,
+                             fd_plot_path, raster_path)
+
+# Number of experiments per page of the catalog
+PAGE_SIZE = 50
 
 def page_configuration() -> None:
     # Configure the page
@@ -21,36 +26,109 @@ def page_configuration() -> None:
 
 def fd_analysis(link) -> None:
 
-    # Show FD plot
-    fd_plot_path = f"data/{link}/fd_plot-{link}.json"
-    st.plotly_chart(plotlyfromjson(fd_plot_path))
+    # Show FD plot (cached across reruns, see dashboard_cache)
+    if not os.path.exists(fd_plot_path(link)):
+        st.info(f"No FD plot for {link} (see fd_data.py).")
+        return
+    st.plotly_chart(load_fd_figure(link))
+
+
+def day_overview(link):
+    """
+    Full-day space-time heatmap of the link. The time window chosen here also filters
+    the experiments below. Returns the window [hr] (None without a raster).
+    """
+    if not os.path.exists(raster_path(link)):
+        st.info(f"No full-day raster for {link} (see the raster stage of pipeline.py).")
+        return None
+    col1, col2 = st.columns([1, 3])
+    measure = col1.selectbox("Measure: ", ("speed", "density"))
+    window = col2.slider("Time window [hr]: ", 0.0, 24.0, (0.0, 24.0), step=0.25)
+    st.plotly_chart(load_raster_figure(link, measure, window), use_container_width=True)
+    return window
+
+
+def missing_experiments(main_folder, catalog):
+    """
+    Catalog rows (without measures) of the experiment folders that are not in the catalog.
+    """
+    listed = set(catalog.loc[catalog["format"] == "csv", "path"].astype(str))
+    missing = sorted(exp for exp in os.listdir(main_folder)
+                     if os.path.isdir(os.path.join(main_folder, exp)) and exp not in listed)
+    return pd.DataFrame({"probe_id": missing, "format": "csv", "path": missing})
+
+
+def select_experiment(main_folder, window=None):
+    """
+    Select an experiment. With a catalog the experiments are filtered, sorted and paged
+    from it, followed by the experiment folders missing from it (they have no measures and
+    pass every filter); otherwise every experiment folder is listed.
+    window: only the experiments inside this time window [hr] (from day_overview).
+    Returns the experiment name and its catalog row (None without a catalog).
+    """
+    catalog_path = os.path.join(main_folder, CATALOG_FILE)
+    if not os.path.exists(catalog_path):
+        ## List out the exp
+        exp_list = [exp for exp in os.listdir(main_folder) if os.path.isdir(os.path.join(main_folder, exp))]
+        exp_name = st.selectbox("Select Experiment: ",
+                        exp_list,
+                        accept_new_options=False)
+        return exp_name, None
+
+    catalog = load_catalog(catalog_path)
+    missing = missing_experiments(main_folder, catalog)
+    if not missing.empty:
+        st.caption(f"{len(missing)} experiment folders are not in the catalog, they are listed last.")
+    col1, col2, col3 = st.columns(3)
+    hours = col1.slider("Hour of the day: ", 0, 24, (0, 24))
+    min_veh = col2.number_input("Min. detected vehicles: ", min_value=0, value=0)
+    sort_by = col3.selectbox("Sort by: ", ("t_min", "n_detected_veh", "mean_speed", "n_detect", "probe_id"))
+
+    ## Filter and sort the catalog
+    mask = (catalog["hour"] >= hours[0]) & (catalog["hour"] < hours[1]) & (catalog["n_detected_veh"] >= min_veh)
+    if window is not None:
+        mask &= (catalog["t_min"] >= window[0]) & (catalog["t_max"] <= window[1])
+    filtered = catalog[mask].sort_values(sort_by, key=(lambda ids: ids.astype(str)) if sort_by == "probe_id" else None)
+    if not missing.empty:
+        filtered = pd.concat([filtered, missing], ignore_index=True)[catalog.columns]
+    if filtered.empty:
+        st.warning("No experiment matches the filters.")
+        return None, None
+
+    ## Page of the catalog
+    n_pages = math.ceil(len(filtered) / PAGE_SIZE)
+    page = st.number_input(f"Page (of {n_pages}): ", min_value=1, max_value=n_pages, value=1)
+    page_df = filtered.iloc[(page - 1) * PAGE_SIZE: page * PAGE_SIZE]
+    st.dataframe(page_df, hide_index=True)
 
+    exp_name = st.selectbox("Select Experiment: ",
+                    page_df["probe_id"].to_list(),
+                    accept_new_options=False)
+    return exp_name, page_df.set_index("probe_id").loc[exp_name]
 
-def fcd_trajectories(link):
 
-    main_folder = f"data/{link}/exp/"
+def fcd_trajectories(link, window=None):
 
-    ## List out the exp
-    exp_list = [exp for exp in os.listdir(main_folder)]
-    exp_name = st.selectbox("Select Experiment: ",
-                    exp_list,
-                    accept_new_options=False)
+    # Discritization of the link (LinkParams.json: DELTAX [m], DELTAT [s])
+    link_params = read_links_params().get(link)
+    if link_params is None:
+        st.warning(f"{link} is not configured in LinkParams.json.")
+        return
+    deltaX, deltaT = link_params["DELTAX"]/1000, link_params["DELTAT"]/3600
 
-    ## Probe and FCD
-    exp_folder = os.path.join(main_folder, exp_name)
-    probe = pd.read_csv(os.path.join(exp_folder, "ProbeTraj.csv"), sep=";", decimal=",", index_col=0)
-    traj = pd.read_csv(os.path.join(exp_folder,  "DetectTraj.csv"), sep=";", decimal=",", index_col=0)
-
-
-    # Discritization
-    delta_params = {"Link-1": {"DELTAX": 0.086, "DELTAT": 3/3600}, 
-                    "Link-2": {"DELTAX": 0.052, "DELTAT": 3/3600}, 
-                    "Link-3": {"DELTAX": 0.043, "DELTAT": 2/3600}, 
-    }
-    grid = create_space_time_grid(delta_params[link]["DELTAX"], delta_params[link]["DELTAT"], 
-                                 road_space=[0, 0.4],
-                                 time_space=[probe["time"].min(), probe["time"].max()])
-    actual_traj = plot_contineous_traj(probe, traj, grid, camView=True, probeViewDistance=[0, 0.140])
+    main_folder = f"data/{link}/exp/"
+    if not os.path.isdir(main_folder):
+        st.info(f"No experiments for {link} (see pipeline.py --links).")
+        return
+    exp_name, entry = select_experiment(main_folder, window)
+    if exp_name is None:
+        return
+    fast = st.checkbox("Fast rendering (WebGL, downsampled trajectories)", value=True)
+    ## Probe and FCD, grid and figure are cached across reruns (see dashboard_cache)
+    fmt, path = ("csv", exp_name) if entry is None else (entry["format"], entry["path"])
+    actual_traj = load_traj_figure(main_folder, exp_name, fmt, path,
+                                   deltaX, deltaT,
+                                   road_space=[0, 0.4], probeViewDistance=[0, 0.140], fast=fast)
     st.plotly_chart(actual_traj, use_container_width=True)
 
 
@@ -84,7 +162,8 @@ def main() -> None:
                         accept_new_options=False)
 
     fd_analysis(link)
-    fcd_trajectories(link)
+    window = day_overview(link)
+    fcd_trajectories(link, window)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+import plotly.graph_objects as go
+
+from raster import load_raster, raster_image, raster_file
+from fd_data import plotlyfromjson, load_fd_plot, fd_plot_json_to_cache
+from fcd_data import plot_contineous_traj, create_space_time_grid, read_catalog, read_experiment
+
+# Number of entries kept in each cache
+CACHE_SIZE = 32
+
+
+class LRUCache:
+    """
+    BOUNDED LEAST-RECENTLY-USED CACHE, INVALIDATED WHEN ITS SOURCE FILES CHANGE.
+    The caches live in this module, which Streamlit imports only once, so they survive the
+    reruns of the dashboard script (its own globals do not). Every entry keeps the size and
+    mtime of the files it was built from, and is rebuilt as soon as one of them changed.
+    """
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Streamlit runs each session in its own thread
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(paths):
+        stamp = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stamp.append((path, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append((path, None, None))
+        return tuple(stamp)
+
+    def get(self, key, paths, build):
+        """
+        Value of the key, built with build() if it is missing or one of paths changed.
+        """
+        stamp = self._stamp(paths)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                return entry[1]
+        value = build()
+        with self.lock:
+            self.entries[key] = (stamp, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+## Caches of the dashboard
+CATALOGS = LRUCache(8)
+EXPERIMENTS = LRUCache()
+GRIDS = LRUCache()
+FIGURES = LRUCache()
+RASTERS = LRUCache(4)
+
+
+def load_catalog(catalog_path):
+    """
+    Experiment catalog of a link.
+    """
+    return CATALOGS.get(catalog_path, [catalog_path], lambda: read_catalog(catalog_path))
+
+
+def fd_plot_path(link):
+    return f"data/{link}/fd_plot-{link}.json"
+
+
+def load_fd_figure(link):
+    """
+    FD plot of a link, from its binary cache. The cache is written from the JSON on the
+    first load, and again whenever the JSON is newer.
+    """
+    json_path = fd_plot_path(link)
+    fd_cache_path = f"data/{link}/fd_plot-{link}.feather"
+
+    def build():
+        if os.path.exists(json_path) and (not os.path.exists(fd_cache_path)
+                                          or os.path.getmtime(json_path) > os.path.getmtime(fd_cache_path)):
+            try:
+                fd_plot_json_to_cache(json_path, fd_cache_path)
+            except OSError:
+                # Read-only data folder: the figure comes from the JSON
+                return plotlyfromjson(json_path)
+        return load_fd_plot(fd_cache_path)
+
+    return FIGURES.get(("fd", link), [fd_cache_path, json_path], build)
+
+
+def _experiment_paths(main_folder, exp_name, fmt, path):
+    if fmt == "store":
+        store_dir = os.path.join(main_folder, path)
+        return [os.path.join(store_dir, name) for name in ("manifest.feather", "probe.feather", "detect.feather")]
+    exp_folder = os.path.join(main_folder, path)
+    return [os.path.join(exp_folder, "ProbeTraj.csv"), os.path.join(exp_folder, "DetectTraj.csv")]
+
+
+def load_experiment(main_folder, exp_name, fmt="csv", path=None):
+    """
+    Probe and detected trajectories of one experiment (CSV folder or columnar store).
+    """
+    path = exp_name if path is None else path
+    paths = _experiment_paths(main_folder, exp_name, fmt, path)
+
+    def build():
+        if fmt == "store":
+            exp = read_experiment(os.path.join(main_folder, path), exp_name)
+            return exp["probe"], exp["detect"]
+        probe = pd.read_csv(paths[0], sep=";", decimal=",", index_col=0)
+        traj = pd.read_csv(paths[1], sep=";", decimal=",", index_col=0)
+        return probe, traj
+
+    return EXPERIMENTS.get((main_folder, exp_name, fmt, path), paths, build)
+
+
+def load_grid(deltaX, deltaT, road_space, time_space):
+    """
+    Space-time grid of create_space_time_grid.
+    """
+    key = (deltaX, deltaT, tuple(road_space), tuple(time_space))
+    return GRIDS.get(key, [], lambda: create_space_time_grid(deltaX, deltaT, road_space, time_space))
+
+
+def load_traj_figure(main_folder, exp_name, fmt, path, deltaX, deltaT, road_space, probeViewDistance, fast):
+    """
+    Space-time plot of one experiment (see plot_contineous_traj).
+    """
+    path = exp_name if path is None else path
+    paths = _experiment_paths(main_folder, exp_name, fmt, path)
+
+    def build():
+        probe, traj = load_experiment(main_folder, exp_name, fmt, path)
+        grid = load_grid(deltaX, deltaT, road_space, [probe["time"].min(), probe["time"].max()])
+        return plot_contineous_traj(probe, traj, grid, camView=True, probeViewDistance=probeViewDistance, fast=fast)
+
+    key = ("traj", main_folder, exp_name, fmt, path, deltaX, deltaT, tuple(road_space),
+           tuple(probeViewDistance), fast)
+    return FIGURES.get(key, paths, build)
+
+
+def raster_path(link):
+    return raster_file(link)
+
+
+def load_raster_figure(link, measure, t_range):
+    """
+    Full-day space-time heatmap of the link, at the raster level that fits t_range [hr].
+    """
+    path = raster_path(link)
+
+    def build():
+        raster = RASTERS.get(link, [path], lambda: load_raster(path))
+        time, pos, image, level = raster_image(raster, measure, t_range)
+        title = "Mean speed [km/hr]" if measure == "speed" else "Density [veh/km]"
+        fig = go.Figure(go.Heatmap(x=time, y=pos, z=image, colorscale="RdYlGn",
+                                   reversescale=measure == "density", colorbar=dict(title=title),
+                                   hovertemplate="Time: %{x:.3f} hr<br>Pos: %{y:.3f} km<br>%{z:.1f}<extra></extra>"))
+        fig.update_xaxes(title_text="Time [hr]", range=list(t_range))
+        fig.update_yaxes(title_text="Space [km]")
+        fig.update_layout(title=f"{title}, {raster['dt'] * 3600 * 2**level:.0f} s bins", title_x=0.5,
+                          margin={"r":10,"t":40,"l":10,"b":0})
+        return fig
+
+    return FIGURES.get(("raster", link, measure, tuple(t_range)), [path], build)
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+## Largest time gap [hr] between two rows of a vehicle that is still one trajectory segment
+MAX_GAP = 5/3600
+# Number of probe windows aggregated together (bounds the memory of one pass)
+WINDOW_BATCH = 256
+
+
+def _ranges(counts):
+    """
+    0, 1, ..., n-1 for each n in counts, concatenated.
+    """
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+
+def num_space_cells(deltaX, road_space):
+    """
+    Number of space cells of create_space_time_grid for the road.
+    """
+    n1 = len(np.arange(road_space[0], road_space[1], deltaX))
+    n2 = len(np.arange(road_space[0]+deltaX, road_space[1]+deltaX, deltaX))
+    if n1 != n2:
+        n1 = len(np.arange(road_space[0], road_space[1]+deltaX, deltaX))
+    return n1
+
+
+def num_time_cells(deltaT, t_start, t_end):
+    """
+    Number of time cells of create_space_time_grid for each window [t_start, t_end]
+    (the same arithmetic as np.arange, without the last cell).
+    """
+    n = np.ceil((np.asarray(t_end, dtype=float) - np.asarray(t_start, dtype=float)) / deltaT)
+    return np.maximum(n.astype(np.int64) - 1, 0)
+
+
+def trajectory_segments(traj, max_gap=MAX_GAP):
+    """
+    STRAIGHT SEGMENTS BETWEEN CONSECUTIVE ROWS OF EACH VEHICLE.
+    Rows further apart than max_gap [hr] are not joined.
+    Returns the arrays (t_a, x_a, t_b, x_b), sorted by t_a.
+    """
+    codes, _ = pd.factorize(traj["id"])
+    time = traj["time"].to_numpy(dtype=float)
+    pos = traj["pos"].to_numpy(dtype=float)
+    order = np.lexsort((time, codes))
+    codes, time, pos = codes[order], time[order], pos[order]
+
+    dt = time[1:] - time[:-1]
+    keep = (codes[1:] == codes[:-1]) & (dt > 0) & (dt <= max_gap)
+    t_a, x_a = time[:-1][keep], pos[:-1][keep]
+    t_b, x_b = time[1:][keep], pos[1:][keep]
+    order = np.argsort(t_a, kind="stable")
+    return t_a[order], x_a[order], t_b[order], x_b[order]
+
+
+def _aggregate(segments, t_start, n_time, n_time_max, x0, n_space, deltaX, deltaT):
+    """
+    Total distance and time of the segments in the cells of each window, as flat arrays
+    of shape (n_windows * n_time_max * n_space,).
+    Each segment is cut where it crosses a cell edge; every piece lands in one cell.
+    """
+    t_a, x_a, t_b, x_b = segments
+    n_windows = len(t_start)
+    size = n_windows * n_time_max * n_space
+    if len(t_a) == 0 or n_windows == 0:
+        return np.zeros(size), np.zeros(size)
+
+    ## Segments overlapping each window (sorted by t_a, at most max_dur long)
+    t_end = t_start + n_time * deltaT
+    max_dur = (t_b - t_a).max()
+    lo = np.searchsorted(t_a, t_start - max_dur, side="left")
+    hi = np.searchsorted(t_a, t_end, side="left")
+    counts = hi - lo
+    win = np.repeat(np.arange(n_windows), counts)
+    seg = np.repeat(lo, counts) + _ranges(counts)
+
+    ## Segment ends in cell units of its window
+    ua = (t_a[seg] - t_start[win]) / deltaT
+    ub = (t_b[seg] - t_start[win]) / deltaT
+    wa = (x_a[seg] - x0) / deltaX
+    wb = (x_b[seg] - x0) / deltaX
+
+    ## Where the segment crosses a time edge or a space edge, as a fraction of the segment
+    n_cross = (np.floor(ub) - np.floor(ua)).astype(np.int64)
+    pair_t = np.repeat(np.arange(len(seg)), n_cross)
+    edge_t = np.floor(ua)[pair_t] + 1 + _ranges(n_cross)
+    s_t = (edge_t - ua[pair_t]) / (ub - ua)[pair_t]
+
+    w_lo, w_hi = np.minimum(wa, wb), np.maximum(wa, wb)
+    n_cross = (np.floor(w_hi) - np.floor(w_lo)).astype(np.int64)
+    pair_x = np.repeat(np.arange(len(seg)), n_cross)
+    edge_x = np.floor(w_lo)[pair_x] + 1 + _ranges(n_cross)
+    s_x = (edge_x - wa[pair_x]) / (wb - wa)[pair_x]
+
+    ## Pieces between consecutive cut points of each segment
+    pair = np.concatenate([np.arange(len(seg)), np.arange(len(seg)), pair_t, pair_x])
+    cut = np.concatenate([np.zeros(len(seg)), np.ones(len(seg)), s_t, s_x])
+    order = np.lexsort((cut, pair))
+    pair, cut = pair[order], cut[order]
+    same = pair[1:] == pair[:-1]
+    pair, s0, s1 = pair[:-1][same], cut[:-1][same], cut[1:][same]
+    s_mid = (s0 + s1) / 2
+    ds = s1 - s0
+
+    ## Cell of each piece from its midpoint
+    it = np.floor(ua[pair] + s_mid * (ub - ua)[pair]).astype(np.int64)
+    ix = np.floor(wa[pair] + s_mid * (wb - wa)[pair]).astype(np.int64)
+    w = win[pair]
+    valid = (it >= 0) & (it < n_time[w]) & (ix >= 0) & (ix < n_space) & (ds > 0)
+    cell = (w[valid] * n_time_max + it[valid]) * n_space + ix[valid]
+
+    seg = seg[pair[valid]]
+    distance = ds[valid] * np.abs(x_b[seg] - x_a[seg])
+    time = ds[valid] * (t_b[seg] - t_a[seg])
+    return (np.bincount(cell, weights=distance, minlength=size),
+            np.bincount(cell, weights=time, minlength=size))
+
+
+def edie_cells(traj, windows, deltaX, deltaT, road_space, max_gap=MAX_GAP):
+    """
+    EDIE'S TOTAL DISTANCE AND TOTAL TIME IN THE SPACE-TIME CELLS OF MANY PROBE WINDOWS.
+    traj: trajectories (id, time [hr], pos [km]), e.g. the detected vehicles of the link.
+    windows: array of [t_start, t_end] [hr] per probe run; each window gets the cells of
+             create_space_time_grid(deltaX, deltaT, road_space, [t_start, t_end]).
+
+    Returns dict with
+        distance: total distance [km] travelled in each cell, shape (n_windows, n_time_max, n_space)
+        time: total time [hr] spent in each cell, same shape
+        num_time: number of time cells of each window (the cells after it are zero)
+    """
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2)
+    t_start = windows[:, 0]
+    n_time = num_time_cells(deltaT, windows[:, 0], windows[:, 1])
+    n_space = num_space_cells(deltaX, road_space)
+    n_time_max = int(n_time.max()) if len(n_time) else 0
+
+    segments = trajectory_segments(traj, max_gap)
+    distance = np.zeros((len(windows), n_time_max, n_space))
+    time = np.zeros((len(windows), n_time_max, n_space))
+    for start in range(0, len(windows), WINDOW_BATCH):
+        stop = min(start + WINDOW_BATCH, len(windows))
+        d, t = _aggregate(segments, t_start[start:stop], n_time[start:stop], n_time_max,
+                          road_space[0], n_space, deltaX, deltaT)
+        distance[start:stop] = d.reshape(stop - start, n_time_max, n_space)
+        time[start:stop] = t.reshape(stop - start, n_time_max, n_space)
+
+    return dict(distance=distance, time=time, num_time=n_time,
+                deltaX=deltaX, deltaT=deltaT)
+
+
+def edie_grid(traj, grid, max_gap=MAX_GAP):
+    """
+    EDIE'S TOTAL DISTANCE AND TOTAL TIME IN THE CELLS OF ONE create_space_time_grid GRID.
+    Returns dict with distance and time of shape (num_time, num_space).
+    """
+    cells = edie_cells(traj, [grid["total_time"]], grid["deltaX"], grid["deltaT"],
+                       grid["road_length"], max_gap)
+    return dict(distance=cells["distance"][0], time=cells["time"][0],
+                num_time=grid["num_time"], deltaX=grid["deltaX"], deltaT=grid["deltaT"])
+
+
+def edie_measures(cells):
+    """
+    DENSITY [veh/km], FLOW [veh/hr] AND SPEED [km/hr] OF EACH CELL (Edie's generalized definitions).
+    The speed is NaN in the cells without vehicles.
+    """
+    area = cells["deltaX"] * cells["deltaT"]
+    density = cells["time"] / area
+    flow = cells["distance"] / area
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(cells["time"] > 0, cells["distance"] / cells["time"], np.nan)
+    return dict(density=density, flow=flow, speed=speed)
@@ -4,8 +4,24 @@ import os
 from tqdm import tqdm
 import json
 import plotly.express as px
+import plotly.graph_objects as go
 import numpy as np 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather
 import math
+import re
+import gzip
+import zlib
+import tempfile
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pandas.api.types import union_categoricals
+from urllib.parse import quote
+from time import monotonic, sleep
+
+import metrics
+from raster import rasterize, save_raster, raster_file
 
 ## Import the Link parameter file
 param_file = "LinkParams.json"
@@ -13,65 +29,425 @@ with open(param_file) as f:
     LINK_PARAMS = json.load(f)
 
 
-def parse_xml(xml_path):
+## Columns of the FCD dataframe
+FCD_COLUMNS = ["time", "id", "x", "y", "angle", "type", "speed", "pos", "lane", "slope"]
+# Vehicle attributes parsed as float (NaN if missing)
+FCD_FLOAT_COLUMNS = ["x", "y", "angle", "speed", "pos", "slope"]
+# Vehicle attributes kept as string (None if missing)
+FCD_STR_COLUMNS = ["id", "type", "lane"]
+# Arrow schema of the FCD dataframe when written to feather
+FCD_SCHEMA = pa.schema([("time", pa.float64()), ("id", pa.string()),
+                        ("x", pa.float64()), ("y", pa.float64()), ("angle", pa.float64()),
+                        ("type", pa.string()), ("speed", pa.float64()), ("pos", pa.float64()),
+                        ("lane", pa.string()), ("slope", pa.float64())])
+# Compact schema: dictionary-encoded strings and float32 measurements, time at full precision
+FCD_COMPACT_SCHEMA = pa.schema([(field.name, pa.dictionary(pa.int32(), pa.string()))
+                                if field.name in FCD_STR_COLUMNS else
+                                (field.name, pa.float32()) if field.name in FCD_FLOAT_COLUMNS else field
+                                for field in FCD_SCHEMA])
+# Number of rows in each streamed batch
+CHUNK_SIZE = 500_000
+
+## FD data used for the inflow and outflow of the experiments
+FD_DIR = "sumo_ingolstadt/simulation/output/ABESEC/"
+FD_TIMESTEPS = [2, 3, 4, 5, 6, 7, 8]
+# Columnar store of the experiments
+EXP_STORE_DIR = "exp_store/"
+# Catalog of the experiments, next to the experiment folders (or in the store)
+CATALOG_FILE = "catalog.feather"
+# Probe ids of every sample of a penetration rate x seed sweep (see sweep_expData)
+SWEEP_FILE = "sweep.feather"
+CATALOG_COLUMNS = ["probe_id", "t_min", "t_max", "hour", "n_probe", "n_detect",
+                   "n_detected_veh", "mean_speed", "format", "path", "partial"]
+# Points kept of each trajectory in the fast space-time plot
+TRAJ_MAX_POINTS = 200
+
+
+class _FcdBuffer:
     """
-    READ THE XML FILES FOR FCD.
+    FIXED-SIZE TYPED COLUMN BUFFERS FOR THE FCD ROWS.
+    Rows are filled one by one and flushed as a DataFrame once the buffer is full.
     """
-    # Parse the XML data
-    print("\n[X] Reading file ...", end=" ")
-    root = ET.parse(xml_path)
-    # Data extracted from the xml 
-    data = []
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.time = np.empty(chunk_size, dtype=np.float64)
+        self.floats = {col: np.empty(chunk_size, dtype=np.float64) for col in FCD_FLOAT_COLUMNS}
+        self.strings = {col: np.empty(chunk_size, dtype=object) for col in FCD_STR_COLUMNS}
+        self.n = 0
+
+    def append(self, time, vehicle):
+        n = self.n
+        self.time[n] = time
+        for col, values in self.floats.items():
+            values[n] = float(vehicle.get(col, float('nan')))
+        for col, values in self.strings.items():
+            values[n] = vehicle.get(col)
+        self.n += 1
+
+    def append_empty(self, time):
+        # Placeholder row for the timesteps without any vehicle
+        n = self.n
+        self.time[n] = time
+        for values in self.floats.values():
+            values[n] = float('nan')
+        for values in self.strings.values():
+            values[n] = None
+        self.n += 1
+
+    def full(self):
+        return self.n >= self.chunk_size
+
+    def flush(self):
+        n = self.n
+        data = {'time': self.time[:n].copy()}
+        data.update({col: values[:n].copy() for col, values in self.floats.items()})
+        data.update({col: values[:n].copy() for col, values in self.strings.items()})
+        self.n = 0
+        return pd.DataFrame(data, columns=FCD_COLUMNS)
+
+
+def compact_fcd(fcd, categories=None):
+    """
+    COMPACT TYPED SCHEMA FOR THE FCD DATAFRAME.
+    id, type and lane become categoricals and the measurements float32; time is kept as float64.
 
-    # Loop for all timesteps in the xml
-    for timestep in root.findall('timestep'):
-        time = float(timestep.get('time'))
-        vehicles = timestep.findall('vehicle')
+    categories: optional dict {column: pd.Index} shared across batches. New values are appended
+    at the end, so the categories of a later batch always extend the ones of the earlier batches.
+    """
+    for col in FCD_STR_COLUMNS:
+        if categories is None:
+            fcd[col] = fcd[col].astype("category")
+            continue
+        known = categories.get(col, pd.Index([], dtype=object))
+        uniques = pd.Index(pd.unique(fcd[col].dropna()))
+        categories[col] = known.append(uniques[~uniques.isin(known)])
+        fcd[col] = pd.Categorical(fcd[col], categories=categories[col])
+    for col in FCD_FLOAT_COLUMNS:
+        fcd[col] = fcd[col].astype(np.float32)
+    return fcd
+
+
+def _concat_batches(frames, ignore_index=True):
+    """
+    Concatenate FCD batches, keeping the categorical columns categorical.
+    """
+    if not frames:
+        return pd.DataFrame(columns=FCD_COLUMNS)
+    df = pd.concat(frames, ignore_index=ignore_index)
+    for col in FCD_STR_COLUMNS:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            df[col] = union_categoricals([frame[col] for frame in frames])
+    return df
 
+
+def _iter_batches(events, chunk_size, compact=False):
+    """
+    Turn the (event, element) pairs of an incremental XML parse into DataFrame batches.
+    Each <timestep> is cleared from the tree once its vehicles are in the buffer.
+    A ("flush", None) event yields the rows buffered so far as a (smaller) batch.
+    """
+    buffer = _FcdBuffer(chunk_size)
+    flush = buffer.flush
+    if compact:
+        categories = {}
+        flush = lambda: compact_fcd(buffer.flush(), categories)
+    root = None
+    for event, elem in events:
+        if event == "flush":
+            if buffer.n:
+                yield flush()
+            continue
+        # First event is the start of the root element
+        if root is None:
+            root = elem
+            continue
+        if event != "end" or elem.tag != "timestep":
+            continue
+
+        time = float(elem.get('time'))
+        vehicles = elem.findall('vehicle')
         if vehicles:
             for vehicle in vehicles:
-                vehicle_data = {
-                    'time': time,
-                    'id': vehicle.get('id'),
-                    'x': float(vehicle.get('x', float('nan'))),
-                    'y': float(vehicle.get('y', float('nan'))),
-                    'angle': float(vehicle.get('angle', float('nan'))),
-                    'type': vehicle.get('type'),
-                    'speed': float(vehicle.get('speed', float('nan'))),
-                    'pos': float(vehicle.get('pos', float('nan'))),
-                    'lane': vehicle.get('lane'),
-                    'slope': float(vehicle.get('slope', float('nan')))
-                }
-                data.append(vehicle_data)
+                buffer.append(time, vehicle)
+                if buffer.full():
+                    yield flush()
         else:
-            data.append({
-                'time': time,
-                'id': None,
-                'x': float('nan'),
-                'y': float('nan'),
-                'angle': float('nan'),
-                'type': None,
-                'speed': float('nan'),
-                'pos': float('nan'),
-                'lane': None,
-                'slope': float('nan')
-            })
-
-    # Create DataFrame
-    df = pd.DataFrame(data)
+            buffer.append_empty(time)
+            if buffer.full():
+                yield flush()
+        # Drop the consumed timestep from the tree
+        root.clear()
+
+    if buffer.n:
+        yield flush()
+
+
+def open_xml(xml_path):
+    """
+    Open a SUMO XML output for binary reading, plain or gzipped (.xml.gz).
+    """
+    with open(xml_path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return gzip.open(xml_path, "rb")
+    return open(xml_path, "rb")
+
+
+def iter_xml(xml_path, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    STREAM THE XML FILE FOR FCD AS DATAFRAME BATCHES.
+    Memory depends on the chunk_size and not on the length of the simulation.
+    With compact=True the batches use the compact schema (see compact_fcd).
+    """
+    with open_xml(xml_path) as f:
+        events = ET.iterparse(f, events=("start", "end"))
+        yield from _iter_batches(events, chunk_size, compact)
+
+
+def _follow_events(xml_path, poll_interval=1.0, idle_timeout=60.0, block_size=1 << 20):
+    """
+    Incremental parse events of an XML file that is still being written.
+    New bytes are fed to the parser as they appear and a ("flush", None) event is sent
+    each time the end of the file is reached. Stops at the end of the root element, or
+    after idle_timeout seconds [s] without the file growing.
+    """
+    # Wait for the simulation to create the file
+    last_growth = monotonic()
+    while not os.path.exists(xml_path):
+        if monotonic() - last_growth > idle_timeout:
+            return
+        sleep(poll_interval)
+
+    parser = ET.XMLPullParser(events=("start", "end"))
+    depth = 0
+    with open(xml_path, "rb") as f:
+        last_growth = monotonic()
+        while True:
+            block = f.read(block_size)
+            if block:
+                last_growth = monotonic()
+                parser.feed(block)
+                for event, elem in parser.read_events():
+                    yield event, elem
+                    depth += 1 if event == "start" else -1
+                    # End of the root element: the simulation is done
+                    if depth == 0:
+                        parser.close()
+                        return
+                continue
+            yield "flush", None
+            if monotonic() - last_growth > idle_timeout:
+                return
+            sleep(poll_interval)
+
+
+def follow_xml(xml_path, chunk_size=CHUNK_SIZE, compact=False, poll_interval=1.0, idle_timeout=60.0):
+    """
+    FOLLOW THE XML FILE FOR FCD WHILE SUMO IS STILL WRITING IT.
+    Every complete <timestep> is parsed once; the rows are yielded as micro-batches each
+    time the reader catches up with the end of the file (or the buffer is full).
+    Only plain XML can be followed, not .xml.gz.
+    """
+    events = _follow_events(xml_path, poll_interval, idle_timeout)
+    yield from _iter_batches(events, chunk_size, compact)
+
+
+def _iter_range_events(xml_path, start, end, block_size=1 << 24):
+    """
+    Incremental parse events for the bytes [start, end) of the XML file.
+    The range must hold whole <timestep> elements; it is wrapped in a root element.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parser.feed(b"<fcd-export>")
+    with open_xml(xml_path) as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            parser.feed(block)
+            yield from parser.read_events()
+    parser.feed(b"</fcd-export>")
+    yield from parser.read_events()
+    parser.close()
+
+
+def scan_timesteps(xml_path, block_size=1 << 24):
+    """
+    SCAN THE XML FILE FOR THE BYTE OFFSETS OF EACH <timestep> ELEMENT.
+    Returns the offsets, the simulation time of each timestep and the byte offset
+    where the timesteps end (the closing root tag).
+    For gzipped files the offsets are in the uncompressed stream.
+    """
+    pattern = re.compile(rb'<timestep\b([^>]*)>')
+    time_pattern = re.compile(rb'time="([^"]*)"')
+    offsets = []
+    times = []
+    end = None
+    with open_xml(xml_path) as f:
+        position = 0
+        tail = b""
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            # Keep the end of the previous block to catch tags on the block boundary
+            data = tail + block
+            base = position - len(tail)
+            for match in pattern.finditer(data):
+                offset = base + match.start()
+                if not offsets or offset > offsets[-1]:
+                    offsets.append(offset)
+                    time = time_pattern.search(match.group(1))
+                    times.append(float(time.group(1)) if time else float('nan'))
+            closing = data.rfind(b"</fcd-export>")
+            if closing >= 0:
+                end = base + closing
+            position += len(block)
+            # Cut the tail before an incomplete <timestep tag so it is matched in full
+            cut = data.rfind(b"<", max(len(data) - 64, 0))
+            tail = data[cut:] if cut >= 0 else b""
+    if end is None:
+        end = position
+    return np.array(offsets, dtype=np.int64), np.array(times, dtype=np.float64), end
+
+
+def timestep_index(xml_path):
+    """
+    SIDECAR INDEX OF THE XML FILE: SIMULATION TIME -> BYTE OFFSET OF THE <timestep>.
+    The index is built once with scan_timesteps and saved next to the file as
+    "<xml_path>.tsidx". It is rebuilt when the size or mtime of the file changes.
+    """
+    index_path = f"{xml_path}.tsidx"
+    stat = os.stat(xml_path)
+    source = {b"source_size": str(stat.st_size).encode(), b"source_mtime": str(stat.st_mtime_ns).encode()}
+
+    if os.path.exists(index_path):
+        table = pa.ipc.open_file(index_path).read_all()
+        meta = table.schema.metadata or {}
+        if all(meta.get(key) == value for key, value in source.items()):
+            return (table["time"].to_numpy(), table["offset"].to_numpy(), int(meta[b"end"]))
+
+    print("\n[X] Building timestep index ...", end=" ")
+    offsets, times, end = scan_timesteps(xml_path)
+    table = pa.table({"time": times, "offset": offsets})
+    table = table.replace_schema_metadata({**source, b"end": str(end).encode()})
+    with pa.ipc.new_file(index_path, table.schema) as writer:
+        writer.write_table(table)
     print("Done!")
+    return times, offsets, end
+
+
+def read_fcd(xml_path, t0=None, t1=None, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    READ THE FCD BETWEEN SIMULATION TIMES t0 AND t1 [sec] (BOTH INCLUDED).
+    Uses the timestep index to seek straight to the window instead of parsing the whole file.
+    For gzipped files the seek still decompresses up to the window, but nothing before it is parsed.
+    """
+    times, offsets, end = timestep_index(xml_path)
+    lo = 0 if t0 is None else np.searchsorted(times, t0, side="left")
+    hi = len(times) if t1 is None else np.searchsorted(times, t1, side="right")
+    if lo >= hi:
+        return pd.DataFrame(columns=FCD_COLUMNS)
+
+    start = offsets[lo]
+    stop = offsets[hi] if hi < len(offsets) else end
+    frames = list(_iter_batches(_iter_range_events(xml_path, start, stop), chunk_size, compact))
+    return _concat_batches(frames)
 
-    # Ensure all columns are present, even if no data
-    columns = ["time", "id", "x", "y", "angle", "type", "speed", "pos", "lane", "slope"]
-    for col in columns:
-        if col not in df.columns:
-            df[col] = None
-    # Reorder columns
-    df = df[columns]
+
+def _shard_bounds(offsets, end, n_shards):
+    """
+    Cut the file into roughly equal byte ranges that start at a <timestep>.
+    """
+    targets = offsets[0] + (end - offsets[0]) * np.arange(n_shards) / n_shards
+    # Targets inside the last timestep start at it: fewer shards than asked for
+    starts = np.unique(offsets[np.minimum(np.searchsorted(offsets, targets), len(offsets) - 1)])
+    ends = np.append(starts[1:], end)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _write_batches(path, batches, compact=False):
+    """
+    Write FCD batches to one feather file, dictionary-encoded if compact.
+    """
+    schema = FCD_COMPACT_SCHEMA if compact else FCD_SCHEMA
+    options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    with pa.ipc.new_file(path, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False))
+            yield batch
+
+
+def _parse_shard(xml_path, start, end, part_path, chunk_size, compact):
+    """
+    Worker: parse one byte range of the XML file and write it as a feather part.
+    """
+    batches = _iter_batches(_iter_range_events(xml_path, start, end), chunk_size, compact)
+    for _ in _write_batches(part_path, batches, compact):
+        pass
+    return part_path
+
+
+def parse_xml_parallel(xml_path, workers=None, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    PARSE THE XML FILE FOR FCD IN PARALLEL.
+    The file is split at <timestep> byte offsets and each shard is parsed in its own process.
+    The result is identical to the serial parse_xml.
+    """
+    workers = workers or os.cpu_count()
+    offsets, _, end = scan_timesteps(xml_path)
+    if len(offsets) == 0:
+        return pd.DataFrame(columns=FCD_COLUMNS)
+    shards = _shard_bounds(offsets, end, workers)
+
+    with tempfile.TemporaryDirectory() as part_dir:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            futures = [pool.submit(_parse_shard, xml_path, start, stop,
+                                   os.path.join(part_dir, f"part-{i:05d}.feather"), chunk_size, compact)
+                       for i, (start, stop) in enumerate(shards)]
+            parts = [future.result() for future in futures]
+        # Concatenate the parts in time order
+        table = pa.concat_tables([pa.ipc.open_file(part).read_all() for part in parts])
+        df = table.unify_dictionaries().to_pandas()
 
     return df
 
 
+@metrics.instrument("fcd.parse_xml")
+def parse_xml(xml_path, chunk_size=CHUNK_SIZE, workers=1, compact=False):
+    """
+    READ THE XML FILES FOR FCD.
+    With workers > 1 the file is parsed in parallel with parse_xml_parallel.
+    With compact=True the dataframe uses the compact schema (see compact_fcd).
+    """
+    # Parse the XML data
+    print("\n[X] Reading file ...", end=" ")
+    if workers != 1:
+        df = parse_xml_parallel(xml_path, workers=workers, chunk_size=chunk_size, compact=compact)
+    else:
+        df = _concat_batches(list(iter_xml(xml_path, chunk_size=chunk_size, compact=compact)))
+    print("Done!")
+
+    return df
+
+
+def convert_units(fcd):
+    """
+    UNIT CONVERSION FOR LATER USE
+    """
+    # Convert speed from m/s to km/h
+    fcd['speed'] = fcd['speed'] * 3.6
+    # Convert position from m to km
+    fcd['pos'] = fcd['pos'] / 1000
+    # Convert time from seconds to hours
+    fcd['time'] = fcd['time'] / 3600
+    return fcd
+
+
+@metrics.instrument("fcd.convert_to_feather")
 def convert_to_feather(fcd, xml_path):
     """
     CONVERT THE FD DATA TO USEFUL UNITS.
@@ -85,12 +461,7 @@ def convert_to_feather(fcd, xml_path):
     """
 
     # UNIT CONVERSION FOR LATER USE
-    # Convert speed from m/s to km/h
-    fcd['speed'] = fcd['speed'] * 3.6
-    # Convert position from m to km
-    fcd['pos'] = fcd['pos'] / 1000
-    # Convert time from seconds to hours
-    fcd['time'] = fcd['time'] / 3600
+    fcd = convert_units(fcd)
 
     # LINKS in the FCD
     print("\n", "-"*50)
@@ -108,13 +479,200 @@ def convert_to_feather(fcd, xml_path):
     return fcd
 
 
+@metrics.instrument("fcd.stream_to_feather")
+def stream_to_feather(xml_path, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    STREAM THE XML FILE FOR FCD INTO fcd.feather IN BATCHES.
+    Same output as parse_xml + convert_to_feather, but only one batch is in memory at a time.
+    Returns the path of the feather file.
+    """
+    parent_dir = os.path.abspath(os.path.join(xml_path, os.pardir))
+    output_path = os.path.join(parent_dir, "fcd.feather")
+
+    print("\n[X] Streaming file to feather ...", end=" ")
+    lanes = {}
+    batches = (convert_units(batch) for batch in iter_xml(xml_path, chunk_size=chunk_size, compact=compact))
+    for batch in _write_batches(output_path, batches, compact):
+        lanes.update(dict.fromkeys(batch.lane.unique()))
+        metrics.add_rows(len(batch))
+    print("Done!")
+
+    # LINKS in the FCD
+    print("\n", "-"*50)
+    print("LANE ID:")
+    print(list(lanes))
+    print("-"*50)
+
+    return output_path
+
+
+
+class FcdDatasetWriter:
+    """
+    INCREMENTAL WRITER OF THE LANE/HOUR PARTITIONED FCD DATASET (see write_fcd_dataset).
+    Batches must come in time order. The partitions of an hour are closed, and added to
+    the manifest, as soon as a batch reaches a later hour, so the manifest only ever
+    lists complete partitions while the FCD is still being written.
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        self.writers = {}
+        self.partitions = {}
+        self.n_rows = 0
+        self.hour = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, batch):
+        """
+        Append one DataFrame batch in converted units (time in hours).
+        """
+        if len(batch) == 0:
+            return
+        hours = np.floor(batch["time"].to_numpy()).astype(np.int64)
+        if self.hour is not None and hours.min() < self.hour:
+            raise ValueError(f"FCD batch starts at hour {hours.min()}, after hour {self.hour} was written")
+
+        schema = FCD_COMPACT_SCHEMA if isinstance(batch["lane"].dtype, pd.CategoricalDtype) else FCD_SCHEMA
+        schema = schema.append(pa.field("row", pa.int64()))
+        batch = batch.assign(row=np.arange(self.n_rows, self.n_rows + len(batch), dtype=np.int64))
+        self.n_rows += len(batch)
+
+        groups = batch.groupby([batch["lane"], hours], observed=True, sort=False).indices
+        # Hour by hour, so a batch spanning many hours never holds all their files open
+        closed = False
+        for (lane, hour), positions in sorted(groups.items(), key=lambda item: item[0][1]):
+            closed |= self._close_before(int(hour))
+            part = batch.iloc[positions]
+            key = (lane, int(hour))
+            if key not in self.writers:
+                lane_dir = os.path.join(self.out_dir, quote(lane, safe=""))
+                os.makedirs(lane_dir, exist_ok=True)
+                path = os.path.join(lane_dir, f"hour={hour:02d}.feather")
+                self.writers[key] = pa.ipc.new_file(path, schema, options=self.options)
+                self.partitions[key] = {"lane": lane, "hour": int(hour),
+                                        "path": os.path.relpath(path, self.out_dir), "rows": 0,
+                                        "time_min": float('inf'), "time_max": float('-inf')}
+            self.writers[key].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+            info = self.partitions[key]
+            info["rows"] += len(part)
+            info["time_min"] = min(info["time_min"], float(part["time"].min()))
+            info["time_max"] = max(info["time_max"], float(part["time"].max()))
+
+        # Earlier hours are complete
+        self.hour = int(hours.max())
+        closed |= self._close_before(self.hour)
+        if closed:
+            self.write_manifest()
+
+    def _close_before(self, hour):
+        # Close the partitions of the hours before hour; True if any was closed
+        done = [key for key in self.writers if key[1] < hour]
+        for key in done:
+            self.writers.pop(key).close()
+        return bool(done)
+
+    def manifest(self):
+        closed = [info for key, info in self.partitions.items() if key not in self.writers]
+        return {"rows": self.n_rows,
+                "lanes": list(dict.fromkeys(info["lane"] for info in closed)),
+                "partitions": closed}
+
+    def write_manifest(self):
+        manifest = self.manifest()
+        # Replace the manifest in one step, readers never see a partial file
+        path = os.path.join(self.out_dir, "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(path + ".tmp", path)
+        return manifest
+
+    def close(self):
+        """
+        Close all the partitions and write the final manifest.
+        """
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        return self.write_manifest()
+
+
+def write_fcd_dataset(batches, out_dir):
+    """
+    WRITE THE FCD AS AN ON-DISK DATASET PARTITIONED BY LANE AND SIMULATION HOUR.
+    batches: a DataFrame or an iterable of DataFrame batches in converted units (time in hours).
+
+    Layout: <out_dir>/<lane>/hour=HH.feather (uncompressed, so reads can be memory-mapped)
+    plus <out_dir>/manifest.json with the rows and time range of each partition.
+    Rows without a lane (empty timesteps) are not written. A "row" column keeps the
+    position of each row in the stream, so the reader can return the original order.
+    """
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    writer = FcdDatasetWriter(out_dir)
+    try:
+        for batch in batches:
+            writer.write(batch)
+    finally:
+        manifest = writer.close()
+    return manifest
+
+
+def stream_to_dataset(xml_path, out_dir, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    STREAM THE XML FILE FOR FCD INTO THE LANE/HOUR PARTITIONED DATASET.
+    """
+    print("\n[X] Streaming file to dataset ...", end=" ")
+    batches = (convert_units(batch) for batch in iter_xml(xml_path, chunk_size=chunk_size, compact=compact))
+    manifest = write_fcd_dataset(batches, out_dir)
+    print("Done!")
+    return manifest
+
+
+def read_dataset_manifest(dataset_dir):
+    with open(os.path.join(dataset_dir, "manifest.json")) as f:
+        return json.load(f)
+
+
+def read_fcd_dataset(dataset_dir, lanes=None, t0=None, t1=None):
+    """
+    READ THE FCD FROM THE PARTITIONED DATASET WITH LANE AND TIME [hr] PREDICATES.
+    Only the partitions of the given lanes that overlap [t0, t1] are opened (memory-mapped)
+    and the rows outside [t0, t1] are filtered out as Arrow tables. The selected rows are
+    then sorted back into their original stream order and converted to one DataFrame,
+    which copies them.
+    """
+    manifest = read_dataset_manifest(dataset_dir)
+    selected = [info for info in manifest["partitions"]
+                if (lanes is None or info["lane"] in lanes)
+                and (t0 is None or info["time_max"] >= t0)
+                and (t1 is None or info["time_min"] <= t1)]
+
+    tables = []
+    for info in selected:
+        with pa.memory_map(os.path.join(dataset_dir, info["path"])) as source:
+            table = pa.ipc.open_file(source).read_all()
+        # Partitions that are not fully inside the window are filtered on time
+        if t0 is not None and info["time_min"] < t0:
+            table = table.filter(pc.greater_equal(table["time"], t0))
+        if t1 is not None and info["time_max"] > t1:
+            table = table.filter(pc.less_equal(table["time"], t1))
+        tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=FCD_COLUMNS)
+    table = pa.concat_tables(tables).unify_dictionaries()
+    table = table.take(pc.sort_indices(table["row"]))
+    return table.drop(["row"]).to_pandas()
+
+
 
 def average_vehicle_length(fcd):
     """
     ANALYSIS FOR AVERAGE LENGTH OF DIFFERENT TYPE OF VEHICLE ON THE LINK
     """
     ## EDIT the type of vehicles in the dataset
-    fcd["type_editied"] = fcd.type.apply(lambda x: "_".join(x.split("_")[:-1]) if x is not None else None)
+    fcd["type_editied"] = fcd.type.apply(lambda x: "_".join(x.split("_")[:-1]) if isinstance(x, str) else None)
 
     ## RESULT table
     # Length of each different vehicle
@@ -133,103 +691,739 @@ def average_vehicle_length(fcd):
 
 
 
+@metrics.instrument("fcd.get_detectData")
 def get_detectData(fcd, detectlinks):
     ### DETECTED VEHICLES
-    links = detectlinks.copy()
-    # Filter the data that only for the link
-    mask = (fcd["lane"] == links.pop())
-    for link in links:
-        mask |= (fcd["lane"] == link)
+    # Partitioned dataset: only read the partitions of the links
+    if isinstance(fcd, str):
+        fcd = read_fcd_dataset(fcd, lanes=detectlinks)
+    # Filter the data that only for the link (integer codes for a categorical lane)
+    mask = fcd["lane"].isin(detectlinks)
     carVeh = fcd[mask]
     carVeh = carVeh[carVeh["pos"].notnull()]
     carVeh.reset_index(inplace=True, drop=True)
     return carVeh
 
 
-def get_probeData(fcd, probelinks):
+@metrics.instrument("fcd.get_probeData")
+def get_probeData(fcd, probelinks, pos_max=None):
     ### PROBE VEHICLES
-    links = probelinks.copy()
-    # Filter the data that only for the link
-    mask = (fcd["lane"] == links.pop())
-    for link in links:
-        mask |= (fcd["lane"] == link)
+    # Length of the link [km], the same in every mode (see ProbeRunTracker, extract_links)
+    pos_max = LINK_PARAMS["ROAD_LENGTH"] / 1000 if pos_max is None else pos_max
+    # Partitioned dataset: only read the partitions of the links
+    if isinstance(fcd, str):
+        fcd = read_fcd_dataset(fcd, lanes=probelinks)
+    # Filter the data that only for the link (integer codes for a categorical lane)
+    mask = fcd["lane"].isin(probelinks)
     probeVeh = fcd[mask]
     probeVeh = probeVeh[probeVeh["pos"].notnull()]
     # To make the probe vehicle trajectory start in opposite direction
-    probeVeh["pos"] = fcd['pos'].max() - probeVeh["pos"]
+    probeVeh["pos"] = pos_max - probeVeh["pos"]
     probeVeh.reset_index(inplace=True, drop=True)
     return probeVeh
 
 
-def generate_expData(ids, probeData, carData):
+class FDWindows:
+    """
+    FD FRAMES OF EACH SAMPLING TIMESTEP, LOADED ONCE AND QUERIED BY TIME WINDOW.
+    Each frame is sorted by interval, so the intervals overlapping a window [t0, t1] are
+    found by binary search. Cumulative entered/left sums give the inflow and outflow
+    counts of any window in O(log n).
+    The intervals of one edgeData output (one edge) do not overlap each other.
+    Each frame is read at its first query.
+    """
+    def __init__(self, fd_dir=FD_DIR, timesteps=FD_TIMESTEPS):
+        self.fd_dir = fd_dir
+        self.timesteps = list(timesteps)
+        self.frames = {}
+        self.begin = {}
+        self.end = {}
+        self.cum_entered = {}
+        self.cum_left = {}
+
+    @metrics.timed("fd.load_frame")
+    def _load(self, ts):
+        fd = pd.read_feather(os.path.join(self.fd_dir, f"fd-{ts}sec.feather"))
+        # The searchsorted lookups need intervals that do not overlap: one edge per file
+        if "laneid" in fd and fd["laneid"].nunique() > 1:
+            raise ValueError(f"fd-{ts}sec.feather has several edges {fd['laneid'].unique().tolist()}, "
+                             "convert it with fd_data.convert_fd(edge_id=...)")
+        fd = fd.sort_values("begin-hr", kind="stable")
+        self.frames[ts] = fd
+        self.begin[ts] = fd["begin-hr"].to_numpy()
+        self.end[ts] = fd["end-hr"].to_numpy()
+        self.cum_entered[ts] = np.concatenate([[0], np.cumsum(fd["entered"].to_numpy())])
+        self.cum_left[ts] = np.concatenate([[0], np.cumsum(fd["left"].to_numpy())])
+
+    def frame(self, ts):
+        """
+        FD frame of the timestep, sorted by interval.
+        """
+        if ts not in self.frames:
+            self._load(ts)
+        return self.frames[ts]
+
+    def window(self, ts, t0, t1):
+        """
+        Row range [lo, hi) of the intervals that begin or end inside [t0, t1] [hr].
+        """
+        if ts not in self.frames:
+            self._load(ts)
+        begin, end = self.begin[ts], self.end[ts]
+        # Intervals that begin inside the window
+        a0, a1 = np.searchsorted(begin, t0, side="left"), np.searchsorted(begin, t1, side="right")
+        # Intervals that end inside the window
+        b0, b1 = np.searchsorted(end, t0, side="left"), np.searchsorted(end, t1, side="right")
+        if a0 >= a1:
+            return b0, b1
+        if b0 >= b1:
+            return a0, a1
+        return min(a0, b0), max(a1, b1)
+
+    def overlapping(self, ts, t0, t1):
+        """
+        All FD intervals of the timestep that begin or end inside [t0, t1] [hr].
+        """
+        lo, hi = self.window(ts, t0, t1)
+        return self.frames[ts].iloc[lo:hi]
+
+    def counts(self, ts, t0, t1):
+        """
+        Number of vehicles entered and left in the intervals of the window [t0, t1] [hr].
+        """
+        lo, hi = self.window(ts, t0, t1)
+        entered = self.cum_entered[ts][hi] - self.cum_entered[ts][lo]
+        left = self.cum_left[ts][hi] - self.cum_left[ts][lo]
+        return entered, left
+
+
+def probe_runs(probeData, carData):
+    """
+    SORT-MERGE JOIN OF THE PROBE RUNS AGAINST THE DETECTED VEHICLES.
+    probeData is grouped by id once and carData sorted by time once; the detected window
+    of every run is then found with searchsorted.
+
+    Returns:
+        runs: DataFrame indexed by probe id with min_time, max_time, detect_lo and detect_hi,
+              the row range [detect_lo, detect_hi) of the run in carSorted
+        carSorted: carData sorted by time (carData itself if it is already sorted)
+        positions: dict of probe id -> row positions of the run in probeData
+    """
+    groups = probeData.groupby("id", observed=True, sort=False)
+    positions = groups.indices
+    runs = groups["time"].agg(["min", "max"]).rename(columns={"min": "min_time", "max": "max_time"})
+
+    carSorted = carData
+    if not carData["time"].is_monotonic_increasing:
+        carSorted = carData.iloc[np.argsort(carData["time"].to_numpy(), kind="stable")]
+    car_time = carSorted["time"].to_numpy()
+    runs["detect_lo"] = np.searchsorted(car_time, runs["min_time"].to_numpy(), side="left")
+    runs["detect_hi"] = np.searchsorted(car_time, runs["max_time"].to_numpy(), side="right")
+    return runs, carSorted, positions
+
+
+def iter_probe_runs(ids, probeData, carData, runs=None):
+    """
+    BATCH EXTRACTION OF THE PROBE AND DETECT DATA OF EACH PROBE ID.
+    Yields (idx, probe, detect) where detect is a row-range slice of the time-sorted carData.
+    runs: the result of probe_runs(probeData, carData), if it is already computed.
+    """
+    runs, carSorted, positions = probe_runs(probeData, carData) if runs is None else runs
+    detect_lo = runs["detect_lo"].to_dict()
+    detect_hi = runs["detect_hi"].to_dict()
+    for idx in ids:
+        probe = probeData.iloc[positions[idx]]
+        detect = carSorted.iloc[detect_lo[idx]:detect_hi[idx]]
+        yield idx, probe, detect
+
+
+def is_probe_id(idx, peneration_rate):
+    """
+    Deterministic sampling of a probe id from a hash of the id, for when the full set of
+    ids is not known yet (follow mode).
+    """
+    return zlib.crc32(str(idx).encode()) < peneration_rate * 2**32
+
+
+class ProbeRunTracker:
+    """
+    ONLINE EXTRACTION OF THE PROBE RUNS FROM FCD BATCHES IN TIME ORDER (follow mode).
+    The rows of the probe and detection links are kept as the batches come in. A probe run
+    is complete once its vehicle has not been seen on the probe links for `grace` hours;
+    it is then yielded as (idx, probe, detect), like iter_probe_runs does.
+    The index of probe and detect counts the rows of the links from the start of the
+    stream, the same as get_probeData and get_detectData on the whole FCD.
+    Probe ids are sampled with is_probe_id, since the ids of the later hours are not known.
+    """
+    def __init__(self, detectlinks, probelinks, pos_max=None, peneration_rate=None, grace=1/3600):
+        self.detectlinks = detectlinks
+        self.probelinks = probelinks
+        # Road length [km], as in get_probeData
+        self.pos_max = LINK_PARAMS["ROAD_LENGTH"] / 1000 if pos_max is None else pos_max
+        self.peneration_rate = LINK_PARAMS["PENERATION_RATE"] if peneration_rate is None else peneration_rate
+        self.grace = grace
+        self.detect = None
+        self.n_detect = 0
+        self.n_probe = 0
+        # Open runs: id -> probe batches, first and last time seen
+        self.runs = {}
+        self.first_seen = {}
+        self.last_seen = {}
+        self.sampled = {}
+
+    def push(self, batch):
+        """
+        Add one batch in converted units and yield the probe runs it completes.
+        """
+        if len(batch) == 0:
+            return
+        now = float(batch["time"].max())
+
+        ### DETECTED VEHICLES
+        carVeh = batch[batch["lane"].isin(self.detectlinks) & batch["pos"].notnull()]
+        carVeh.index = pd.RangeIndex(self.n_detect, self.n_detect + len(carVeh))
+        self.n_detect += len(carVeh)
+        frames = [carVeh] if self.detect is None else [self.detect, carVeh]
+        self.detect = _concat_batches(frames, ignore_index=False)
+
+        ### PROBE VEHICLES
+        probeVeh = batch[batch["lane"].isin(self.probelinks) & batch["pos"].notnull()]
+        probeVeh.index = pd.RangeIndex(self.n_probe, self.n_probe + len(probeVeh))
+        self.n_probe += len(probeVeh)
+        probeVeh = probeVeh.assign(pos=self.pos_max - probeVeh["pos"])
+        for idx, positions in probeVeh.groupby("id", observed=True, sort=False).indices.items():
+            if idx not in self.sampled:
+                self.sampled[idx] = is_probe_id(idx, self.peneration_rate)
+            # One run per probe id, as in the batch extraction
+            if not self.sampled[idx]:
+                continue
+            run = probeVeh.iloc[positions]
+            self.runs.setdefault(idx, []).append(run)
+            self.first_seen.setdefault(idx, float(run["time"].iloc[0]))
+            self.last_seen[idx] = float(run["time"].iloc[-1])
+
+        yield from self._complete(now - self.grace)
+        # Detected vehicles before every open run are not needed anymore
+        keep = min(self.first_seen.values(), default=now)
+        self.detect = self.detect[self.detect["time"].to_numpy() >= keep]
+
+    def flush(self):
+        """
+        Yield the runs still open at the end of the simulation.
+        """
+        yield from self._complete(float('inf'))
+
+    def _complete(self, cutoff):
+        ended = [idx for idx, time in self.last_seen.items() if time < cutoff]
+        for idx in ended:
+            probe = _concat_batches(self.runs.pop(idx), ignore_index=False)
+            min_time, max_time = self.first_seen.pop(idx), self.last_seen.pop(idx)
+            # The id does not start a new run
+            self.sampled[idx] = False
+            car_time = self.detect["time"].to_numpy()
+            lo = np.searchsorted(car_time, min_time, side="left")
+            hi = np.searchsorted(car_time, max_time, side="right")
+            yield idx, probe, self.detect.iloc[lo:hi]
+
+
+def write_experiment(output_folder, probe, detect, fd_windows):
+    """
+    WRITE THE DATA OF ONE PROBE RUN TO ITS FOLDER.
+    Returns False, without writing anything, if there are no detected vehicles.
+    Without fd_windows only the probe and detect data are written (e.g. follow mode,
+    before the FD outputs are converted).
+    """
+    # If the length of detection is greater than 1, meaning there are detected vehicles.
+    if len(detect) <= 1:
+        return False
+
+    ##### Inflow and Outflow data for each FD-timestep
+    min_time = probe.time.min()
+    max_time = probe.time.max()
+    inflow = {}
+    outflow = {}
+    for ts in (fd_windows.timesteps if fd_windows is not None else []):
+        df = fd_windows.overlapping(ts, min_time, max_time)
+        inflow[ts]  = df[['begin-hr', 'end-hr','inflow']]
+        outflow[ts] = df[['begin-hr', 'end-hr','outflow']]
+
+    write_experiment_csv(output_folder, probe, detect, inflow, outflow)
+    return True
+
+
+@metrics.timed("exp.write_csv")
+def write_experiment_csv(output_folder, probe, detect, inflow, outflow):
+    """
+    WRITE ONE EXPERIMENT IN THE CSV FOLDER LAYOUT.
+    inflow, outflow: dict of FD-timestep -> dataframe.
+    """
+    os.mkdir(output_folder)
+
+    ########### SAVING DATA ###########
+    # Save the probe data
+    path = os.path.join(output_folder, "ProbeTraj.csv")
+    probe.to_csv(path, sep=";", decimal=",")
+    # Save the detect data
+    path = os.path.join(output_folder, "DetectTraj.csv")
+    detect.to_csv(path, sep=";", decimal=",")
+
+    for ts in inflow:
+        ## Save the files
+        path = os.path.join(output_folder, f"inflow-{ts}sec.csv")
+        inflow[ts].to_csv(path, sep=";", decimal=",")
+        # Save the outflow data
+        path = os.path.join(output_folder, f"outflow-{ts}sec.csv")
+        outflow[ts].to_csv(path, sep=";", decimal=",")
+
+
+def report_experiment(idx, status, n_probe, n_detect):
+    """
+    Print the outcome of one experiment ("written", "exists" or "nodetect"),
+    with the same messages for every way of generating the experiments.
+    """
+    if status == "nodetect":
+        print(f"\nERROR!!! Not detection done on link on {idx}")
+        print("Length of Probe : ", n_probe)
+        print("Length of Detect: ", n_detect)
+    elif status == "exists":
+        print(f"\nProbeID {idx} data already exits")
+
+
+def catalog_row(idx, probe, detect, fmt, path, partial=False):
+    """
+    ONE ROW OF THE EXPERIMENT CATALOG.
+    fmt is "csv" (path is the experiment folder) or "store" (path is the store directory),
+    both relative to the catalog.
+    partial: the experiment was written without the FD inflow and outflow (see is_partial);
+    generate_expData writes it again.
+    """
+    return {"probe_id": idx,
+            "t_min": probe["time"].min(),
+            "t_max": probe["time"].max(),
+            "hour": int(probe["time"].min()),
+            "n_probe": len(probe),
+            "n_detect": len(detect),
+            "n_detected_veh": detect["id"].nunique(),
+            "mean_speed": detect["speed"].mean(),
+            "format": fmt,
+            "path": path,
+            "partial": partial}
+
+
+def update_catalog(catalog_path, rows):
+    """
+    ADD ROWS TO THE EXPERIMENT CATALOG (one row per probe id, the newest row wins).
+    probe_id keeps the type of the ids given to generate_expData (the ids of probeData).
+    """
+    catalog = pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+    if os.path.exists(catalog_path):
+        previous = pd.read_feather(catalog_path)
+        # An empty frame would turn the columns of the previous rows into object
+        catalog = pd.concat([previous, catalog], ignore_index=True) if rows else previous
+        catalog = catalog.drop_duplicates("probe_id", keep="last").reset_index(drop=True)
+    # Catalogs written before the partial column have complete experiments
+    catalog["partial"] = catalog["partial"].eq(True)
+    catalog.to_feather(catalog_path)
+    return catalog
+
+
+def is_partial(fd_windows):
+    """
+    True if the experiments written with these FD windows lack the inflow and outflow.
+    """
+    return fd_windows is None or not fd_windows.timesteps
+
+
+def clear_partial_experiments(exp_folder, ids):
+    """
+    Remove the folders of the probe ids whose catalog row is partial, so that they are
+    written again with the FD inflow and outflow.
+    """
+    catalog_path = os.path.join(exp_folder, CATALOG_FILE)
+    if not os.path.exists(catalog_path):
+        return
+    catalog = read_catalog(catalog_path)
+    if "partial" not in catalog:
+        return
+    partial = catalog[catalog["partial"] & (catalog["format"] == "csv") & catalog["probe_id"].isin(list(ids))]
+    for path in partial["path"]:
+        if os.path.isdir(os.path.join(exp_folder, path)):
+            shutil.rmtree(os.path.join(exp_folder, path))
+
+
+def clear_experiments(exp_folder):
+    """
+    REMOVE THE EXPERIMENTS OF A FOLDER: every experiment folder (one with a ProbeTraj.csv),
+    the catalog and the sweep table. Other files and folders are left alone.
+    Existing experiment folders are never overwritten, so stale experiments must be
+    cleared before generating them again from new inputs or parameters.
+    """
+    if not os.path.isdir(exp_folder):
+        return
+    for name in os.listdir(exp_folder):
+        path = os.path.join(exp_folder, name)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, "ProbeTraj.csv")):
+            shutil.rmtree(path)
+    for name in (CATALOG_FILE, SWEEP_FILE):
+        if os.path.exists(os.path.join(exp_folder, name)):
+            os.remove(os.path.join(exp_folder, name))
+
+
+def read_catalog(catalog_path):
+    """
+    Read the experiment catalog written by generate_expData.
+    """
+    return pd.read_feather(catalog_path)
+
+
+@metrics.instrument("fcd.generate_expData")
+def generate_expData(ids, probeData, carData, fd_windows=None, workers=1, output="csv", exp_folder=None, runs=None):
+    """
+    GENERATE THE PROBE AND DETECT TRAJECTORY DATA FOR EACH PROBE-ID.
+    output="csv" writes one folder per probe id under exp_folder (default: exp/, the legacy layout);
+    output="store" writes all experiments into the columnar store exp_store/ (see write_exp_store).
+    With workers > 1 the probe ids are spread across worker processes (see _generate_expData_parallel).
+    A catalog with one row per written experiment is kept in catalog.feather next to the experiments.
+    runs: the result of probe_runs(probeData, carData), if it is already computed.
+    """
+    metrics.add_rows(len(ids))
+    # FD frames are read at the first experiment that needs them
+    if fd_windows is None:
+        fd_windows = FDWindows()
+    if output == "store":
+        return write_exp_store(ids, probeData, carData, os.path.join(os.getcwd(), EXP_STORE_DIR), fd_windows, runs)
+    # EXP Directory
+    if exp_folder is None:
+        exp_folder = os.path.join(os.getcwd(), "exp/")
+    os.makedirs(exp_folder, exist_ok=True)
+
+    # Experiments written before without the FD are written again
+    if not is_partial(fd_windows):
+        clear_partial_experiments(exp_folder, ids)
+
+    if workers != 1:
+        return _generate_expData_parallel(ids, probeData, carData, fd_windows, exp_folder, workers, runs)
+
     ### Loop over all the different IDS to create a sperate folder for each run
     print("\n")
+    catalog = []
+    try:
+        for idx, probe, detect in (pbar := tqdm(iter_probe_runs(ids, probeData, carData, runs), total=len(ids))):
+            pbar.set_description("Generating data for Probe ID: ")
+
+            # If the probe_id does not exits, then generate data
+            output_folder = os.path.join(exp_folder, f"{idx}")
+            if os.path.exists(output_folder):
+                status = "exists"
+            elif write_experiment(output_folder, probe, detect, fd_windows):
+                status = "written"
+                catalog.append(catalog_row(idx, probe, detect, "csv", f"{idx}", is_partial(fd_windows)))
+            else:
+                status = "nodetect"
+            report_experiment(idx, status, len(probe), len(detect))
+    finally:
+        # Also keep the catalog of the experiments written before an interruption
+        update_catalog(os.path.join(exp_folder, CATALOG_FILE), catalog)
+
+
+## Data shared with the experiment worker processes
+_EXP_WORKER = {}
+
+
+def _write_shared_frame(df, path):
+    """
+    Write a dataframe as an uncompressed Arrow file that the workers can memory-map.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_shared_frame(path):
+    """
+    Memory-mapped Arrow table of a shared frame. Its buffers point into the page cache, so
+    the workers share one copy of the data; the map stays open for the life of the worker.
+    """
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def _init_exp_worker(probe_path, car_path, fd_dir, timesteps, exp_folder):
+    # Each worker maps the shared frames once, instead of receiving them with every task
+    _EXP_WORKER["probeData"] = _read_shared_frame(probe_path)
+    _EXP_WORKER["carData"] = _read_shared_frame(car_path)
+    _EXP_WORKER["fd_windows"] = FDWindows(fd_dir, timesteps)
+    _EXP_WORKER["exp_folder"] = exp_folder
+
+
+def _exp_worker_task(task):
+    idx, positions, detect_lo, detect_hi = task
+    # Only the rows of the run are converted to pandas
+    probe = _EXP_WORKER["probeData"].take(positions).to_pandas()
+    detect = _EXP_WORKER["carData"].slice(detect_lo, detect_hi - detect_lo).to_pandas()
+    output_folder = os.path.join(_EXP_WORKER["exp_folder"], f"{idx}")
+    if write_experiment(output_folder, probe, detect, _EXP_WORKER["fd_windows"]):
+        return "written", len(probe), len(detect), catalog_row(idx, probe, detect, "csv", f"{idx}",
+                                                               is_partial(_EXP_WORKER["fd_windows"]))
+    return "nodetect", len(probe), len(detect), None
+
+
+def _generate_expData_parallel(ids, probeData, carData, fd_windows, exp_folder, workers, runs=None):
+    """
+    PARALLEL GENERATION OF THE EXPERIMENTS ACROSS PROBE IDS.
+    probeData and the time-sorted carData are handed to the workers as memory-mapped Arrow files.
+    Every probe id is generated once; repeated ids and existing folders are reported exactly as
+    in the serial loop, in the order of ids, so the result on disk is the same.
+    """
+    runs, carSorted, positions = probe_runs(probeData, carData) if runs is None else runs
+
+    # First occurrence of every probe id that does not have a folder yet
+    tasks = {}
+    for idx in ids:
+        if idx not in tasks and not os.path.exists(os.path.join(exp_folder, f"{idx}")):
+            tasks[idx] = (idx, positions[idx], runs.at[idx, "detect_lo"], runs.at[idx, "detect_hi"])
+
+    print("\n")
+    with tempfile.TemporaryDirectory() as shared_dir:
+        probe_path = os.path.join(shared_dir, "probeData.feather")
+        car_path = os.path.join(shared_dir, "carData.feather")
+        _write_shared_frame(probeData, probe_path)
+        _write_shared_frame(carSorted, car_path)
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_exp_worker,
+                                 initargs=(probe_path, car_path, fd_windows.fd_dir,
+                                           fd_windows.timesteps, exp_folder)) as pool:
+            chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count())))
+            results = pool.map(_exp_worker_task, tasks.values(), chunksize=chunksize)
+
+            # Aggregated progress and reporting in the order of ids
+            outcomes = {}
+            catalog = []
+            try:
+                pbar = tqdm(ids)
+                pbar.set_description("Generating data for Probe ID: ")
+                for idx in pbar:
+                    if idx in tasks and idx not in outcomes:
+                        outcomes[idx] = next(results)
+                        status, n_probe, n_detect, row = outcomes[idx]
+                        if row is not None:
+                            catalog.append(row)
+                    elif idx in outcomes and outcomes[idx][0] == "nodetect":
+                        # The serial loop retries the id and fails again
+                        status, n_probe, n_detect, _ = outcomes[idx]
+                    else:
+                        status, n_probe, n_detect = "exists", None, None
+                    report_experiment(idx, status, n_probe, n_detect)
+            finally:
+                update_catalog(os.path.join(exp_folder, CATALOG_FILE), catalog)
+
+
+
+
+def _write_store_frame(df, path):
+    """
+    Write a dataframe of the experiment store; the index is kept as column "index".
+    """
+    df = df.reset_index(names="index")
+    pa.feather.write_feather(df, path, compression="uncompressed")
+
+
+def _read_store_rows(path, lo, hi):
+    """
+    Rows [lo, hi) of a store file, memory-mapped, with the original index restored.
+    """
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    df = table.slice(lo, hi - lo).to_pandas().set_index("index")
+    df.index.name = None
+    return df
+
+
+def write_exp_store(ids, probeData, carData, store_dir=EXP_STORE_DIR, fd_windows=None, runs=None):
+    """
+    WRITE ALL EXPERIMENTS INTO A COLUMNAR STORE KEYED BY PROBE ID.
+    Files in store_dir:
+        probe.feather       probe rows of all experiments, contiguous per probe id
+        detect.feather      time-sorted carData, written once; experiments are row ranges of it
+        fd-{ts}sec.feather  begin-hr, end-hr, inflow and outflow of each FD-timestep, written once
+        manifest.feather    one row per probe id with its row ranges [lo, hi) in each file
+    Probe ids without detected vehicles are reported and skipped like in the CSV layout.
+    """
+    if fd_windows is None:
+        fd_windows = FDWindows()
+    os.makedirs(store_dir, exist_ok=True)
+    runs, carSorted, positions = probe_runs(probeData, carData) if runs is None else runs
+
+    print("\n")
+    manifest = []
+    catalog = []
+    probe_positions = []
+    probe_rows = 0
+    outcomes = {}
     for idx in (pbar := tqdm(ids)):
         pbar.set_description("Generating data for Probe ID: ")
+        if idx in outcomes and outcomes[idx] == "written":
+            report_experiment(idx, "exists", None, None)
+            continue
+        run_positions = positions[idx]
+        detect_lo, detect_hi = runs.at[idx, "detect_lo"], runs.at[idx, "detect_hi"]
+        # If the length of detection is greater than 1, meaning there are detected vehicles.
+        if detect_hi - detect_lo <= 1:
+            outcomes[idx] = "nodetect"
+            report_experiment(idx, "nodetect", len(run_positions), detect_hi - detect_lo)
+            continue
+
+        outcomes[idx] = "written"
+        row = {"probe_id": idx,
+               "probe_lo": probe_rows, "probe_hi": probe_rows + len(run_positions),
+               "detect_lo": detect_lo, "detect_hi": detect_hi}
+        for ts in fd_windows.timesteps:
+            row[f"fd-{ts}_lo"], row[f"fd-{ts}_hi"] = fd_windows.window(ts, runs.at[idx, "min_time"], runs.at[idx, "max_time"])
+        manifest.append(row)
+        catalog.append(catalog_row(idx, probeData.iloc[run_positions], carSorted.iloc[detect_lo:detect_hi], "store", ".", is_partial(fd_windows)))
+        probe_positions.append(run_positions)
+        probe_rows += len(run_positions)
+
+    ########### SAVING DATA ###########
+    print("[X] Saving experiment store ...", end=" ")
+    probe_positions = np.concatenate(probe_positions) if probe_positions else np.array([], dtype=np.int64)
+    _write_store_frame(probeData.iloc[probe_positions], os.path.join(store_dir, "probe.feather"))
+    _write_store_frame(carSorted, os.path.join(store_dir, "detect.feather"))
+    for ts in fd_windows.timesteps:
+        _write_store_frame(fd_windows.frame(ts)[['begin-hr', 'end-hr', 'inflow', 'outflow']],
+                           os.path.join(store_dir, f"fd-{ts}sec.feather"))
+    manifest = pd.DataFrame(manifest, columns=["probe_id", "probe_lo", "probe_hi", "detect_lo", "detect_hi"]
+                            + [f"fd-{ts}_{end}" for ts in fd_windows.timesteps for end in ("lo", "hi")])
+    table = pa.Table.from_pandas(manifest, preserve_index=False)
+    table = table.replace_schema_metadata({b"timesteps": json.dumps(fd_windows.timesteps).encode()})
+    pa.feather.write_feather(table, os.path.join(store_dir, "manifest.feather"), compression="uncompressed")
+    # The store is rewritten as a whole, so is its catalog
+    catalog_path = os.path.join(store_dir, CATALOG_FILE)
+    if os.path.exists(catalog_path):
+        os.remove(catalog_path)
+    update_catalog(catalog_path, catalog)
+    print("Done!")
+    return manifest
 
-        ### First check if the probe_id alread exits
-        # EXP Directory
-        exp_folder = os.path.join(os.getcwd(), "exp/")
-        if not os.path.exists(exp_folder):
-            os.mkdir(exp_folder)
 
+def read_exp_manifest(store_dir=EXP_STORE_DIR):
+    """
+    Manifest of the experiment store, indexed by probe id, and its FD-timesteps.
+    """
+    table = pa.feather.read_table(os.path.join(store_dir, "manifest.feather"))
+    timesteps = json.loads(table.schema.metadata[b"timesteps"])
+    return table.to_pandas().set_index("probe_id"), timesteps
 
-        # If the probe_id does not exits, then generate data
-        output_folder = os.path.join(exp_folder, f"{idx}")
-        if not os.path.exists(output_folder):
-
-            # Probe data
-            probe = probeData[probeData["id"] == idx]
-            # print("Length of Probe: ", len(probe))
-            # Detected veh data
-            min_time = probe.time.min()
-            max_time = probe.time.max()
-            detect = carData[(carData["time"] >= min_time) & (carData["time"] <= max_time)]
-            # print("Length of Detect:", len(detect))
-
-            # If the length of detection is greater than 1, meaning there are detected vehicles.
-            if len(detect) > 1:
-                os.mkdir(output_folder)
-
-                ########### SAVING DATA ###########
-                # Save the probe data
-                path = os.path.join(output_folder, "ProbeTraj.csv")
-                probe.to_csv(path, sep=";", decimal=",")
-                # Save the detect data
-                path = os.path.join(output_folder, "DetectTraj.csv")
-                detect.to_csv(path, sep=";", decimal=",")
-
-                ##### Inflow and Outflow data for each FD-timestep
-                # Inflow and outflow data
-                timesteps = [2, 3, 4, 5, 6, 7, 8]
-                for ts in timesteps:
-                    fd_data_path = os.path.join("sumo_ingolstadt/simulation/output/ABESEC/", f"fd-{ts}sec.feather")
-                    fd = pd.read_feather(fd_data_path)
-                    mask = ((fd['begin-hr'] >= probe.time.min()) & (fd['begin-hr'] <= probe.time.max()) | (fd['end-hr'] >= probe.time.min()) & (fd['end-hr'] <= probe.time.max()))
-                    df = fd[mask]
-                    inflow  = df[['begin-hr', 'end-hr','inflow']]
-                    outflow = df[['begin-hr', 'end-hr','outflow']]
-
-                    ## Save the files
-                    path = os.path.join(output_folder, f"inflow-{ts}sec.csv")
-                    inflow.to_csv(path, sep=";", decimal=",")
-                    # Save the outflow data
-                    path = os.path.join(output_folder, f"outflow-{ts}sec.csv")
-                    outflow.to_csv(path, sep=";", decimal=",")
 
-            else:
-                print(f"\nERROR!!! Not detection done on link on {idx}")
-                print("Length of Probe : ", len(probe))
-                print("Length of Detect: ", len(detect))
-        else:
+def read_experiment(store_dir, probe_id, store_manifest=None):
+    """
+    READ ONE EXPERIMENT FROM THE STORE.
+    store_manifest: the (manifest, timesteps) of read_exp_manifest, read from store_dir if None.
+    Returns a dict with probe, detect and the inflow/outflow dicts of FD-timestep -> dataframe,
+    the same frames that are written as CSV in the folder layout.
+    """
+    if store_manifest is None:
+        store_manifest = read_exp_manifest(store_dir)
+    manifest, timesteps = store_manifest
+    row = manifest.loc[probe_id]
+    exp = {"probe": _read_store_rows(os.path.join(store_dir, "probe.feather"), row["probe_lo"], row["probe_hi"]),
+           "detect": _read_store_rows(os.path.join(store_dir, "detect.feather"), row["detect_lo"], row["detect_hi"]),
+           "inflow": {}, "outflow": {}}
+    for ts in timesteps:
+        fd = _read_store_rows(os.path.join(store_dir, f"fd-{ts}sec.feather"), row[f"fd-{ts}_lo"], row[f"fd-{ts}_hi"])
+        exp["inflow"][ts] = fd[['begin-hr', 'end-hr', 'inflow']]
+        exp["outflow"][ts] = fd[['begin-hr', 'end-hr', 'outflow']]
+    return exp
+
+
+def export_exp_csv(store_dir=EXP_STORE_DIR, exp_folder="exp/", ids=None):
+    """
+    EXPORT THE EXPERIMENT STORE TO THE LEGACY CSV FOLDER LAYOUT (exp/<id>/...).
+    """
+    store_manifest = read_exp_manifest(store_dir)
+    ids = store_manifest[0].index if ids is None else ids
+    os.makedirs(exp_folder, exist_ok=True)
+    for idx in (pbar := tqdm(ids)):
+        pbar.set_description("Exporting data for Probe ID: ")
+        output_folder = os.path.join(exp_folder, f"{idx}")
+        if os.path.exists(output_folder):
             print(f"\nProbeID {idx} data already exits")
+            continue
+        exp = read_experiment(store_dir, idx, store_manifest)
+        write_experiment_csv(output_folder, exp["probe"], exp["detect"], exp["inflow"], exp["outflow"])
 
 
 
 
+def sample_probe_ids(probeData, peneration_rate, random_state=100):
+    """
+    Sample random IDs that are marked as probe (rows of probeData["id"]).
+    """
+    total_cars = probeData["id"].nunique()
+    n_samples = int(total_cars * peneration_rate)
+    return probeData["id"].sample(n=n_samples, replace=False, random_state=random_state).to_list()
+
+
+def sweep_samples(n_vehicles, rates, seeds):
+    """
+    NESTED PROBE SAMPLES OF A GRID OF PENETRATION RATES AND SEEDS, AS INDEX ARRAYS.
+    Every seed draws one permutation of the n_vehicles unique probe vehicles; the sample of
+    a rate is its first int(n_vehicles * rate) vehicles, so for one seed the sample of a
+    lower rate is part of the sample of every higher rate.
+    Returns dict (rate, seed) -> positions in the unique vehicles.
+    """
+    samples = {}
+    for seed in seeds:
+        order = np.random.default_rng(seed).permutation(n_vehicles)
+        for rate in rates:
+            samples[(rate, seed)] = order[:int(n_vehicles * rate)]
+    return samples
+
+
+@metrics.instrument("fcd.sweep_expData")
+def sweep_expData(probeData, carData, rates, seeds, fd_windows=None, workers=1, output="csv", exp_folder=None):
+    """
+    PENETRATION RATE x SEED SWEEP OVER ONE SET OF PROBE RUNS.
+    The probe runs and their detected windows are computed once (probe_runs) and every sample
+    of the grid is an index array into the unique probe vehicles (sweep_samples). The
+    experiments of the union of the samples are then generated once each, so a probe id picked
+    by several samples shares one experiment. sweep.feather next to the catalog lists the
+    probe ids of every (rate, seed) sample, and whether the id has an experiment.
+    Unlike sample_probe_ids, the samples are drawn from the unique vehicles, not from the rows.
+    Returns the sweep table.
+    """
+    runs = probe_runs(probeData, carData)
+    vehicles = runs[0].index.to_numpy()
+    # Runs with detected vehicles get an experiment (see write_experiment)
+    has_exp = (runs[0]["detect_hi"] - runs[0]["detect_lo"]).to_numpy() > 1
+    samples = sweep_samples(len(vehicles), rates, seeds)
+    keys = list(samples)
+    positions = np.concatenate([samples[key] for key in keys]) if keys else np.array([], dtype=np.int64)
+
+    ## Every probe id of the union is generated once
+    picked = np.unique(positions)
+    print("\nSWEEP: ", len(keys), "SAMPLES OF", len(vehicles), "PROBE VEHICLES")
+    print("NUMBER OF DISTINCT PROBE IDS: ", len(picked), "OF", len(positions), "SAMPLED")
+    generate_expData(vehicles[picked].tolist(), probeData, carData, fd_windows=fd_windows,
+                     workers=workers, output=output, exp_folder=exp_folder, runs=runs)
+
+    ## Samples as one long table: (rate, seed, probe_id)
+    sizes = [len(samples[key]) for key in keys]
+    sweep = pd.DataFrame({"rate": np.repeat([rate for rate, _ in keys], sizes).astype(float),
+                          "seed": np.repeat([seed for _, seed in keys], sizes).astype(np.int64),
+                          "probe_id": vehicles[positions],
+                          "has_exp": has_exp[positions]})
+    if output == "store":
+        sweep_dir = os.path.join(os.getcwd(), EXP_STORE_DIR)
+    else:
+        sweep_dir = exp_folder if exp_folder is not None else os.path.join(os.getcwd(), "exp/")
+    sweep.to_feather(os.path.join(sweep_dir, SWEEP_FILE))
+    return sweep
+
+
 def extract_space_time_diagrams(fcd):
     """
     EXTRACTING SEVERAL SPACE_TIME DIAGRAM FOR EACH PROBE RUN
+    fcd: the FCD dataframe or the directory of the partitioned FCD dataset.
     """
     ##################### Extracting PROBE and CAR Trajectories #####################
     # Amount of vehicles that I assume contains the camera (in ratio %)
@@ -238,7 +1432,7 @@ def extract_space_time_diagrams(fcd):
     # LINKS in the FCD
     print("\n", "-"*50)
     print("LANE ID in the FCD data:")
-    print(fcd.lane.unique())
+    print(read_dataset_manifest(fcd)["lanes"] if isinstance(fcd, str) else fcd.lane.unique())
     print("-"*50)
 
     # Links that are part of detection lane
@@ -258,9 +1452,7 @@ def extract_space_time_diagrams(fcd):
     print(len(probeData.id.unique()))
 
     # Sample random IDs that are marked as probe
-    total_cars = probeData["id"].nunique()
-    n_samples = int(total_cars * peneration_rate)
-    ids = probeData["id"].sample(n=n_samples, replace=False, random_state=100).to_list()
+    ids = sample_probe_ids(probeData, peneration_rate)
     print("\nPENERATION RATE: ", peneration_rate)
     print("NUMBER OF PROBE IDS SAMPLES: ", len(ids))
 
@@ -268,6 +1460,114 @@ def extract_space_time_diagrams(fcd):
     generate_expData(ids, probeData, carData)
 
 
+# Keys every link of LINKS in LinkParams.json gives itself (see read_links_params)
+LINK_OWN_KEYS = ["ROAD_LENGTH", "DELTAX", "DELTAT"]
+# Keys a link of LINKS never inherits from the top level, with their defaults
+LINK_LANE_KEYS = {"DETECTION_LANE": [], "PROBE_LANE": [], "FD_DIR": None}
+
+
+def read_links_params(param_path=param_file):
+    """
+    PARAMETERS OF EVERY LINK, link name -> dict with the keys of LinkParams.json.
+    The top level of LinkParams.json is the link LINK_NAME (the link of LINK_PARAMS).
+    LINKS holds the other links: each gives its own ROAD_LENGTH [m], DELTAX [m] and DELTAT [s]
+    and inherits the other keys (PENERATION_RATE, ...) from the top level, except its lanes
+    DETECTION_LANE, PROBE_LANE and FD_DIR (the folder of its converted edgeData outputs).
+    A link without lanes only gives the discretization of the dashboard, it is not extracted.
+    FD_DIR of the top-level link defaults to FD_DIR.
+    """
+    with open(param_path) as f:
+        params = json.load(f)
+    others = params.pop("LINKS", {})
+    base = {"FD_DIR": FD_DIR, **params}
+    links = {base.pop("LINK_NAME", "Link-1"): base}
+    for link, own in others.items():
+        missing = [key for key in LINK_OWN_KEYS if key not in own]
+        if missing:
+            raise ValueError(f"{param_path}: link {link} misses {missing}")
+        links[link] = {**base, **LINK_LANE_KEYS, **own}
+    return links
+
+
+def link_lane_masks(links):
+    """
+    Lane lookup of the links: lane id -> bit mask of the links (in the order of links)
+    whose detection or probe lanes contain it. A lane can belong to several links.
+    """
+    lookup = {}
+    for k, params in enumerate(links.values()):
+        for lane in set(params["DETECTION_LANE"]) | set(params["PROBE_LANE"]):
+            lookup[lane] = lookup.get(lane, 0) | (1 << k)
+    return lookup
+
+
+def split_links(batches, links):
+    """
+    FAN THE ROWS OF ONE SCAN OF THE FCD OUT TO THE LINKS BY LANE LOOKUP.
+    batches: FCD batches (see iter_xml), already in the units of convert_units.
+    Returns link name -> FCD rows on the detection and probe lanes of the link, in the
+    order of the scan. Rows on lanes of no link are dropped as soon as they are read.
+    """
+    lookup = link_lane_masks(links)
+    sinks = {link: [] for link in links}
+    for batch in batches:
+        metrics.add_rows(len(batch))
+        rows = batch[batch["lane"].isin(list(lookup))]
+        if rows.empty:
+            continue
+        # Links of every row, one dict lookup per row
+        masks = rows["lane"].map(lookup).to_numpy(dtype=np.int64)
+        for k, link in enumerate(links):
+            selected = (masks & (1 << k)) != 0
+            if selected.any():
+                sinks[link].append(rows[selected])
+    return {link: _concat_batches(frames) for link, frames in sinks.items()}
+
+
+@metrics.instrument("fcd.extract_links")
+def extract_links(xml_path, links=None, out_dir="data/", chunk_size=CHUNK_SIZE, compact=False, experiments=True):
+    """
+    SINGLE-SCAN MULTI-LINK EXTRACTION.
+    The FCD is parsed once and its rows are fanned out to the links of the multi-link
+    config (see split_links). For each link the detect and probe data are written to
+    out_dir/<link>/detect.feather and probe.feather, the full-day raster of the dashboard
+    to out_dir/<link>/raster-<link>.npz (see raster.py) and, if experiments, the
+    experiments of the sampled probe ids to out_dir/<link>/exp/.
+    The probe positions are reversed against the ROAD_LENGTH of each link.
+    Links without lanes in the config are skipped.
+    """
+    links = read_links_params() if links is None else links
+    skipped = [link for link, params in links.items() if not params["DETECTION_LANE"] or not params["PROBE_LANE"]]
+    links = {link: params for link, params in links.items() if link not in skipped}
+    if skipped:
+        print("\nLINKS WITHOUT LANES (skipped):", skipped)
+
+    print(f"\n[X] Scanning {xml_path} for {len(links)} links ...", end=" ")
+    fcd_links = split_links((convert_units(batch) for batch in iter_xml(xml_path, chunk_size, compact)), links)
+    print("Done!")
+
+    for link, params in links.items():
+        link_folder = os.path.join(out_dir, link)
+        os.makedirs(link_folder, exist_ok=True)
+        carData = get_detectData(fcd_links[link], params["DETECTION_LANE"])
+        probeData = get_probeData(fcd_links[link], params["PROBE_LANE"], pos_max=params["ROAD_LENGTH"] / 1000)
+        carData.to_feather(os.path.join(link_folder, "detect.feather"))
+        probeData.to_feather(os.path.join(link_folder, "probe.feather"))
+        save_raster(raster_file(link, out_dir), rasterize(carData, road_space=(0, params["ROAD_LENGTH"] / 1000)))
+        print(f"\n{link}: {carData.id.nunique()} detected and {probeData.id.nunique()} probe vehicles")
+        if not experiments:
+            continue
+
+        ids = sample_probe_ids(probeData, params["PENERATION_RATE"])
+        print("PENERATION RATE: ", params["PENERATION_RATE"])
+        print("NUMBER OF PROBE IDS SAMPLES: ", len(ids))
+        # Links without edgeData outputs get experiments without inflow and outflow
+        fd_windows = FDWindows(fd_dir=params["FD_DIR"]) if params.get("FD_DIR") else FDWindows(timesteps=[])
+        generate_expData(ids, probeData, carData, fd_windows=fd_windows,
+                         exp_folder=os.path.join(link_folder, "exp/"))
+    return fcd_links
+
+
 def unique_interval_values(intervals)->list:
     """
     Function to return unique values from the interval
@@ -325,7 +1625,149 @@ def create_space_time_grid(deltaX, deltaT, road_space: list, time_space: list):
 
 
 
-def plot_contineous_traj(probe, traj, grid=None, camView=False, probeViewDistance=None, title=None):
+def _style_traj_fig(fig, grid):
+    """
+    Axes and layout of the space-time plot.
+    """
+    fig.update_layout(legend_title_text='VehicleID', 
+                      legend = dict(font = dict(size = 8)),
+                      legend_title = dict(font = dict(size=15)),
+                      font_size=20, 
+                      font_color="black")
+    
+    # Update tick values
+    ticks = []
+    for intvl in grid["cell_time"]:
+        ticks.append(intvl.right)
+        ticks.append(intvl.left)
+    fig.update_xaxes(title_text='Time [hr]',
+                     range=grid['total_time'],
+                     tickmode = 'array',
+                     tickvals = list(set(ticks)),
+                     ticktext = [convert_hours_to_hms(t) for t in set(ticks)],
+                     # showgrid=True, griddash='dash', gridcolor='black', gridwidth=1, 
+                     showline=True, linewidth=1, linecolor='black', mirror=True,
+                     zeroline=True, zerolinecolor="black")
+
+    # Update tick values
+    ticks = []
+    for intvl in grid["cell_space"]:
+        ticks.append(intvl.right)
+        ticks.append(intvl.left)
+    fig.update_yaxes(title_text='Space [km]',
+                     range=grid['road_length'],
+                     tickmode = 'array',
+                     tickvals = list(set(ticks)),
+                     ticktext = list(set(ticks)),
+                     # showgrid=True, griddash='dash', gridcolor='black', gridwidth=1, 
+                     showline=True, linewidth=1, linecolor='black', mirror=True, 
+                     zeroline=True, zerolinecolor="black")
+    fig.update_layout(title_x=0.5, margin={"r":10,"t":40,"l":10,"b":0}, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', showlegend=False)
+    return fig
+
+
+def lttb(x, y, n_out):
+    """
+    LARGEST-TRIANGLE-THREE-BUCKETS DOWNSAMPLING OF A LINE.
+    Returns the positions of the n_out points kept (the first and last point always are).
+    The points between two buckets are chosen to keep the largest triangle area, so peaks
+    and bends of the trajectory survive.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket edges of the n-2 inner points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def _segmented(xs, ys):
+    """
+    Join lines into one trace, separated by gaps (None).
+    """
+    x, y = [], []
+    for xi, yi in zip(xs, ys):
+        x.extend(xi)
+        x.append(None)
+        y.extend(yi)
+        y.append(None)
+    return x, y
+
+
+def _plot_traj_fast(probe, traj, grid, camView, probeViewDistance, max_points):
+    """
+    FAST SPACE-TIME PLOT: ONE WEBGL TRACE PER COLOR, ONE POLYGON FOR THE CAMERA BAND
+    AND ONE SEGMENTED TRACE FOR THE GRID.
+    """
+    fig = go.Figure()
+    colors = px.colors.qualitative.Plotly
+
+    ## Detected trajectories, downsampled, one trace per color of the palette
+    lines = {color: ([], []) for color in colors}
+    for k, (_, veh) in enumerate(traj.sort_values("time", kind="stable").groupby("id", sort=False)):
+        keep = lttb(veh["time"].to_numpy(), veh["pos"].to_numpy(), max_points)
+        xs, ys = lines[colors[k % len(colors)]]
+        xs.append(veh["time"].to_numpy()[keep])
+        ys.append(veh["pos"].to_numpy()[keep])
+    for color, (xs, ys) in lines.items():
+        if not xs:
+            continue
+        x, y = _segmented(xs, ys)
+        fig.add_trace(go.Scattergl(x=x, y=y, mode="lines+markers", name="Detected",
+                                   line=dict(width=2, color=color), marker=dict(size=2, color=color)))
+
+    ## Probe vehicle
+    probe = probe.sort_values("time", kind="stable")
+    keep = lttb(probe["time"].to_numpy(), probe["pos"].to_numpy(), max_points)
+    fig.add_trace(go.Scattergl(x=probe["time"].to_numpy()[keep], y=probe["pos"].to_numpy()[keep],
+                               mode="lines+markers", name="Probe",
+                               line=dict(width=2, color="#ff0000", dash="longdashdot"),
+                               marker=dict(size=5, color="#ff0000")))
+
+    if camView:
+        ## Camera View Area (CameraBand) as one polygon: upper edge forward, lower edge back
+        time = probe["time"].to_numpy()
+        pos = probe["pos"].to_numpy()
+        half = 0.125/3600
+        t = np.concatenate([[time[0] - half], time, [time[-1] + half]])
+        p = np.concatenate([[pos[0]], pos, [pos[-1]]])
+        x = np.concatenate([t, t[::-1]])
+        y = np.concatenate([p - probeViewDistance[0], (p - probeViewDistance[1])[::-1]])
+        fig.add_trace(go.Scatter(x=x, y=y, fill="toself", mode="none", name="Camera",
+                                 fillcolor="rgba(255,0,0,0.1)", hoverinfo="skip"))
+
+    ## Grid lines as one segmented trace
+    times = unique_interval_values(grid["cell_time"])
+    spaces = unique_interval_values(grid["cell_space"])
+    x, y = _segmented([[ts, ts] for ts in times] + [grid["total_time"] for _ in spaces],
+                      [grid["road_length"] for _ in times] + [[sp, sp] for sp in spaces])
+    fig.add_trace(go.Scatter(x=x, y=y, mode="lines", name="Grid", hoverinfo="skip",
+                             line=dict(width=0.8, color="black", dash="dash")))
+    return _style_traj_fig(fig, grid)
+
+
+def plot_contineous_traj(probe, traj, grid=None, camView=False, probeViewDistance=None, title=None,
+                         fast=False, max_points=TRAJ_MAX_POINTS):
+    """
+    SPACE-TIME PLOT OF THE DETECTED TRAJECTORIES, THE PROBE RUN AND THE GRID.
+    With fast=True the figure is built from a handful of WebGL traces instead (see
+    _plot_traj_fast), and every trajectory is downsampled to max_points points.
+    """
+    if fast:
+        return _plot_traj_fast(probe, traj, grid, camView, probeViewDistance, max_points)
     # Plot for the detected trajectories
     fig = px.line(traj, x="time", y="pos", color='id', markers=True)
     fig.update_traces(line=dict(width=2), marker=dict(size=2))
@@ -362,41 +1804,7 @@ def plot_contineous_traj(probe, traj, grid=None, camView=False, probeViewDistanc
             fig.add_hline(y=sp, line_width=0.8, line_color="black", line_dash="dash")
 
 
-    fig.update_layout(legend_title_text='VehicleID', 
-                      legend = dict(font = dict(size = 8)),
-                      legend_title = dict(font = dict(size=15)),
-                      font_size=20, 
-                      font_color="black")
-    
-    # Update tick values
-    ticks = []
-    for intvl in grid["cell_time"]:
-        ticks.append(intvl.right)
-        ticks.append(intvl.left)
-    fig.update_xaxes(title_text='Time [hr]',
-                     range=grid['total_time'],
-                     tickmode = 'array',
-                     tickvals = list(set(ticks)),
-                     ticktext = [convert_hours_to_hms(t) for t in set(ticks)],
-                     # showgrid=True, griddash='dash', gridcolor='black', gridwidth=1, 
-                     showline=True, linewidth=1, linecolor='black', mirror=True,
-                     zeroline=True, zerolinecolor="black")
-
-    # Update tick values
-    ticks = []
-    for intvl in grid["cell_space"]:
-        ticks.append(intvl.right)
-        ticks.append(intvl.left)
-    fig.update_yaxes(title_text='Space [km]',
-                     range=grid['road_length'],
-                     tickmode = 'array',
-                     tickvals = list(set(ticks)),
-                     ticktext = list(set(ticks)),
-                     # showgrid=True, griddash='dash', gridcolor='black', gridwidth=1, 
-                     showline=True, linewidth=1, linecolor='black', mirror=True, 
-                     zeroline=True, zerolinecolor="black")
-    fig.update_layout(title_x=0.5, margin={"r":10,"t":40,"l":10,"b":0}, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', showlegend=False)
-    return fig
+    return _style_traj_fig(fig, grid)
 
 
 
@@ -408,10 +1816,14 @@ if __name__ == "__main__":
     fcd = parse_xml(xml_path)
 
     ## Convert to feather
-    fcd = convert_to_feather(fcd)
+    fcd = convert_to_feather(fcd, xml_path)
 
     ## Average length of vehicles
     average_vehicle_length(fcd)
 
     ## Extract space-time diagrams for all fcd in the simulation
     extract_space_time_diagrams(fcd)
+
+    ## Runtime of each stage
+    metrics.print_report()
+    metrics.write_report(os.path.join(os.path.dirname(xml_path), "metrics-fcd.json"))
@@ -1,85 +1,92 @@
 import pandas as pd
+import numpy as np
 import xml.etree.ElementTree as ET
 import os
 import json 
+import base64
+import argparse
+from array import array
+import pyarrow as pa
+import pyarrow.feather
+from concurrent.futures import ProcessPoolExecutor
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 from plotly.utils import PlotlyJSONEncoder
 
+import metrics
+from fcd_data import open_xml, iter_xml, FD_TIMESTEPS
+
 ## Import the Link parameter file
 param_file = "LinkParams.json"
 with open(param_file) as f:
     LINK_PARAMS = json.load(f)
 
 
+## Columns of the FD dataframe
+FD_COLUMNS = ['begin', 'end', 'id', 'laneid', 'sampledSeconds', 'overlapTraveltime', 'density', 
+              'laneDensity', 'occupancy', 'waitingTime', 'timeLoss', 'speed', 'speedRelative', 
+              'departed', 'arrived', 'entered', 'left', 'laneChangedFrom', 'laneChangedTo']
+# Edge attributes parsed as float (NaN if missing)
+FD_FLOAT_COLUMNS = ['sampledSeconds', 'overlapTraveltime', 'density', 'laneDensity', 'occupancy',
+                    'waitingTime', 'timeLoss', 'speed', 'speedRelative']
+# Edge attributes parsed as int (0 if missing)
+FD_INT_COLUMNS = ['departed', 'arrived', 'entered', 'left', 'laneChangedFrom', 'laneChangedTo']
+# Columns of the FD plot cache (see save_fd_plot)
+FD_PLOT_COLUMNS = ["laneDensity", "flow", "speed"]
+# Rollup of the edge attributes over several intervals (see rollup_fd):
+# summed, averaged over the sampled seconds, and averaged over time
+FD_SUM_COLUMNS = ['sampledSeconds', 'waitingTime', 'timeLoss'] + FD_INT_COLUMNS
+FD_SPEED_COLUMNS = ['speed', 'speedRelative']
+FD_TIME_COLUMNS = ['density', 'laneDensity', 'occupancy']
+# Speed [m/s] below which a vehicle counts as waiting (as in SUMO)
+WAITING_SPEED = 0.1
+# Edge of the detection lanes: the lane id without the lane index
+LINK_EDGE = LINK_PARAMS["DETECTION_LANE"][0].rsplit("_", 1)[0]
+
+
+@metrics.instrument("fd.parse_xml")
 def parse_xml(xml_path, ts):
+    """
+    READ THE XML FILE FOR FD (SUMO edgeData OUTPUT).
+    The intervals are streamed with an incremental parse straight into typed columns,
+    one row per <edge> of each <interval>; intervals without an edge are left out.
+    """
     # Parse the XML data
     print(f"\n[X] Reading file {ts}sec...", end=" ")
-    root = ET.parse(xml_path)
-
-    # Prepare data list
-    data = []
-
-    # Iterate through intervals
-    for interval in root.findall('interval'):
-        interval_data = {
-            'begin': float(interval.get('begin')),
-            'end': float(interval.get('end')),
-            'id': interval.get('id')
-        }
-
-        # Check if there's an edge element
-        edge = interval.find('edge')
-        if edge is not None:
-            interval_data.update({
-                'laneid': edge.get('id'),
-                'sampledSeconds': float(edge.get('sampledSeconds', 'nan')),
-                'overlapTraveltime': float(edge.get('overlapTraveltime', 'nan')),
-                'density': float(edge.get('density', 'nan')),
-                'laneDensity': float(edge.get('laneDensity', 'nan')),
-                'occupancy': float(edge.get('occupancy', 'nan')),
-                'waitingTime': float(edge.get('waitingTime', 'nan')),
-                'timeLoss': float(edge.get('timeLoss', 'nan')),
-                'speed': float(edge.get('speed', 'nan')),
-                'speedRelative': float(edge.get('speedRelative', 'nan')),
-                'departed': int(edge.get('departed', '0')),
-                'arrived': int(edge.get('arrived', '0')),
-                'entered': int(edge.get('entered', '0')),
-                'left': int(edge.get('left', '0')),
-                'laneChangedFrom': int(edge.get('laneChangedFrom', '0')),
-                'laneChangedTo': int(edge.get('laneChangedTo', '0'))
-            })
-        else:
-            # If no edge element, fill with NaN or appropriate default values
-            interval_data.update({
-                'laneid': None,
-                'sampledSeconds': float('nan'),
-                'overlapTraveltime': float('nan'),
-                'density': float('nan'),
-                'laneDensity': float('nan'),
-                'occupancy': float('nan'),
-                'waitingTime': float('nan'),
-                'timeLoss': float('nan'),
-                'speed': float('nan'),
-                'speedRelative': float('nan'),
-                'departed': 0,
-                'arrived': 0,
-                'entered': 0,
-                'left': 0,
-                'laneChangedFrom': 0,
-                'laneChangedTo': 0
-            })
-
-        data.append(interval_data)
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+    # Typed column buffers
+    columns = {col: array('d') for col in ['begin', 'end'] + FD_FLOAT_COLUMNS}
+    columns.update({col: array('q') for col in FD_INT_COLUMNS})
+    columns.update({col: [] for col in ['id', 'laneid']})
+
+    # Plain or gzipped XML
+    with open_xml(xml_path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end" or elem.tag != "interval":
+                continue
+            begin = float(elem.get('begin'))
+            end = float(elem.get('end'))
+            interval_id = elem.get('id')
+            for edge in elem.iter('edge'):
+                columns['begin'].append(begin)
+                columns['end'].append(end)
+                columns['id'].append(interval_id)
+                columns['laneid'].append(edge.get('id'))
+                for col in FD_FLOAT_COLUMNS:
+                    columns[col].append(float(edge.get(col, 'nan')))
+                for col in FD_INT_COLUMNS:
+                    columns[col].append(int(edge.get(col, '0')))
+            # Drop the consumed interval from the tree
+            root.clear()
 
-    # Reorder columns as specified
-    columns = ['begin', 'end', 'id', 'laneid', 'sampledSeconds', 'overlapTraveltime', 'density', 
-               'laneDensity', 'occupancy', 'waitingTime', 'timeLoss', 'speed', 'speedRelative', 
-               'departed', 'arrived', 'entered', 'left', 'laneChangedFrom', 'laneChangedTo']
-    df = df[columns]
+    # Create DataFrame
+    data = {col: np.frombuffer(values, dtype=np.float64 if values.typecode == 'd' else np.int64)
+            if isinstance(values, array) else values
+            for col, values in columns.items()}
+    df = pd.DataFrame(data, columns=FD_COLUMNS)
     df = df[df['laneid'].notna()]
 
     ## Add flow and density info 
@@ -89,6 +96,268 @@ def parse_xml(xml_path, ts):
     return df
 
 
+@metrics.instrument("fd.convert_fd")
+def convert_fd(xml_path, ts, n_lanes, edge_id=LINK_EDGE):
+    """
+    CONVERT THE FD DATA OF ONE SAMPLING TIMESTEP TO USEFUL UNITS AND SAVE IT AS FEATHER.
+    Only the intervals of the link's edge (edge_id) are kept.
+    Returns the path of the feather file.
+    """
+    edge = parse_xml(xml_path, ts)
+    metrics.add_rows(len(edge))
+    edge = convert_edge(select_edge(edge, edge_id), ts, n_lanes)
+
+    # EDGE SUMMARY
+    print("\n", "-"*50)
+    print("LANE ID:")
+    print(edge.laneid.unique())
+    print(edge[['density', 'laneDensity', 'occupancy', 'entered', 'left']].describe())
+    print("-"*50)
+
+    # SAVE TO FEATHER
+    print("[X] Saving as feather ...", end=" ")
+    parent_dir = os.path.abspath(os.path.join(xml_path, os.pardir))
+    output_path = os.path.join(parent_dir, f"fd-{ts}sec.feather")
+    edge.to_feather(output_path)
+    print("Done!")
+    return output_path
+
+
+def select_edge(edge, edge_id=LINK_EDGE):
+    """
+    Intervals of one edge of the FD data (columns of parse_xml). The fd-{ts}sec.feather files
+    hold one edge, so that their intervals do not overlap (see FDWindows).
+    """
+    selected = edge[edge['laneid'] == edge_id].reset_index(drop=True)
+    if selected.empty and not edge.empty:
+        raise ValueError(f"No interval of the edge {edge_id} in the FD data (edges: {edge['laneid'].unique().tolist()})")
+    return selected
+
+
+def convert_edge(edge, ts, n_lanes):
+    """
+    Unit conversion of the FD data of one sampling timestep (columns of parse_xml), in place.
+    Adds flow, begin-hr, end-hr, inflow and outflow: the schema of fd-{ts}sec.feather.
+    """
+    # UNIT CONVERSION FOR LATER USE
+    # Convert speed from m/s to km/h
+    edge['speed'] = edge['speed'] * 3.6
+    # Convert the density from veh/km/lane to veh/km
+    edge['laneDensity'] = edge['laneDensity']*n_lanes
+    # Calculate flow (veh/h)
+    edge['flow'] = edge['laneDensity']*edge['speed']
+    # Convert timestamps to hours
+    edge['begin-hr'] = edge['begin']/3600
+    edge['end-hr']   = edge['end']/3600
+    # Traffic flow into the lane
+    edge['inflow']  = 3600 * (edge['entered'] / ts)
+    edge['outflow'] = 3600 * (edge['left'] / ts)
+    return edge
+
+
+def read_fd_config(config_path):
+    """
+    READ THE edgeData OUTPUTS CONFIGURED IN fd-config.xml.
+    Returns a list of (freq [sec], xml path) with the paths relative to the config file.
+    A gzipped output (<file>.gz) is used when the plain file does not exist.
+    """
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    outputs = []
+    for edge_data in ET.parse(config_path).getroot().iter('edgeData'):
+        xml_path = os.path.join(config_dir, edge_data.get('file'))
+        if not os.path.exists(xml_path) and os.path.exists(xml_path + ".gz"):
+            xml_path = xml_path + ".gz"
+        freq = float(edge_data.get('freq'))
+        outputs.append((int(freq) if freq.is_integer() else freq, xml_path))
+    return outputs
+
+
+@metrics.instrument("fd.convert_all_fd")
+def convert_all_fd(config_path, n_lanes, workers=None, edge_id=LINK_EDGE):
+    """
+    CONVERT EVERY edgeData OUTPUT OF fd-config.xml CONCURRENTLY.
+    Each output is parsed, converted and saved as feather in its own worker process.
+    Returns the dict of freq -> feather path.
+    """
+    outputs = read_fd_config(config_path)
+    with ProcessPoolExecutor(max_workers=workers or min(len(outputs), os.cpu_count())) as pool:
+        futures = {ts: pool.submit(_convert_fd_task, xml_path, ts, n_lanes, edge_id) for ts, xml_path in outputs}
+        paths = {}
+        for ts, future in futures.items():
+            paths[ts], recorded = future.result()
+            # Stages of the worker process
+            metrics.merge(recorded)
+        return paths
+
+
+def _convert_fd_task(xml_path, ts, n_lanes, edge_id):
+    # Worker: convert one output and send back its metrics
+    metrics.reset()
+    output_path = convert_fd(xml_path, ts, n_lanes, edge_id)
+    return output_path, metrics.records()
+
+
+def _cumsum(values):
+    # Cumulative sum with a leading 0: the sum of rows [lo, hi) is cum[hi] - cum[lo]
+    return np.concatenate([[0], np.cumsum(values)])
+
+
+@metrics.instrument("fd.rollup_fd")
+def rollup_fd(fine, periods=FD_TIMESTEPS):
+    """
+    ROLL THE FINEST edgeData INTERVALS UP TO COARSER AGGREGATION PERIODS.
+    fine: intervals in the units of parse_xml (e.g. the 1sec output of SUMO, or fcd_intervals);
+    every period [sec] must be a multiple of the length of the fine intervals.
+    Counts and seconds are summed, speeds are averaged over the sampled seconds and
+    densities and occupancy over time, which is how SUMO aggregates a single interval.
+    The cumulative sums of each edge are computed once; every period then only looks up
+    the fine intervals at its bounds, so all the periods come from one pass over the data.
+    Returns dict period -> intervals with the columns of parse_xml.
+    """
+    metrics.add_rows(len(fine))
+    rolled = {ts: [] for ts in periods}
+    for laneid, edge in fine.groupby("laneid", sort=False):
+        edge = edge.sort_values("begin", kind="stable")
+        begin = edge["begin"].to_numpy(dtype=float)
+        end = edge["end"].to_numpy(dtype=float)
+        duration = end - begin
+        step = np.median(duration)
+        sampled = np.nan_to_num(edge["sampledSeconds"].to_numpy(dtype=float))
+
+        ## Cumulative sums: value (NaN as 0) and weight of the non-NaN values
+        cum = {}
+        for col, weight in ([(col, np.ones(len(edge))) for col in FD_SUM_COLUMNS]
+                            + [(col, sampled) for col in FD_SPEED_COLUMNS]
+                            + [(col, duration) for col in FD_TIME_COLUMNS]):
+            values = edge[col].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            cum[col] = (_cumsum(np.where(valid, values * weight, 0)), _cumsum(np.where(valid, weight, 0)))
+        # Length of the edge [m], from the travel times of SUMO
+        speed = edge["speed"].to_numpy(dtype=float)
+        lengths = edge["overlapTraveltime"].to_numpy(dtype=float) * speed
+        lengths = lengths[np.isfinite(lengths) & (speed > 0)]
+        length = np.median(lengths) if len(lengths) else np.nan
+
+        for ts in periods:
+            if not np.isclose(ts / step, round(ts / step)):
+                raise ValueError(f"Period {ts} sec is not a multiple of the fine intervals ({step} sec)")
+            ## Fine intervals [lo, hi) of every period
+            n = int(np.ceil((end[-1] - begin[0]) / ts - 1e-9))
+            bounds = begin[0] + ts * np.arange(n + 1)
+            lo = np.searchsorted(begin, bounds[:-1] - 1e-9, side="left")
+            hi = np.searchsorted(begin, bounds[1:] - 1e-9, side="left")
+            keep = hi > lo
+            lo, hi = lo[keep], hi[keep]
+
+            df = pd.DataFrame({"begin": bounds[:-1][keep], "end": np.minimum(bounds[1:][keep], end[hi - 1]),
+                               "id": edge["id"].iloc[0], "laneid": laneid})
+            for col in FD_SUM_COLUMNS + FD_SPEED_COLUMNS + FD_TIME_COLUMNS:
+                total = cum[col][0][hi] - cum[col][0][lo]
+                weight = cum[col][1][hi] - cum[col][1][lo]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    if col in FD_SUM_COLUMNS:
+                        df[col] = np.where(weight > 0, total, np.nan)
+                    else:
+                        df[col] = np.where(weight > 0, total / weight, np.nan)
+            for col in FD_INT_COLUMNS:
+                df[col] = np.nan_to_num(df[col]).astype(np.int64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                df["overlapTraveltime"] = np.where(df["speed"] > 0, length / df["speed"], np.nan)
+            rolled[ts].append(df[FD_COLUMNS])
+    return {ts: pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=FD_COLUMNS)
+            for ts, frames in rolled.items()}
+
+
+@metrics.instrument("fd.fcd_intervals")
+def fcd_intervals(fcd, lanes=None, period=1, step_length=None, road_length=None, interval_id="myEdgeData"):
+    """
+    edgeData INTERVALS OF THE LANES COMPUTED FROM THE RAW FCD, IN ONE PASS.
+    fcd: FCD xml path (streamed with iter_xml) or dataframe in the units of the XML
+    (time [s], speed [m/s]). The lanes (default: the detection lanes) are measured as one
+    edge of road_length [m]. Every FCD row stands for step_length seconds of its vehicle
+    (default: inferred from the timesteps); the intervals are period seconds long.
+    A vehicle enters in the interval of its first row and leaves
+    in the interval after its last row, unless it is still on the lanes at the end.
+    occupancy, timeLoss and speedRelative need the vehicle lengths and speed limits, which
+    the FCD does not have, and are NaN.
+    Returns the intervals with the columns of parse_xml, to be rolled up with rollup_fd.
+    """
+    lanes = LINK_PARAMS["DETECTION_LANE"] if lanes is None else lanes
+    road_length = LINK_PARAMS["ROAD_LENGTH"] if road_length is None else road_length
+    batches = iter_xml(fcd) if isinstance(fcd, str) else [fcd]
+
+    ## Per-row sums binned by interval, and the first/last time of every vehicle
+    n_rows, speed_sum, n_waiting = np.zeros(0), np.zeros(0), np.zeros(0)
+    first_last = []
+    t_max = -np.inf
+    for batch in batches:
+        metrics.add_rows(len(batch))
+        time = batch["time"].to_numpy(dtype=float)
+        if len(time):
+            t_max = max(t_max, time.max())
+        # Simulation step: inferred from the first batch with two timesteps
+        if step_length is None and len(np.unique(time)) > 1:
+            step_length = float(np.median(np.diff(np.unique(time))))
+        rows = batch[batch["lane"].isin(lanes)]
+        if rows.empty:
+            continue
+        k = np.floor(rows["time"].to_numpy(dtype=float) / period + 1e-9).astype(np.int64)
+        speed = rows["speed"].to_numpy(dtype=float)
+        size = max(len(n_rows), k.max() + 1)
+        n_rows = np.pad(n_rows, (0, size - len(n_rows))) + np.bincount(k, minlength=size)
+        speed_sum = np.pad(speed_sum, (0, size - len(speed_sum))) + np.bincount(k, weights=speed, minlength=size)
+        n_waiting = np.pad(n_waiting, (0, size - len(n_waiting))) + np.bincount(k, weights=speed < WAITING_SPEED, minlength=size)
+        first_last.append(rows.groupby("id", observed=True)["time"].agg(["min", "max"]))
+    if step_length is None:
+        raise ValueError("Cannot infer the simulation step, pass step_length")
+
+    ## Intervals up to the last timestep of the simulation
+    n = max(int(np.floor(t_max / period + 1e-9)) + 1, len(n_rows))
+    n_rows, speed_sum, n_waiting = (np.pad(a, (0, n - len(a))) for a in (n_rows, speed_sum, n_waiting))
+    if first_last:
+        first_last = pd.concat(first_last).groupby(level=0).agg({"min": "min", "max": "max"})
+        first, last = first_last["min"].to_numpy(), first_last["max"].to_numpy()
+    else:
+        first, last = np.zeros(0), np.zeros(0)
+    entered = np.bincount(np.floor(first / period + 1e-9).astype(np.int64), minlength=n)
+    gone = last < t_max
+    left = np.bincount(np.minimum(np.floor((last[gone] + step_length) / period + 1e-9).astype(np.int64), n - 1), minlength=n)
+
+    edge_id = lanes[0].rsplit("_", 1)[0] if lanes else "edge"
+    sampled = n_rows * step_length
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(sampled > 0, speed_sum / n_rows, np.nan)
+        overlap_traveltime = np.where(speed > 0, road_length / speed, np.nan)
+    density = sampled / period / (road_length / 1000)
+    df = pd.DataFrame({"begin": np.arange(n) * period, "end": (np.arange(n) + 1) * period,
+                       "id": interval_id, "laneid": edge_id,
+                       "sampledSeconds": sampled, "overlapTraveltime": overlap_traveltime,
+                       "density": density, "laneDensity": density / max(len(lanes), 1),
+                       "occupancy": np.nan, "waitingTime": n_waiting * step_length, "timeLoss": np.nan,
+                       "speed": speed, "speedRelative": np.nan,
+                       "departed": 0, "arrived": 0, "entered": entered[:n], "left": left[:n],
+                       "laneChangedFrom": 0, "laneChangedTo": 0})
+    return df[FD_COLUMNS]
+
+
+@metrics.instrument("fd.convert_rollups")
+def convert_rollups(fine, out_dir, n_lanes, periods=FD_TIMESTEPS, edge_id=LINK_EDGE):
+    """
+    ROLL THE FINE INTERVALS UP TO EVERY PERIOD AND SAVE THEM AS fd-{ts}sec.feather,
+    converted like convert_fd, instead of one SUMO edgeData output per period.
+    Only the intervals of the link's edge (edge_id) are kept.
+    Returns the dict of period -> feather path.
+    """
+    paths = {}
+    for ts, edge in rollup_fd(select_edge(fine, edge_id), periods).items():
+        print(f"\n[X] Saving the {ts}sec rollup as feather ...", end=" ")
+        edge = convert_edge(edge, ts, n_lanes)
+        paths[ts] = os.path.join(out_dir, f"fd-{ts}sec.feather")
+        edge.to_feather(paths[ts])
+        print("Done!")
+    return paths
+
+
 def get_fd_plot(df, title=None):
     fig = make_subplots(rows=1, cols=3)
     ## Speed/Density plot
@@ -157,6 +426,52 @@ def get_fd_plot(df, title=None):
                     showlegend=False)
     return fig
 
+def save_fd_plot(df, fpath, title=None):
+    """
+    CACHE THE FD PLOT AS ITS DATA: density, flow and speed as float32 columns of a
+    compressed feather file, plus a small layout spec (the title) in the metadata.
+    load_fd_plot rebuilds the figure with get_fd_plot.
+    """
+    table = pa.table({col: df[col].to_numpy(dtype=np.float32) for col in FD_PLOT_COLUMNS})
+    table = table.replace_schema_metadata({"fd_plot": json.dumps({"title": title})})
+    pyarrow.feather.write_feather(table, fpath, compression="zstd")
+
+
+def load_fd_plot(fpath):
+    """
+    Rebuild the FD plot from the cache written by save_fd_plot.
+    """
+    table = pyarrow.feather.read_table(fpath)
+    spec = json.loads(table.schema.metadata[b"fd_plot"])
+    df = pd.DataFrame({col: table[col].to_numpy() for col in FD_PLOT_COLUMNS})
+    return get_fd_plot(df, title=spec["title"])
+
+
+def _plot_array(values):
+    # Array of a trace: a list, or a typed array {"dtype", "bdata"[, "shape"]} (base64) of plotly >= 6
+    if isinstance(values, dict) and "bdata" in values:
+        array = np.frombuffer(base64.b64decode(values["bdata"]), dtype=np.dtype(values["dtype"]))
+        shape = values.get("shape")
+        if shape:
+            array = array.reshape([int(n) for n in str(shape).split(",")])
+        return array.astype(float)
+    return np.asarray(values, dtype=float)
+
+
+def fd_plot_json_to_cache(json_path, fpath):
+    """
+    Convert an FD plot saved by plotlyfig2json to the cache of save_fd_plot.
+    The figure is read by plotly; its arrays may be lists or typed arrays (see _plot_array).
+    """
+    with open(json_path, 'r') as f:
+        fig = pio.from_json(f.read())
+    speed_density, flow_density = fig.data[0], fig.data[1]
+    df = pd.DataFrame({"laneDensity": _plot_array(speed_density.x),
+                       "flow": _plot_array(flow_density.y),
+                       "speed": _plot_array(speed_density.y)})
+    save_fd_plot(df, fpath, title=fig.layout.title.text)
+
+
 def plotlyfig2json(fig, fpath=None):
     """
     Modified from https://github.com/nteract/nteract/issues/1229
@@ -190,48 +505,29 @@ if __name__ == "__main__":
     # CONVERT THE FD DATA TO USEFUL UNITS.
     # SAVE THE CONVERTED XML DATA TO DATAFRAME
     # """
-    ###################### IMPORTANT VARIABLS ######################
-    # Sampling times
-    timesteps = [2, 3, 4, 5, 6, 7, 8]
-
-    # Number of Lanes on the detecion lane
-    n_lanes = 2
-
-    ###################### LOOP ACROSS TIMESTEPS ######################
-    ## Loop across each different file and create a corresponding dataframe
-    for ts in timesteps:
-        # CONVERT XML TO FEATHER
-        cwd = os.getcwd()
-        xml_path = os.path.join(cwd, f"sumo_ingolstadt/simulation/output/fd-¨{ts}sec.xml")
-        edge = parse_xml(xml_path, ts)
-
-        # UNIT CONVERSION FOR LATER USE
-        # Convert speed from m/s to km/h
-        edge['speed'] = edge['speed'] * 3.6
-        # Convert the density from veh/km/lane to veh/km
-        edge['laneDensity'] = edge['laneDensity']*n_lanes
-        # Calculate flow (veh/h)
-        edge['flow'] = edge['laneDensity']*edge['speed']
-        # Convert timestamps to hours
-        edge['begin-hr'] = edge['begin']/3600
-        edge['end-hr']   = edge['end']/3600
-        # Traffic flow into the lane
-        edge['inflow']  = 3600 * (edge['entered'] / ts)
-        edge['outflow'] = 3600 * (edge['left'] / ts)
-
-        # EDGE SUMMARY
-        print("\n", "-"*50)
-        print("LANE ID:")
-        print(edge.laneid.unique())
-        print(edge[['density', 'laneDensity', 'occupancy', 'entered', 'left']].describe())
-        print("-"*50)
-
-        # SAVE TO FEATHER
-        print("[X] Saving as feather ...", end=" ")
-        parent_dir = os.path.abspath(os.path.join(xml_path, os.pardir))
-        output_path = os.path.join(parent_dir, f"fd-{ts}sec.feather")
-        edge.to_feather(output_path)
-        print("Done!")
+    parser = argparse.ArgumentParser(description="Convert the FD outputs of SUMO to fd-{ts}sec.feather.")
+    parser.add_argument("--config", default="sumo_ingolstadt/simulation/fd-config.xml", help="edgeData outputs (one per sampling time)")
+    parser.add_argument("--n-lanes", type=int, default=2, help="Number of Lanes on the detecion lane")
+    parser.add_argument("--from-fine", default=None, help="Roll all the periods up from this finest edgeData output instead")
+    parser.add_argument("--from-fcd", default=None, help="Roll all the periods up from this FCD output instead")
+    parser.add_argument("--periods", type=float, nargs="+", default=FD_TIMESTEPS, help="Rollup periods [sec]")
+    parser.add_argument("--edge", default=LINK_EDGE, help="Edge of the link (the other edges of the outputs are left out)")
+    args = parser.parse_args()
+    periods = [int(ts) if float(ts).is_integer() else ts for ts in args.periods]
+
+    if args.from_fine or args.from_fcd:
+        ###################### ALL PERIODS FROM ONE PASS ######################
+        source = args.from_fine or args.from_fcd
+        fine = parse_xml(source, "fine") if args.from_fine else fcd_intervals(source)
+        convert_rollups(fine, os.path.dirname(os.path.abspath(source)), args.n_lanes, periods, args.edge)
+        report_dir = os.path.dirname(os.path.abspath(source))
+    else:
+        ###################### ALL TIMESTEPS CONCURRENTLY ######################
+        ## Convert each different file to a corresponding feather
+        convert_all_fd(args.config, args.n_lanes, edge_id=args.edge)
+        report_dir = os.path.join(os.path.dirname(args.config), "output")
+
+    ## Runtime of each stage
+    metrics.print_report()
+    metrics.write_report(os.path.join(report_dir, "metrics-fd.json"))
     ###################################################################################
-
-
@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+
+## Stages recorded in this process, in the order they finished
+STAGES = []
+# Accumulated time of frequent calls (one per experiment), name -> {calls, seconds}
+TIMERS = {}
+# Names of the stages currently running (innermost last)
+_ACTIVE = []
+# Interval [s] of the RSS samples taken while stages run
+RSS_INTERVAL = 0.05
+# Background thread sampling the RSS of the running stages (see _start_rss_sampler)
+_SAMPLER = {"thread": None, "stop": None}
+
+
+def _io_counters():
+    """
+    Bytes read and written by this process so far (Linux /proc/self/io), or (None, None).
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _current_rss_mb():
+    """
+    Current resident set size [MB] of this process (Linux /proc/self/statm), or None.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _sample_rss(stop):
+    # Every running stage keeps the highest RSS sampled while it runs
+    while not stop.wait(RSS_INTERVAL):
+        rss = _current_rss_mb()
+        for current in list(_ACTIVE):
+            current.observe_rss(rss)
+
+
+def _start_rss_sampler():
+    if _SAMPLER["thread"] is None:
+        _SAMPLER["stop"] = threading.Event()
+        _SAMPLER["thread"] = threading.Thread(target=_sample_rss, args=(_SAMPLER["stop"],), daemon=True)
+        _SAMPLER["thread"].start()
+
+
+def _stop_rss_sampler():
+    if _SAMPLER["thread"] is not None:
+        _SAMPLER["stop"].set()
+        _SAMPLER["thread"].join()
+        _SAMPLER["thread"] = None
+
+
+def _reset_rss_sampler():
+    # A forked worker process does not inherit the thread of its parent
+    _SAMPLER["thread"] = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_rss_sampler)
+
+
+def _peak_rss_mb():
+    """
+    Peak resident set size [MB] over the whole lifetime of this process (not of one stage),
+    and of its largest finished worker process.
+    """
+    scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, kB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2**20
+    return own, children
+
+
+class Stage:
+    """
+    METRICS OF ONE RUN OF A PIPELINE STAGE.
+    rows can be set (or added to) by the stage itself; otherwise it is len() of the result.
+    The RSS of the stage is the current RSS at its start and end, and the peak of the
+    samples taken every RSS_INTERVAL seconds while it runs.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.parent = _ACTIVE[-1].name if _ACTIVE else None
+        self.rows = None
+        self.start = time.perf_counter()
+        self.read0, self.written0 = _io_counters()
+        self.rss_start = _current_rss_mb()
+        self.rss_peak = self.rss_start
+        self.record = None
+
+    def add_rows(self, n):
+        self.rows = (self.rows or 0) + int(n)
+
+    def observe_rss(self, rss):
+        if rss is not None and (self.rss_peak is None or rss > self.rss_peak):
+            self.rss_peak = rss
+
+    def finish(self, error=None):
+        seconds = time.perf_counter() - self.start
+        read, written = _io_counters()
+        rss_end = _current_rss_mb()
+        self.observe_rss(rss_end)
+        peak_lifetime, peak_lifetime_children = _peak_rss_mb()
+        self.record = {
+            "stage": self.name,
+            "parent": self.parent,
+            "seconds": seconds,
+            "rows": self.rows,
+            "rows_per_s": self.rows / seconds if self.rows is not None and seconds > 0 else None,
+            "bytes_read": read - self.read0 if read is not None else None,
+            "bytes_written": written - self.written0 if written is not None else None,
+            "rss_start_mb": self.rss_start,
+            "rss_end_mb": rss_end,
+            "peak_rss_mb": self.rss_peak,
+            "peak_rss_lifetime_mb": peak_lifetime,
+            "peak_rss_children_lifetime_mb": peak_lifetime_children,
+            "error": error,
+        }
+        STAGES.append(self.record)
+        return self.record
+
+
+@contextmanager
+def stage(name):
+    """
+    RECORD THE WALL TIME, ROWS, I/O AND RSS OF THE ENCLOSED CODE AS A STAGE.
+    Stages can be nested; each record names its parent stage.
+    """
+    current = Stage(name)
+    _ACTIVE.append(current)
+    _start_rss_sampler()
+    try:
+        yield current
+    except BaseException as e:
+        _ACTIVE.pop()
+        if not _ACTIVE:
+            _stop_rss_sampler()
+        current.finish(error=type(e).__name__)
+        raise
+    _ACTIVE.pop()
+    if not _ACTIVE:
+        _stop_rss_sampler()
+    current.finish()
+
+
+def instrument(name):
+    """
+    Decorator recording every call of the function as the stage name (see stage).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as current:
+                result = func(*args, **kwargs)
+                if current.rows is None and hasattr(result, "__len__") and not isinstance(result, (str, bytes, dict)):
+                    current.rows = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def timed(name):
+    """
+    Decorator adding the time of every call to TIMERS[name], for calls too frequent
+    to be recorded as stages one by one.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer = TIMERS.setdefault(name, {"calls": 0, "seconds": 0.0})
+                timer["calls"] += 1
+                timer["seconds"] += time.perf_counter() - start
+        return wrapper
+    return decorator
+
+
+def add_rows(n):
+    """
+    Add rows to the innermost running stage (no-op outside of a stage).
+    """
+    if _ACTIVE:
+        _ACTIVE[-1].add_rows(n)
+
+
+def reset():
+    STAGES.clear()
+    TIMERS.clear()
+
+
+def records():
+    """
+    Stages and timers recorded so far, to send back from a worker process (see merge).
+    """
+    return {"stages": list(STAGES), "timers": {name: dict(timer) for name, timer in TIMERS.items()}}
+
+
+def merge(recorded):
+    """
+    Add the stages and timers recorded in a worker process.
+    """
+    STAGES.extend(recorded["stages"])
+    for name, timer in recorded["timers"].items():
+        total = TIMERS.setdefault(name, {"calls": 0, "seconds": 0.0})
+        total["calls"] += timer["calls"]
+        total["seconds"] += timer["seconds"]
+
+
+def report():
+    """
+    MACHINE-READABLE REPORT OF THE RECORDED STAGES, WITH TOTALS PER STAGE NAME.
+    """
+    totals = {}
+    for record in STAGES:
+        total = totals.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "rows": 0})
+        total["calls"] += 1
+        total["seconds"] += record["seconds"]
+        total["rows"] += record["rows"] or 0
+    for total in totals.values():
+        total["rows_per_s"] = total["rows"] / total["seconds"] if total["seconds"] > 0 else None
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(),
+            "stages": list(STAGES), "totals": totals, "timers": TIMERS}
+
+
+def write_report(path):
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=4)
+    return path
+
+
+def print_report():
+    print(f"\n{'stage':<32}{'calls':>6}{'seconds':>10}{'rows':>12}{'rows/s':>12}")
+    print("-" * 72)
+    for name, total in report()["totals"].items():
+        rate = f"{total['rows_per_s']:,.0f}" if total["rows_per_s"] else "-"
+        print(f"{name:<32}{total['calls']:>6}{total['seconds']:>10.3f}{total['rows']:>12}{rate:>12}")
+    for name, timer in TIMERS.items():
+        print(f"{name:<32}{timer['calls']:>6}{timer['seconds']:>10.3f}{'-':>12}{'-':>12}")
+
+
+class SamplingProfiler:
+    """
+    SAMPLING PROFILER FOR HOT-PATH DRILL-DOWN.
+    A background thread samples the stack of the main thread every interval seconds; each
+    sample is prefixed with the running stage. write() saves the samples as collapsed
+    stacks ("stage;file:function;... count"), the input of flamegraph.pl or speedscope.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = threading.main_thread().ident
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stage_name = _ACTIVE[-1].name if _ACTIVE else "-"
+            self.samples[";".join([stage_name] + stack[::-1])] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def top(self, n=20):
+        """
+        Functions with the most samples on top of the stack: list of (function, share).
+        """
+        total = sum(self.samples.values()) or 1
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [(func, count / total) for func, count in leaves.most_common(n)]
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+@contextmanager
+def profiled(path=None, interval=0.005):
+    """
+    Run the enclosed code under the SamplingProfiler; the collapsed stacks go to path.
+    With path None nothing is sampled.
+    """
+    if path is None:
+        yield None
+        return
+    profiler = SamplingProfiler(interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write(path)
@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+import argparse
+import pandas as pd
+
+import metrics
+from raster import rasterize, save_raster, raster_file
+from fcd_data import (LINK_PARAMS, FD_DIR, FD_TIMESTEPS, CATALOG_FILE, stream_to_feather,
+                      get_detectData, get_probeData, sample_probe_ids, generate_expData,
+                      follow_xml, convert_units, FcdDatasetWriter, FDWindows, ProbeRunTracker, write_experiment,
+                      catalog_row, update_catalog, report_experiment, is_partial, clear_experiments, param_file,
+                      read_links_params, extract_links, SWEEP_FILE, sweep_expData)
+
+## Manifest of the stages, next to the stage outputs
+MANIFEST_FILE = "pipeline-manifest.json"
+
+
+def fingerprint(path, use_hash=False):
+    """
+    Fingerprint of a file: its size and mtime, or the sha256 of its content if use_hash.
+    None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    if not use_hash:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def run_stage(manifest, name, inputs, params, outputs, run, force=False, use_hash=False):
+    """
+    RUN ONE STAGE OF THE PIPELINE, UNLESS NOTHING CHANGED SINCE ITS LAST RUN.
+    A stage is skipped when the fingerprints of its inputs, its parameters and the
+    fingerprints of its outputs are the same as recorded in the manifest.
+    Returns True if the stage was run.
+    """
+    state = {"inputs": {path: fingerprint(path, use_hash) for path in inputs},
+             "params": params}
+    previous = manifest.get(name)
+    if (not force and previous is not None
+            and previous["inputs"] == state["inputs"]
+            and previous["params"] == state["params"]
+            and all(fingerprint(path, use_hash) == fp for path, fp in previous["outputs"].items())):
+        print(f"\n[-] Stage {name}: up to date, skipped")
+        return False
+
+    missing = [path for path, fp in state["inputs"].items() if fp is None]
+    if missing:
+        raise FileNotFoundError(f"Stage {name}: missing inputs {missing}")
+
+    print(f"\n[X] Stage {name}: running")
+    with metrics.stage(f"pipeline.{name}"):
+        run()
+    state["outputs"] = {path: fingerprint(path, use_hash) for path in outputs}
+    manifest[name] = state
+    return True
+
+
+def run_pipeline(xml_path, fd_dir=FD_DIR, force=False, use_hash=False, rates=None, seeds=None):
+    """
+    INCREMENTAL PIPELINE: XML -> FEATHER -> LANE SUBSETS -> RASTER AND EXPERIMENTS.
+    Only the stages whose inputs or LinkParams.json keys changed are run again, e.g. a
+    new PENERATION_RATE only reruns the experiments, not the XML parse.
+    The manifest is saved after every stage, so an interrupted run resumes where it stopped.
+    With rates (and seeds) the experiments stage is a penetration rate x seed sweep
+    (see sweep_expData) instead of the single PENERATION_RATE sample.
+    """
+    out_dir = os.path.abspath(os.path.join(xml_path, os.pardir))
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+
+    fcd_path = os.path.join(out_dir, "fcd.feather")
+    detect_path = os.path.join(out_dir, "detect.feather")
+    probe_path = os.path.join(out_dir, "probe.feather")
+    fd_paths = [os.path.join(fd_dir, f"fd-{ts}sec.feather") for ts in FD_TIMESTEPS]
+    catalog_path = os.path.join(os.getcwd(), "exp", CATALOG_FILE)
+    sweep_path = os.path.join(os.getcwd(), "exp", SWEEP_FILE)
+
+    ## STAGE 1: XML to feather
+    run_stage(manifest, "fcd_feather", inputs=[xml_path], params={}, outputs=[fcd_path],
+              run=lambda: stream_to_feather(xml_path),
+              force=force, use_hash=use_hash)
+    save_manifest(manifest, manifest_path)
+
+    ## STAGE 2: feather to lane subsets
+    def lane_subsets():
+        fcd = pd.read_feather(fcd_path)
+        get_detectData(fcd, LINK_PARAMS["DETECTION_LANE"]).to_feather(detect_path)
+        get_probeData(fcd, LINK_PARAMS["PROBE_LANE"]).to_feather(probe_path)
+
+    run_stage(manifest, "lane_subsets", inputs=[fcd_path],
+              params={key: LINK_PARAMS[key] for key in ("DETECTION_LANE", "PROBE_LANE", "ROAD_LENGTH")},
+              outputs=[detect_path, probe_path], run=lane_subsets,
+              force=force, use_hash=use_hash)
+    save_manifest(manifest, manifest_path)
+
+    ## STAGE 3: detected vehicles to the full-day raster of the dashboard
+    raster_path = raster_file(LINK_PARAMS["LINK_NAME"], os.path.join(os.getcwd(), "data"))
+
+    def raster():
+        os.makedirs(os.path.dirname(raster_path), exist_ok=True)
+        road_space = (0, LINK_PARAMS["ROAD_LENGTH"] / 1000)
+        save_raster(raster_path, rasterize(pd.read_feather(detect_path), road_space=road_space))
+
+    run_stage(manifest, "raster", inputs=[detect_path], params={"ROAD_LENGTH": LINK_PARAMS["ROAD_LENGTH"]},
+              outputs=[raster_path], run=raster,
+              force=force, use_hash=use_hash)
+    save_manifest(manifest, manifest_path)
+
+    ## STAGE 4: lane subsets to experiments
+    def experiments():
+        # The stage reruns because its inputs or parameters changed: the old experiments are stale
+        clear_experiments(os.path.join(os.getcwd(), "exp"))
+        carData = pd.read_feather(detect_path)
+        probeData = pd.read_feather(probe_path)
+        if rates:
+            sweep_expData(probeData, carData, rates, seeds, fd_windows=FDWindows(fd_dir=fd_dir))
+            return
+        ids = sample_probe_ids(probeData, LINK_PARAMS["PENERATION_RATE"])
+        print("\nPENERATION RATE: ", LINK_PARAMS["PENERATION_RATE"])
+        print("NUMBER OF PROBE IDS SAMPLES: ", len(ids))
+        generate_expData(ids, probeData, carData, fd_windows=FDWindows(fd_dir=fd_dir))
+
+    if rates:
+        seeds = [100] if seeds is None else seeds
+        params, outputs = {"rates": list(rates), "seeds": list(seeds)}, [catalog_path, sweep_path]
+    else:
+        params, outputs = {"PENERATION_RATE": LINK_PARAMS["PENERATION_RATE"], "random_state": 100}, [catalog_path]
+    run_stage(manifest, "experiments", inputs=[detect_path, probe_path] + fd_paths,
+              params=params, outputs=outputs, run=experiments,
+              force=force, use_hash=use_hash)
+    save_manifest(manifest, manifest_path)
+    return manifest
+
+
+def follow_fcd(xml_path, dataset_dir=None, fd_windows=None, poll_interval=1.0, idle_timeout=60.0):
+    """
+    FOLLOW MODE: PROCESS THE FCD WHILE SUMO IS STILL WRITING IT.
+    The complete timesteps of the growing XML are parsed in micro-batches, appended to the
+    partitioned dataset (if dataset_dir is given) and every probe run is written to exp/
+    as soon as the probe vehicle has left the link. The catalog is updated after each batch.
+    Probe ids are sampled by a hash of the id (see is_probe_id), not by sample_probe_ids.
+    fd_windows: FD frames of the inflow and outflow (see FDWindows). Without them the
+    experiments are marked partial in the catalog, and a later batch run writes them again.
+    """
+    exp_folder = os.path.join(os.getcwd(), "exp/")
+    os.makedirs(exp_folder, exist_ok=True)
+    catalog_path = os.path.join(exp_folder, CATALOG_FILE)
+    writer = FcdDatasetWriter(dataset_dir) if dataset_dir is not None else None
+    tracker = ProbeRunTracker(LINK_PARAMS["DETECTION_LANE"], LINK_PARAMS["PROBE_LANE"])
+
+    def write_runs(runs):
+        rows = []
+        for idx, probe, detect in runs:
+            output_folder = os.path.join(exp_folder, f"{idx}")
+            if os.path.exists(output_folder):
+                status = "exists"
+            elif write_experiment(output_folder, probe, detect, fd_windows):
+                status = "written"
+                rows.append(catalog_row(idx, probe, detect, "csv", f"{idx}", is_partial(fd_windows)))
+            else:
+                status = "nodetect"
+            report_experiment(idx, status, len(probe), len(detect))
+        if rows:
+            update_catalog(catalog_path, rows)
+
+    print(f"\n[X] Following file {xml_path} ...")
+    try:
+        for batch in follow_xml(xml_path, poll_interval=poll_interval, idle_timeout=idle_timeout):
+            batch = convert_units(batch)
+            if writer is not None:
+                writer.write(batch)
+            write_runs(tracker.push(batch))
+        # Runs still on the link at the end of the simulation
+        write_runs(tracker.flush())
+    finally:
+        if writer is not None:
+            writer.close()
+    print("Done!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental FCD extraction pipeline.")
+    parser.add_argument("--xml", default="sumo_ingolstadt/simulation/output/fcd.xml", help="FCD output of SUMO")
+    parser.add_argument("--fd-dir", default=None,
+                        help=f"Directory of the fd-{{ts}}sec.feather files (default {FD_DIR}; follow mode: none, the experiments are partial)")
+    parser.add_argument("--force", action="store_true", help="Run all the stages")
+    parser.add_argument("--hash", action="store_true", help="Fingerprint files by content instead of size and mtime")
+    parser.add_argument("--metrics", default=None, help="Write the metrics of the stages to this JSON report")
+    parser.add_argument("--profile", default=None, help="Sample the run and write collapsed stacks to this file")
+    parser.add_argument("--follow", action="store_true", help="Process the FCD while SUMO is still writing it")
+    parser.add_argument("--dataset", default=None, help="Follow mode: also write the partitioned FCD dataset here")
+    parser.add_argument("--idle-timeout", type=float, default=60.0, help="Follow mode: stop after this many seconds without new data")
+    parser.add_argument("--links", nargs="?", const=param_file, default=None,
+                        help=f"Extract all the links of this config (the link and its LINKS) in one scan (default {param_file})")
+    parser.add_argument("--out-dir", default="data/", help="Links mode: one folder per link is written here")
+    parser.add_argument("--rates", type=float, nargs="+", default=None, help="Sweep the experiments over these penetration rates")
+    parser.add_argument("--seeds", type=int, nargs="+", default=None, help="Sweep: random seeds of the samples (default 100)")
+    args = parser.parse_args()
+
+    with metrics.profiled(args.profile):
+        if args.follow:
+            fd_windows = FDWindows(fd_dir=args.fd_dir) if args.fd_dir else None
+            follow_fcd(args.xml, dataset_dir=args.dataset, fd_windows=fd_windows, idle_timeout=args.idle_timeout)
+        elif args.links:
+            extract_links(args.xml, read_links_params(args.links), out_dir=args.out_dir)
+        else:
+            run_pipeline(args.xml, fd_dir=args.fd_dir or FD_DIR, force=args.force, use_hash=args.hash,
+                         rates=args.rates, seeds=args.seeds)
+
+    metrics.print_report()
+    if args.metrics:
+        metrics.write_report(args.metrics)
@@ -0,0 +1,125 @@
+import os
+import json
+import numpy as np
+
+## Finest raster cell: time [hr] x position [km]
+RASTER_DT = 10/3600
+RASTER_DX = 0.010
+# Number of resolution levels, each one twice as coarse in time as the previous
+RASTER_LEVELS = 8
+# Most time bins sent to the browser for one image
+MAX_BINS = 1200
+
+
+def raster_file(link, data_dir="data/"):
+    """
+    Raster of a link, where the dashboard reads it.
+    """
+    return os.path.join(data_dir, link, f"raster-{link}.npz")
+
+
+def rasterize(traj, dt=RASTER_DT, dx=RASTER_DX, time_space=(0, 24), road_space=None):
+    """
+    BIN EVERY FCD ROW OF THE LINK INTO A TIME x POSITION RASTER.
+    traj: rows of the link with time [hr], pos [km] and speed [km/hr] (e.g. get_detectData).
+    Returns dict with the row count and the sum of the speeds of each cell, as arrays of
+    shape (n_time, n_space), and the raster geometry. Rows outside the raster are dropped.
+    """
+    time = traj["time"].to_numpy(dtype=float)
+    pos = traj["pos"].to_numpy(dtype=float)
+    speed = traj["speed"].to_numpy(dtype=float)
+    if road_space is None:
+        road_space = (0, np.nanmax(pos, initial=0))
+    n_time = int(np.ceil((time_space[1] - time_space[0]) / dt))
+    n_space = max(int(np.ceil((road_space[1] - road_space[0]) / dx)), 1)
+
+    ## Cell of every row by integer arithmetic, then one bincount per measure
+    # Rows on a bin edge (whole steps in hours) go to the later bin, despite the rounding
+    it = np.floor((time - time_space[0]) / dt + 1e-9)
+    ix = np.floor((pos - road_space[0]) / dx)
+    valid = (it >= 0) & (it < n_time) & (ix >= 0) & (ix < n_space) & ~np.isnan(speed)
+    cell = it[valid].astype(np.int64) * n_space + ix[valid].astype(np.int64)
+    count = np.bincount(cell, minlength=n_time * n_space).reshape(n_time, n_space)
+    speed_sum = np.bincount(cell, weights=speed[valid], minlength=n_time * n_space).reshape(n_time, n_space)
+
+    # Simulation step [hr]: time that one row stands for
+    steps = np.diff(np.unique(time))
+    step = float(np.median(steps)) if len(steps) else 1/3600
+    return dict(count=count.astype(np.float32), speed_sum=speed_sum.astype(np.float32),
+                t0=float(time_space[0]), dt=dt, x0=float(road_space[0]), dx=dx, step=step)
+
+
+def build_levels(raster, n_levels=RASTER_LEVELS):
+    """
+    MULTI-RESOLUTION LEVELS OF THE RASTER: level k merges 2**k time bins of the finest level.
+    Counts and speed sums add up, so every level is exact (not resampled).
+    """
+    levels = [(raster["count"], raster["speed_sum"])]
+    for _ in range(1, n_levels):
+        count, speed_sum = levels[-1]
+        if len(count) < 2:
+            break
+        # Pad to an even number of bins and sum the pairs
+        pad = ((0, len(count) % 2), (0, 0))
+        count = np.pad(count, pad)
+        speed_sum = np.pad(speed_sum, pad)
+        levels.append((count[0::2] + count[1::2], speed_sum[0::2] + speed_sum[1::2]))
+    return levels
+
+
+def save_raster(fpath, raster, n_levels=RASTER_LEVELS):
+    """
+    Write all the levels of the raster in one compressed .npz file.
+    """
+    levels = build_levels(raster, n_levels)
+    arrays = {}
+    for k, (count, speed_sum) in enumerate(levels):
+        arrays[f"count_{k}"] = count
+        arrays[f"speed_sum_{k}"] = speed_sum
+    meta = {key: raster[key] for key in ("t0", "dt", "x0", "dx", "step")}
+    meta["n_levels"] = len(levels)
+    np.savez_compressed(fpath, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load_raster(fpath):
+    """
+    Read the levels written by save_raster: dict with the geometry and the list of levels.
+    """
+    with np.load(fpath) as f:
+        raster = json.loads(str(f["meta"]))
+        raster["levels"] = [(f[f"count_{k}"], f[f"speed_sum_{k}"]) for k in range(raster["n_levels"])]
+    return raster
+
+
+def raster_image(raster, measure="speed", t_range=None, max_bins=MAX_BINS):
+    """
+    IMAGE OF THE RASTER FOR THE TIME WINDOW t_range [hr], AT THE FINEST LEVEL WITH AT MOST
+    max_bins TIME BINS IN THE WINDOW.
+    measure: "speed" (mean speed [km/hr]) or "density" [veh/km].
+    Returns (time, pos, image, level): the bin centres and the (n_space, n_time) image.
+    """
+    t0, dt, x0, dx = raster["t0"], raster["dt"], raster["x0"], raster["dx"]
+    n_finest = len(raster["levels"][0][0])
+    if t_range is None:
+        t_range = (t0, t0 + n_finest * dt)
+    span = (t_range[1] - t_range[0]) / dt
+
+    ## Finest level that fits the zoom
+    level = 0
+    while level < len(raster["levels"]) - 1 and span / 2**level > max_bins:
+        level += 1
+    count, speed_sum = raster["levels"][level]
+    dt_level = dt * 2**level
+    lo = max(int(np.floor((t_range[0] - t0) / dt_level)), 0)
+    hi = min(int(np.ceil((t_range[1] - t0) / dt_level)), len(count))
+    count, speed_sum = count[lo:hi], speed_sum[lo:hi]
+
+    if measure == "speed":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            image = np.where(count > 0, speed_sum / count, np.nan)
+    else:
+        # Every row is one vehicle during one simulation step
+        image = count * raster["step"] / (dt_level * dx)
+    time = t0 + (np.arange(lo, hi) + 0.5) * dt_level
+    pos = x0 + (np.arange(count.shape[1]) + 0.5) * dx
+    return time, pos, image.T, level
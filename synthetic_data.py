@@ -0,0 +1,199 @@
+import os
+import time
+import argparse
+import numpy as np
+
+from fcd_data import LINK_PARAMS, FD_TIMESTEPS
+
+## Header and footer of the SUMO FCD output
+FCD_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+              '<fcd-export xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+              'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/fcd_file.xsd">\n')
+FCD_FOOTER = '</fcd-export>\n'
+# Header and footer of the SUMO edgeData output
+FD_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+             '<meandata xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+             'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/meandata_file.xsd">\n')
+FD_FOOTER = '</meandata>\n'
+
+
+def arrival_rate(n_vehicles, duration, n_lanes):
+    """
+    Arrivals per second per lane for n_vehicles over duration [s].
+    """
+    return n_vehicles / duration / n_lanes
+
+
+def iter_steps(n_steps, step_length=1.0, rate=0.2, lanes=None, seed=0):
+    """
+    SYNTHETIC TRAFFIC ON THE LINK, ONE SIMULATION STEP AT A TIME.
+    Vehicles arrive on the lanes (by default the probe and detection lanes of LinkParams.json)
+    as a Poisson process of rate vehicles per second per lane, drive the ROAD_LENGTH at a
+    random speed and leave.
+    Yields (time, vehicles, entered, left): the vehicles dict id -> {lane, pos, speed} at
+    the step, and the ids that entered and left the link since the previous step.
+    """
+    rng = np.random.default_rng(seed)
+    lanes = LINK_PARAMS["PROBE_LANE"] + LINK_PARAMS["DETECTION_LANE"] if lanes is None else lanes
+    road_length = LINK_PARAMS["ROAD_LENGTH"]
+    vehicles = {}
+    n_veh = 0
+    for step in range(n_steps):
+        t = step * step_length
+        ## New vehicles at the start of the lanes
+        entered = []
+        for lane in lanes:
+            for _ in range(rng.poisson(rate * step_length)):
+                idx = f"veh_{n_veh}"
+                vehicles[idx] = {"lane": lane, "pos": 0.0, "speed": rng.uniform(5, 13)}
+                entered.append(idx)
+                n_veh += 1
+        ## Vehicles that reach the end of the link leave it
+        left = [(idx, vehicles.pop(idx)) for idx in [idx for idx, veh in vehicles.items() if veh["pos"] > road_length]]
+        yield t, vehicles, entered, left
+        for veh in vehicles.values():
+            veh["pos"] += veh["speed"] * step_length
+
+
+def timestep_xml(t, vehicles):
+    """
+    XML text of one <timestep> of the FCD output.
+    """
+    if not vehicles:
+        return f'    <timestep time="{t:.2f}"/>\n'
+    lines = [f'    <timestep time="{t:.2f}">\n']
+    for idx, veh in vehicles.items():
+        lines.append(f'        <vehicle id="{idx}" x="{veh["pos"]:.2f}" y="0.00" angle="90.00" '
+                     f'type="opti_driver_1" speed="{veh["speed"]:.2f}" pos="{veh["pos"]:.2f}" '
+                     f'lane="{veh["lane"]}" slope="0.00"/>\n')
+    lines.append('    </timestep>\n')
+    return "".join(lines)
+
+
+def iter_timesteps(n_steps, step_length=1.0, arrival_rate=0.2, seed=0):
+    """
+    Yields the XML text of each timestep of the synthetic traffic (see iter_steps).
+    """
+    for t, vehicles, _, _ in iter_steps(n_steps, step_length, arrival_rate, seed=seed):
+        yield timestep_xml(t, vehicles)
+
+
+class _EdgeDataAccumulator:
+    """
+    edgeData measures of the detection lanes, per interval of freq seconds.
+    """
+    def __init__(self, freq, duration, n_lanes):
+        self.freq = freq
+        self.n_lanes = n_lanes
+        n = int(np.ceil(duration / freq))
+        self.sampled = np.zeros(n)
+        self.speed_time = np.zeros(n)
+        self.entered = np.zeros(n, dtype=np.int64)
+        self.left = np.zeros(n, dtype=np.int64)
+
+    def add(self, t, step_length, speeds, n_entered, n_left):
+        k = min(int(t // self.freq), len(self.sampled) - 1)
+        self.sampled[k] += len(speeds) * step_length
+        self.speed_time[k] += sum(speeds) * step_length
+        self.entered[k] += n_entered
+        self.left[k] += n_left
+
+    def write(self, xml_path, edge_id):
+        road_length = LINK_PARAMS["ROAD_LENGTH"] / 1000
+        with open(xml_path, "w") as f:
+            f.write(FD_HEADER)
+            for k in range(len(self.sampled)):
+                begin, end = k * self.freq, (k + 1) * self.freq
+                f.write(f'    <interval begin="{begin:.2f}" end="{end:.2f}" id="myEdgeData">\n')
+                # Density [veh/km] and mean speed [m/s] of the interval
+                density = self.sampled[k] / self.freq / road_length
+                speed = self.speed_time[k] / self.sampled[k] if self.sampled[k] > 0 else 0.0
+                f.write(f'        <edge id="{edge_id}" sampledSeconds="{self.sampled[k]:.2f}" '
+                        f'traveltime="{road_length * 1000 / speed if speed > 0 else 0:.2f}" '
+                        f'overlapTraveltime="{road_length * 1000 / speed if speed > 0 else 0:.2f}" '
+                        f'density="{density:.2f}" laneDensity="{density / self.n_lanes:.2f}" '
+                        f'occupancy="{density / self.n_lanes * 0.5:.2f}" waitingTime="0.00" timeLoss="0.00" '
+                        f'speed="{speed:.2f}" speedRelative="{speed / 13.89:.2f}" departed="0" arrived="0" '
+                        f'entered="{self.entered[k]}" left="{self.left[k]}" laneChangedFrom="0" laneChangedTo="0"/>\n')
+                f.write('    </interval>\n')
+            f.write(FD_FOOTER)
+
+
+def write_outputs(out_dir, n_vehicles=1000, duration=3600, step_length=1.0, lanes=None,
+                  fd_timesteps=FD_TIMESTEPS, seed=0):
+    """
+    WRITE A SYNTHETIC SUMO OUTPUT FOLDER: fcd.xml, fd-{ts}sec.xml AND fd-config.xml.
+    n_vehicles arrive over duration [s] on the lanes (default: the lanes of LinkParams.json);
+    the edgeData outputs measure the detection lanes of the same traffic, so the FD and the
+    FCD agree. Returns the path of fcd.xml.
+    """
+    lanes = LINK_PARAMS["PROBE_LANE"] + LINK_PARAMS["DETECTION_LANE"] if lanes is None else lanes
+    detect_lanes = [lane for lane in lanes if lane in LINK_PARAMS["DETECTION_LANE"]]
+    # Edge of the detection lanes: the lane id without the lane index
+    edge_id = detect_lanes[0].rsplit("_", 1)[0] if detect_lanes else "edge"
+    os.makedirs(out_dir, exist_ok=True)
+    n_steps = int(round(duration / step_length))
+    rate = arrival_rate(n_vehicles, duration, len(lanes))
+    fd = [_EdgeDataAccumulator(ts, duration, max(len(detect_lanes), 1)) for ts in fd_timesteps]
+
+    fcd_path = os.path.join(out_dir, "fcd.xml")
+    with open(fcd_path, "w") as f:
+        f.write(FCD_HEADER)
+        for t, vehicles, entered, left in iter_steps(n_steps, step_length, rate, lanes, seed):
+            f.write(timestep_xml(t, vehicles))
+            speeds = [veh["speed"] for veh in vehicles.values() if veh["lane"] in detect_lanes]
+            n_entered = sum(vehicles[idx]["lane"] in detect_lanes for idx in entered)
+            n_left = sum(veh["lane"] in detect_lanes for _, veh in left)
+            for acc in fd:
+                acc.add(t, step_length, speeds, n_entered, n_left)
+        f.write(FCD_FOOTER)
+
+    ## edgeData outputs and their configuration
+    for acc in fd:
+        acc.write(os.path.join(out_dir, f"fd-{acc.freq}sec.xml"), edge_id)
+    with open(os.path.join(out_dir, "fd-config.xml"), "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<additional>\n')
+        for ts in fd_timesteps:
+            f.write(f'    <edgeData  id="myEdgeData" freq="{ts}" file="fd-{ts}sec.xml" edges="{edge_id}" excludeEmpty="False"/>\n')
+        f.write('</additional>\n')
+    return fcd_path
+
+
+def append_timesteps(xml_path, n_steps, step_length=1.0, delay=0.0, batch=10, seed=0):
+    """
+    WRITE A SYNTHETIC FCD OUTPUT THE WAY SUMO DOES, A FEW TIMESTEPS AT A TIME.
+    batch timesteps are appended and flushed every delay seconds [s], so a reader can
+    follow the growing file (see follow_xml). The root element is closed at the end.
+    """
+    with open(xml_path, "w") as f:
+        f.write(FCD_HEADER)
+        for step, text in enumerate(iter_timesteps(n_steps, step_length, seed=seed)):
+            f.write(text)
+            if (step + 1) % batch == 0:
+                f.flush()
+                os.fsync(f.fileno())
+                time.sleep(delay)
+        f.write(FCD_FOOTER)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic SUMO outputs (FCD and edgeData) for the link of LinkParams.json.")
+    parser.add_argument("out", help="Output folder, or the FCD file to append to with --follow")
+    parser.add_argument("--vehicles", type=int, default=1000, help="Number of vehicles")
+    parser.add_argument("--duration", type=float, default=3600, help="Simulated time [s]")
+    parser.add_argument("--step-length", type=float, default=1.0, help="Simulation step [s]")
+    parser.add_argument("--lanes", nargs="+", default=None, help="Lanes (default: probe and detection lanes)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--follow", action="store_true", help="Append timesteps to one FCD file, like a running simulation")
+    parser.add_argument("--delay", type=float, default=0.1, help="Follow: seconds between two appends")
+    parser.add_argument("--batch", type=int, default=10, help="Follow: timesteps per append")
+    args = parser.parse_args()
+
+    n_steps = int(round(args.duration / args.step_length))
+    if args.follow:
+        print(f"\n[X] Writing {n_steps} timesteps to {args.out} ...", end=" ")
+        append_timesteps(args.out, n_steps, args.step_length, args.delay, args.batch, args.seed)
+    else:
+        print(f"\n[X] Writing synthetic outputs to {args.out} ...", end=" ")
+        write_outputs(args.out, args.vehicles, args.duration, args.step_length, args.lanes, seed=args.seed)
+    print("Done!")
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+## The scripts read LinkParams.json from the working directory when they are imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import fd_data
+import synthetic_data
+from fcd_data import (LINK_PARAMS, FD_TIMESTEPS, parse_xml, convert_units,
+                      get_detectData, get_probeData)
+
+
+@pytest.fixture(scope="session")
+def sumo_output(tmp_path_factory):
+    """
+    Synthetic SUMO output folder of the link (see synthetic_data.write_outputs), with the
+    fd-{ts}sec.feather files of its edgeData outputs.
+    """
+    out_dir = tmp_path_factory.mktemp("output")
+    synthetic_data.write_outputs(str(out_dir), n_vehicles=300, duration=900)
+    for ts in FD_TIMESTEPS:
+        fd_data.convert_fd(str(out_dir / f"fd-{ts}sec.xml"), ts, n_lanes=LINK_PARAMS["N_LANES"])
+    return out_dir
+
+
+@pytest.fixture(scope="session")
+def fcd(sumo_output):
+    return convert_units(parse_xml(str(sumo_output / "fcd.xml")))
+
+
+@pytest.fixture(scope="session")
+def detect_data(fcd):
+    return get_detectData(fcd, LINK_PARAMS["DETECTION_LANE"])
+
+
+@pytest.fixture(scope="session")
+def probe_data(fcd):
+    return get_probeData(fcd, LINK_PARAMS["PROBE_LANE"])
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from camera_view import VIEW_DISTANCE, FIELD_OF_VIEW, observed_trajectories
+
+
+def _vehicles(rng, prefix, n_ids, n_steps):
+    # Vehicles scattered over 1 km x 1 km, in meters, one row per id and timestep
+    rows = n_ids * n_steps
+    return pd.DataFrame({"time": np.tile(np.arange(n_steps), n_ids) / 3600,
+                         "id": np.repeat([f"{prefix}_{k}" for k in range(n_ids)], n_steps),
+                         "x": rng.uniform(0, 1000, rows), "y": rng.uniform(0, 1000, rows),
+                         "angle": rng.uniform(0, 360, rows)})
+
+
+def _brute_force(probeData, carData):
+    # Every probe row against every detected row of its timestep
+    seen = []
+    for probe_row, probe in probeData.iterrows():
+        cars = carData[np.isclose(carData["time"], probe["time"])]
+        dx, dy = (cars["x"] - probe["x"]) / 1000, (cars["y"] - probe["y"]) / 1000
+        distance = np.hypot(dx, dy)
+        bearing = (np.degrees(np.arctan2(dx, dy)) - probe["angle"] + 180) % 360 - 180
+        ok = ((distance >= VIEW_DISTANCE[0]) & (distance <= VIEW_DISTANCE[1])
+              & (bearing.abs() <= FIELD_OF_VIEW / 2) & (cars["id"] != probe["id"]))
+        seen += [(probe["id"], probe_row, car_id) for car_id in cars.loc[ok, "id"]]
+    return sorted(seen)
+
+
+def test_observed_trajectories_match_brute_force():
+    rng = np.random.default_rng(0)
+    probeData = _vehicles(rng, "probe", 6, 5)
+    carData = pd.concat([_vehicles(rng, "car", 60, 5), probeData], ignore_index=True)
+    observed = observed_trajectories(probeData, carData)
+    expected = _brute_force(probeData, carData)
+    assert len(expected) > 0
+    assert sorted(zip(observed["probe_id"], observed["probe_row"], observed["id"])) == expected
+    assert (observed["distance"] <= VIEW_DISTANCE[1]).all()
+
+    ## Only the given probe ids
+    ids = ["probe_1", "probe_4"]
+    subset = observed_trajectories(probeData, carData, ids=ids)
+    assert set(subset["probe_id"]) <= set(ids)
+    assert len(subset) == observed["probe_id"].isin(ids).sum()
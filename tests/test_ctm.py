@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import ctm
+from edie import num_time_cells, num_space_cells, edie_cells, edie_measures
+from fcd_data import LINK_PARAMS, FDWindows
+
+DELTAX, DELTAT, ROAD = 0.086, 3 / 3600, 0.43
+VF, RHO_C = LINK_PARAMS["ESTIM_VF"], LINK_PARAMS["ESTIM_RHO_C"]
+
+
+def _scalar_ctm(fd_windows, t0, t1, n_split, ts=3):
+    # One window, one cell at a time
+    frame = fd_windows.frame(ts)
+
+    def fd_at(t, col):
+        match = (frame["begin-hr"] <= t) & (t < frame["end-hr"])
+        return float(np.nan_to_num(frame.loc[match, col].iloc[0])) if match.any() else 0.0
+
+    def q(rho):
+        return VF * rho * (1 - rho / (2 * RHO_C))
+
+    n_time, n_space = int(num_time_cells(DELTAT, t0, t1)), num_space_cells(DELTAX, [0, ROAD])
+    dx = DELTAX / n_split
+    n_sub = max(int(np.ceil(VF * DELTAT / dx)), 1)
+    rho = [min(max(fd_at(t0, "laneDensity"), 0), 2 * RHO_C)] * (n_space * n_split)
+    density, flow = np.zeros((n_time, n_space)), np.zeros((n_time, n_space))
+    for k in range(n_time):
+        t_mid = t0 + (k + 0.5) * DELTAT
+        for _ in range(n_sub):
+            send = [q(min(r, RHO_C)) for r in rho]
+            receive = [q(min(max(r, RHO_C), 2 * RHO_C)) for r in rho]
+            flux = ([min(fd_at(t_mid, "inflow"), receive[0])]
+                    + [min(send[i], receive[i + 1]) for i in range(len(rho) - 1)]
+                    + [min(send[-1], fd_at(t_mid, "outflow"))])
+            for j in range(len(rho)):
+                density[k, j // n_split] += rho[j] / (n_sub * n_split)
+                flow[k, j // n_split] += (flux[j] + flux[j + 1]) / 2 / (n_sub * n_split)
+            rho = [rho[i] + DELTAT / n_sub / dx * (flux[i] - flux[i + 1]) for i in range(len(rho))]
+    return density, flow
+
+
+def _windows(probe_data, n):
+    runs = probe_data.groupby("id", observed=True)["time"].agg(["min", "max"])
+    return runs.to_numpy()[:n]
+
+
+@pytest.mark.parametrize("sub_dx, n_split", [(None, 2), (DELTAX, 1)])
+def test_batched_ctm_matches_scalar(sumo_output, probe_data, monkeypatch, sub_dx, n_split):
+    # Several batches of windows of different lengths
+    monkeypatch.setattr(ctm, "WINDOW_BATCH", 3)
+    fd_windows = FDWindows(fd_dir=str(sumo_output))
+    windows = _windows(probe_data, 8)
+    estimate = ctm.ctm_estimate(windows, fd_windows, deltaX=DELTAX, deltaT=DELTAT,
+                                road_space=[0, ROAD], sub_dx=sub_dx)
+    assert estimate["density"].shape == (estimate["num_time"].sum(), num_space_cells(DELTAX, [0, ROAD]))
+    for i, (t0, t1) in enumerate(windows):
+        density, flow = _scalar_ctm(fd_windows, t0, t1, n_split)
+        assert np.allclose(ctm.window_cells(estimate, i), density)
+        assert np.allclose(ctm.window_cells(estimate, i, "flow"), flow)
+
+
+def test_estimate_errors_match_brute_force(sumo_output, probe_data, detect_data):
+    fd_windows = FDWindows(fd_dir=str(sumo_output))
+    windows = _windows(probe_data, 12)
+    estimate = ctm.ctm_estimate(windows, fd_windows, deltaX=DELTAX, deltaT=DELTAT, road_space=[0, ROAD])
+    cells = edie_cells(detect_data, windows, DELTAX, DELTAT, [0, ROAD])
+    truth = edie_measures(cells)
+    rmse = ctm.estimate_errors(estimate, cells)
+    for i, n in enumerate(estimate["num_time"]):
+        for measure in ("density", "flow"):
+            err = ctm.window_cells(estimate, i, measure) - truth[measure][i, :n]
+            expected = np.sqrt((err ** 2).mean()) if n else 0.0
+            assert np.isclose(rmse[measure][i], expected)
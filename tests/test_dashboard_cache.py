@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import numpy as np
+
+import dashboard_cache
+from dashboard_cache import LRUCache
+from fd_data import _plot_array
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    built = []
+
+    def build(key):
+        built.append(key)
+        return key
+
+    cache.get("a", [], lambda: build("a"))
+    cache.get("b", [], lambda: build("b"))
+    # "a" is used again, so "b" goes first
+    assert cache.get("a", [], lambda: build("a")) == "a"
+    cache.get("c", [], lambda: build("c"))
+    assert list(cache.entries) == ["a", "c"]
+    cache.get("b", [], lambda: build("b"))
+    assert built == ["a", "b", "c", "b"]
+
+
+def test_lru_cache_rebuilds_when_a_source_changes(tmp_path):
+    path = tmp_path / "source.txt"
+    path.write_text("one")
+    cache = LRUCache()
+
+    def load():
+        return path.read_text() if path.exists() else None
+
+    assert cache.get("key", [str(path)], load) == "one"
+    path.write_text("three")
+    assert cache.get("key", [str(path)], load) == "three"
+    path.unlink()
+    assert cache.get("key", [str(path)], load) is None
+    cache.clear()
+    assert not cache.entries
+
+
+def test_fd_figure_writes_its_cache_on_first_load(tmp_path, monkeypatch):
+    link = "Link-1"
+    os.makedirs(tmp_path / "data" / link)
+    shutil.copy(dashboard_cache.fd_plot_path(link), tmp_path / "data" / link)
+    json_fig = dashboard_cache.plotlyfromjson(dashboard_cache.fd_plot_path(link))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dashboard_cache, "FIGURES", LRUCache())
+
+    fig = dashboard_cache.load_fd_figure(link)
+    assert os.path.exists(tmp_path / "data" / link / f"fd_plot-{link}.feather")
+    assert fig.layout.title.text == json_fig.layout.title.text
+    assert np.allclose(fig.data[0].x, _plot_array(json_fig.data[0].x), equal_nan=True)
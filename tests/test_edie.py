@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from edie import MAX_GAP, num_time_cells, num_space_cells, edie_cells, edie_measures
+
+DELTAX, DELTAT, ROAD = 0.086, 3 / 3600, 0.43
+# Pieces of every trajectory segment in the brute-force sums
+N_PIECES = 400
+
+
+def _brute_force_cells(traj, windows):
+    # Every segment cut into equal pieces, each piece counted in the cell of its midpoint
+    n_time = num_time_cells(DELTAT, windows[:, 0], windows[:, 1])
+    n_space = num_space_cells(DELTAX, [0, ROAD])
+    distance = np.zeros((len(windows), n_time.max(), n_space))
+    time = np.zeros_like(distance)
+    s = (np.arange(N_PIECES) + 0.5) / N_PIECES
+    for _, veh in traj.sort_values("time").groupby("id", observed=True):
+        t, x = veh["time"].to_numpy(), veh["pos"].to_numpy()
+        for k in range(len(t) - 1):
+            dt = t[k + 1] - t[k]
+            if not 0 < dt <= MAX_GAP:
+                continue
+            tm, xm = t[k] + s * dt, x[k] + s * (x[k + 1] - x[k])
+            for w, (t0, _) in enumerate(windows):
+                it = np.floor((tm - t0) / DELTAT).astype(int)
+                ix = np.floor(xm / DELTAX).astype(int)
+                ok = (it >= 0) & (it < n_time[w]) & (ix >= 0) & (ix < n_space)
+                np.add.at(distance[w], (it[ok], ix[ok]), abs(x[k + 1] - x[k]) / N_PIECES)
+                np.add.at(time[w], (it[ok], ix[ok]), dt / N_PIECES)
+    return distance, time
+
+
+def test_edie_cells_match_brute_force(probe_data, detect_data):
+    runs = probe_data.groupby("id", observed=True)["time"].agg(["min", "max"])
+    windows = runs.to_numpy()[:4]
+    traj = detect_data[detect_data["time"] <= windows[:, 1].max()]
+    cells = edie_cells(traj, windows, DELTAX, DELTAT, [0, ROAD])
+    distance, time = _brute_force_cells(traj, windows)
+
+    assert cells["distance"].shape == distance.shape
+    assert distance.sum() > 0
+    # Only the pieces across a cell edge can land in the neighbouring cell
+    assert np.abs(cells["distance"] - distance).max() < 0.01 * max(distance.max(), 1e-9)
+    assert np.abs(cells["time"] - time).max() < 0.01 * max(time.max(), 1e-9)
+    assert np.isclose(cells["distance"].sum(), distance.sum(), rtol=1e-3)
+    assert np.isclose(cells["time"].sum(), time.sum(), rtol=1e-3)
+
+
+def test_edie_measures_of_one_vehicle():
+    # One vehicle at 36 km/h over the whole road, one row per second
+    t = np.arange(0, 44) / 3600
+    traj = pd.DataFrame({"id": "veh", "time": t, "pos": 36 * t})
+    cells = edie_cells(traj, np.array([[0, t[-1]]]), DELTAX, DELTAT, [0, ROAD])
+    measures = edie_measures(cells)
+    visited = cells["time"] > 0
+    assert np.allclose(measures["speed"][visited], 36)
+    # Distance driven in the time cells of the window
+    assert np.isclose(cells["distance"].sum(), 36 * cells["num_time"][0] * DELTAT)
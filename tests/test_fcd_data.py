@@ -0,0 +1,292 @@
+import gzip
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fcd_data
+import synthetic_data
+from fcd_data import (LINK_PARAMS, FCD_COLUMNS, FCD_FLOAT_COLUMNS, FCD_STR_COLUMNS, parse_xml, compact_fcd,
+                      stream_to_feather, read_fcd, get_probeData, stream_to_dataset, write_fcd_dataset,
+                      read_fcd_dataset, FDWindows, probe_runs, iter_probe_runs, generate_expData,
+                      write_exp_store, read_exp_manifest, read_experiment, export_exp_csv,
+                      CATALOG_FILE, update_catalog, catalog_row, lttb, convert_units, split_links, iter_xml)
+
+
+def _tree_parse(xml_path):
+    # The whole tree at once, one row per vehicle and per empty timestep
+    rows = []
+    for timestep in ET.parse(xml_path).getroot().findall("timestep"):
+        vehicles = timestep.findall("vehicle") or [ET.Element("vehicle")]
+        for vehicle in vehicles:
+            rows.append([float(timestep.get("time"))] + [vehicle.get(col) for col in FCD_COLUMNS[1:]])
+    df = pd.DataFrame(rows, columns=FCD_COLUMNS)
+    df[FCD_FLOAT_COLUMNS] = df[FCD_FLOAT_COLUMNS].astype(float)
+    return df
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 500_000])
+def test_streaming_parse_matches_tree_parse(sumo_output, chunk_size):
+    xml_path = str(sumo_output / "fcd.xml")
+    expected = _tree_parse(xml_path)
+    assert expected["id"].isna().any()
+    pd.testing.assert_frame_equal(parse_xml(xml_path, chunk_size=chunk_size), expected)
+
+
+def test_stream_to_feather_matches_parse(sumo_output, fcd):
+    path = stream_to_feather(str(sumo_output / "fcd.xml"), chunk_size=1000)
+    pd.testing.assert_frame_equal(pd.read_feather(path), fcd)
+
+
+def test_compact_schema_keeps_the_values(sumo_output, fcd, tmp_path):
+    xml_path = str(sumo_output / "fcd.xml")
+    compact = parse_xml(xml_path, chunk_size=1000, compact=True)
+    assert compact["time"].dtype == np.float64
+    assert all(isinstance(compact[col].dtype, pd.CategoricalDtype) for col in FCD_STR_COLUMNS)
+    assert all(compact[col].dtype == np.float32 for col in FCD_FLOAT_COLUMNS)
+    pd.testing.assert_frame_equal(compact, compact_fcd(parse_xml(xml_path)), check_categorical=False)
+
+    ## Categories shared across the batches survive the feather round trip
+    shutil.copy(xml_path, tmp_path / "fcd.xml")
+    path = stream_to_feather(str(tmp_path / "fcd.xml"), chunk_size=1000, compact=True)
+    pd.testing.assert_frame_equal(pd.read_feather(path), compact_fcd(fcd.copy()), check_categorical=False)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_parallel_parse_matches_serial(sumo_output, compact):
+    xml_path = str(sumo_output / "fcd.xml")
+    serial = parse_xml(xml_path, chunk_size=5000, compact=compact)
+    parallel = parse_xml(xml_path, chunk_size=5000, workers=3, compact=compact)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_more_workers_than_timesteps(tmp_path):
+    # A short file splits into fewer shards than workers
+    synthetic_data.write_outputs(str(tmp_path), n_vehicles=20, duration=20)
+    xml_path = str(tmp_path / "fcd.xml")
+    pd.testing.assert_frame_equal(parse_xml(xml_path), parse_xml(xml_path, workers=32))
+
+
+def test_gzip_input_and_time_windows(sumo_output, tmp_path):
+    gz_path = tmp_path / "fcd.xml.gz"
+    with open(sumo_output / "fcd.xml", "rb") as f, gzip.open(gz_path, "wb") as g:
+        shutil.copyfileobj(f, g)
+    raw = parse_xml(str(sumo_output / "fcd.xml"))
+    pd.testing.assert_frame_equal(parse_xml(str(gz_path)), raw)
+
+    for path in (str(sumo_output / "fcd.xml"), str(gz_path)):
+        for t0, t1 in [(100, 250), (0, 0), (899, None), (None, 10), (950, 1000)]:
+            expected = raw[(raw["time"] >= (t0 or 0)) & (raw["time"] <= (np.inf if t1 is None else t1))]
+            window = read_fcd(path, t0, t1)
+            assert len(window) == len(expected)
+            if len(expected):
+                pd.testing.assert_frame_equal(window, expected.reset_index(drop=True))
+
+
+def test_dataset_roundtrip(sumo_output, fcd, tmp_path):
+    stream_to_dataset(str(sumo_output / "fcd.xml"), str(tmp_path), chunk_size=5000)
+    lanes = LINK_PARAMS["PROBE_LANE"]
+    expected = fcd[fcd["lane"].isin(lanes)].reset_index(drop=True)
+    actual = read_fcd_dataset(str(tmp_path), lanes=lanes)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    ## Time predicates
+    t0, t1 = 0.05, 0.1
+    window = expected[(expected["time"] >= t0) & (expected["time"] <= t1)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_fcd_dataset(str(tmp_path), lanes=lanes, t0=t0, t1=t1),
+                                  window, check_dtype=False)
+
+    ## The dataset and the dataframe reverse the probe positions alike
+    pd.testing.assert_frame_equal(get_probeData(str(tmp_path), lanes),
+                                  get_probeData(fcd, lanes), check_dtype=False)
+
+
+def test_dataset_partitions_of_several_hours(fcd, tmp_path):
+    # The same traffic over 2.5 hours, written as one batch
+    long = fcd.dropna(subset=["lane"]).assign(time=fcd["time"] * 10)
+    manifest = write_fcd_dataset(long, str(tmp_path))
+    assert sorted({info["hour"] for info in manifest["partitions"]}) == [0, 1, 2]
+    for info in manifest["partitions"]:
+        assert os.path.exists(tmp_path / info["path"])
+    t0, t1 = 0.9, 2.1
+    expected = long[(long["time"] >= t0) & (long["time"] <= t1)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_fcd_dataset(str(tmp_path), t0=t0, t1=t1), expected, check_dtype=False)
+
+    ## Batches must come in time order
+    with pytest.raises(ValueError):
+        write_fcd_dataset([long[long["time"] >= 1], long[long["time"] < 1]], str(tmp_path / "unordered"))
+
+
+@pytest.mark.parametrize("ts", [2, 5])
+def test_fd_windows_match_brute_force(sumo_output, ts):
+    fd_windows = FDWindows(fd_dir=str(sumo_output))
+    # The frame is read at the first query
+    fd_windows.window(ts, 0, 0)
+    frame = fd_windows.frames[ts]
+    begin, end = frame["begin-hr"].to_numpy(), frame["end-hr"].to_numpy()
+    rng = np.random.default_rng(0)
+    for t0 in rng.uniform(0, 0.25, 50):
+        t1 = t0 + rng.uniform(0, 0.02)
+        inside = np.flatnonzero(((begin >= t0) & (begin <= t1)) | ((end >= t0) & (end <= t1)))
+        lo, hi = fd_windows.window(ts, t0, t1)
+        if len(inside):
+            assert (lo, hi) == (inside[0], inside[-1] + 1)
+        else:
+            assert lo >= hi
+        entered, left = fd_windows.counts(ts, t0, t1)
+        assert entered == frame["entered"].iloc[lo:hi].sum()
+        assert left == frame["left"].iloc[lo:hi].sum()
+
+
+def test_fd_windows_refuse_several_edges(sumo_output, tmp_path):
+    fd = pd.read_feather(sumo_output / "fd-2sec.feather")
+    pd.concat([fd, fd.assign(laneid="other")], ignore_index=True).to_feather(tmp_path / "fd-2sec.feather")
+    with pytest.raises(ValueError):
+        FDWindows(fd_dir=str(tmp_path)).frame(2)
+
+
+def test_probe_runs_match_brute_force(probe_data, detect_data):
+    ids = probe_data["id"].unique()[:40]
+    for idx, probe, detect in iter_probe_runs(ids, probe_data, detect_data):
+        expected_probe = probe_data[probe_data["id"] == idx]
+        t0, t1 = expected_probe["time"].min(), expected_probe["time"].max()
+        expected_detect = detect_data[(detect_data["time"] >= t0) & (detect_data["time"] <= t1)]
+        pd.testing.assert_frame_equal(probe, expected_probe)
+        pd.testing.assert_frame_equal(detect.sort_index(), expected_detect)
+
+    runs, _, _ = probe_runs(probe_data, detect_data)
+    assert set(runs.index) == set(probe_data["id"].unique())
+
+
+def _read_tree(folder):
+    # Content of every file under the folder, by relative path
+    files = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, folder)] = f.read()
+    return files
+
+
+def test_parallel_experiments_match_serial(sumo_output, probe_data, detect_data, tmp_path, monkeypatch):
+    ids = probe_data["id"].drop_duplicates().sample(frac=0.3, random_state=100).to_list()
+    fd_windows = FDWindows(fd_dir=str(sumo_output))
+    for name, workers in [("serial", 1), ("parallel", 2)]:
+        os.makedirs(tmp_path / name)
+        monkeypatch.chdir(tmp_path / name)
+        generate_expData(ids, probe_data, detect_data, fd_windows=fd_windows, workers=workers)
+    serial = _read_tree(tmp_path / "serial")
+    parallel = _read_tree(tmp_path / "parallel")
+    assert len(serial) and serial.keys() == parallel.keys()
+    for path in serial:
+        assert serial[path] == parallel[path], path
+
+
+def test_exp_store_exports_the_csv_experiments(sumo_output, probe_data, detect_data, tmp_path, monkeypatch):
+    ids = list(probe_data["id"].unique()[:15])
+    fd_windows = FDWindows(fd_dir=str(sumo_output))
+    monkeypatch.chdir(tmp_path)
+    generate_expData(ids, probe_data, detect_data, fd_windows=fd_windows)
+    write_exp_store(ids, probe_data, detect_data, store_dir=str(tmp_path / "store"), fd_windows=fd_windows)
+
+    store_manifest = read_exp_manifest(str(tmp_path / "store"))
+    for idx in store_manifest[0].index[:3]:
+        assert read_experiment(str(tmp_path / "store"), idx).keys() == \
+            read_experiment(str(tmp_path / "store"), idx, store_manifest).keys()
+
+    export_exp_csv(str(tmp_path / "store"), str(tmp_path / "export"))
+    csv = _read_tree(tmp_path / "exp")
+    export = _read_tree(tmp_path / "export")
+    csv.pop(CATALOG_FILE)
+    assert len(csv) and csv.keys() == export.keys()
+    for path in csv:
+        assert csv[path] == export[path], path
+
+
+def test_update_catalog_keeps_probe_id_dtype(probe_data, detect_data, tmp_path):
+    catalog_path = str(tmp_path / CATALOG_FILE)
+    probe = probe_data.iloc[:10]
+    update_catalog(catalog_path, [catalog_row(1, probe, detect_data, "csv", "1"),
+                                  catalog_row(2, probe, detect_data, "csv", "2")])
+    update_catalog(catalog_path, [catalog_row(2, probe, detect_data.iloc[:5], "csv", "2")])
+    catalog = update_catalog(catalog_path, [])
+    assert catalog["probe_id"].dtype == np.int64
+    assert catalog["probe_id"].tolist() == [1, 2]
+    assert catalog.set_index("probe_id").loc[2, "n_detect"] == 5
+
+
+def test_partial_experiments_are_written_again(sumo_output, probe_data, detect_data, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ids = list(probe_data["id"].unique()[:10])
+    generate_expData(ids, probe_data, detect_data, fd_windows=FDWindows(timesteps=[]))
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert len(catalog) and catalog["partial"].all()
+
+    generate_expData(ids, probe_data, detect_data, fd_windows=FDWindows(fd_dir=str(sumo_output)))
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert not catalog["partial"].any()
+    for path in catalog["path"]:
+        assert os.path.exists(tmp_path / "exp" / path / "inflow-2sec.csv")
+
+
+def test_lttb():
+    x = np.linspace(0, 1, 1000)
+    y = np.sin(8 * x)
+    y[437] = 10
+    kept = lttb(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == len(x) - 1
+    assert (np.diff(kept) > 0).all()
+    # The peak survives the downsampling
+    assert 437 in kept
+    # Nothing to drop
+    assert (lttb(x[:20], y[:20], 50) == np.arange(20)).all()
+
+
+def test_split_links_match_per_link_filter(sumo_output, fcd):
+    links = fcd_data.read_links_params()
+    name = next(iter(links))
+    # A second link sharing a probe lane with the first one
+    links["Other"] = dict(links[name], DETECTION_LANE=LINK_PARAMS["PROBE_LANE"][:1],
+                          PROBE_LANE=LINK_PARAMS["PROBE_LANE"])
+    batches = (convert_units(batch) for batch in iter_xml(str(sumo_output / "fcd.xml"), 5000))
+    out = split_links(batches, links)
+    for link, params in links.items():
+        expected = fcd[fcd["lane"].isin(params["DETECTION_LANE"] + params["PROBE_LANE"])]
+        pd.testing.assert_frame_equal(out[link].reset_index(drop=True), expected.reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False)
+
+
+def test_links_without_lanes_only_give_their_discretization(tmp_path):
+    links = fcd_data.read_links_params()
+    assert links["Link-2"]["DELTAX"] == 52 and links["Link-3"]["DELTAT"] == 2
+    # The lanes of the top-level link are never inherited
+    assert links["Link-2"]["DETECTION_LANE"] == [] and links["Link-2"]["FD_DIR"] is None
+    assert links["Link-2"]["PENERATION_RATE"] == LINK_PARAMS["PENERATION_RATE"]
+
+    config = tmp_path / "LinkParams.json"
+    config.write_text('{"LINK_NAME": "Link-1", "LINKS": {"Link-2": {"ROAD_LENGTH": 312}}}')
+    with pytest.raises(ValueError):
+        fcd_data.read_links_params(str(config))
+
+
+def test_sweep_samples_are_nested_and_written_once(sumo_output, probe_data, detect_data, tmp_path):
+    rates, seeds = [0.1, 0.3, 0.5], [1, 2]
+    sweep = fcd_data.sweep_expData(probe_data, detect_data, rates, seeds,
+                                   fd_windows=FDWindows(fd_dir=str(sumo_output)), exp_folder=str(tmp_path))
+    pd.testing.assert_frame_equal(pd.read_feather(tmp_path / fcd_data.SWEEP_FILE), sweep)
+    n_vehicles = probe_data["id"].nunique()
+    for seed in seeds:
+        samples = [set(sweep.loc[(sweep["rate"] == rate) & (sweep["seed"] == seed), "probe_id"]) for rate in rates]
+        assert [len(sample) for sample in samples] == [int(n_vehicles * rate) for rate in rates]
+        assert samples[0] <= samples[1] <= samples[2]
+
+    ## One experiment per distinct probe id with detected vehicles
+    catalog = pd.read_feather(tmp_path / CATALOG_FILE)
+    assert set(catalog["probe_id"]) == set(sweep.loc[sweep["has_exp"], "probe_id"])
+    assert catalog["probe_id"].is_unique
+    assert set(catalog["path"]) == {name for name in os.listdir(tmp_path) if os.path.isdir(tmp_path / name)}
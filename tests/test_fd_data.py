@@ -0,0 +1,77 @@
+import base64
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fd_data
+from fd_data import parse_xml, fcd_intervals, rollup_fd, convert_fd, convert_rollups, LINK_EDGE
+from fcd_data import FD_TIMESTEPS
+
+
+def _assert_same_intervals(rolled, direct):
+    # SUMO writes 2 decimals; the last interval of the synthetic outputs is cut short
+    assert list(rolled.columns) == list(direct.columns)
+    assert len(rolled) == len(direct)
+    for col in ["begin", "end", "sampledSeconds", "density", "laneDensity", "entered", "left"]:
+        err = np.abs(rolled[col].to_numpy(float) - direct[col].to_numpy(float))[:-1]
+        assert err.max() < 0.011, col
+    occupied = direct["sampledSeconds"] > 0
+    assert np.abs(rolled["speed"][occupied] - direct["speed"][occupied]).max() < 0.011
+
+
+def test_rollup_of_fcd_matches_direct_outputs(sumo_output):
+    fine = fcd_intervals(str(sumo_output / "fcd.xml"))
+    for ts, rolled in rollup_fd(fine).items():
+        _assert_same_intervals(rolled, parse_xml(str(sumo_output / f"fd-{ts}sec.xml"), ts))
+
+
+def test_rollup_of_fine_output_matches_direct_outputs(sumo_output):
+    fine = parse_xml(str(sumo_output / "fd-2sec.xml"), 2)
+    for ts, rolled in rollup_fd(fine, [4, 6, 8]).items():
+        _assert_same_intervals(rolled, parse_xml(str(sumo_output / f"fd-{ts}sec.xml"), ts))
+    with pytest.raises(ValueError):
+        rollup_fd(fine, [3])
+
+
+def test_rollup_conversion_has_the_schema_of_convert_fd(sumo_output, tmp_path):
+    paths = convert_rollups(fcd_intervals(str(sumo_output / "fcd.xml")), str(tmp_path), n_lanes=1)
+    assert sorted(paths) == sorted(FD_TIMESTEPS)
+    rolled = pd.read_feather(paths[4])
+    direct = pd.read_feather(sumo_output / "fd-4sec.feather")
+    assert list(rolled.columns) == list(direct.columns)
+    assert (rolled.dtypes == direct.dtypes).all()
+
+
+def test_convert_fd_keeps_the_link_edge(sumo_output, tmp_path):
+    xml = (sumo_output / "fd-5sec.xml").read_text()
+    # Every interval also measures another edge
+    xml = re.sub(r'(\s*<edge id=")([^"]+)(".*?/>)', lambda m: m.group(0) + m.group(1) + "other" + m.group(3), xml)
+    (tmp_path / "fd-5sec.xml").write_text(xml)
+    assert parse_xml(str(tmp_path / "fd-5sec.xml"), 5)["laneid"].nunique() == 2
+
+    fd = pd.read_feather(convert_fd(str(tmp_path / "fd-5sec.xml"), 5, n_lanes=1))
+    pd.testing.assert_frame_equal(fd, pd.read_feather(sumo_output / "fd-5sec.feather"))
+    assert (fd["laneid"] == LINK_EDGE).all()
+    with pytest.raises(ValueError):
+        convert_fd(str(tmp_path / "fd-5sec.xml"), 5, n_lanes=1, edge_id="missing")
+
+
+def test_fd_plot_json_to_cache(sumo_output, tmp_path):
+    df = pd.read_feather(sumo_output / "fd-2sec.feather").dropna(subset=["speed"])
+    fig = fd_data.get_fd_plot(df, title="FD")
+    fd_data.plotlyfig2json(fig, str(tmp_path / "fd_plot.json"))
+    fd_data.fd_plot_json_to_cache(str(tmp_path / "fd_plot.json"), str(tmp_path / "fd_plot.feather"))
+    cached = fd_data.load_fd_plot(str(tmp_path / "fd_plot.feather"))
+    assert cached.layout.title.text == "FD"
+    for original, rebuilt in zip(fig.data[:2], cached.data[:2]):
+        assert np.allclose(np.asarray(original.x, dtype=float), rebuilt.x, equal_nan=True)
+        assert np.allclose(np.asarray(original.y, dtype=float), rebuilt.y, equal_nan=True)
+
+
+def test_plot_array_decodes_typed_arrays():
+    values = np.arange(6, dtype=np.int16)
+    typed = {"dtype": "i2", "bdata": base64.b64encode(values.tobytes()).decode(), "shape": "2, 3"}
+    assert (fd_data._plot_array(typed) == values.reshape(2, 3)).all()
+    assert (fd_data._plot_array([1, 2]) == [1.0, 2.0]).all()
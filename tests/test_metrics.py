@@ -0,0 +1,25 @@
+import time
+
+import numpy as np
+
+import metrics
+
+
+def test_stage_rss_is_sampled_per_stage():
+    metrics.reset()
+    with metrics.stage("outer"):
+        with metrics.stage("big"):
+            buffer = np.ones(64 * 2**20 // 8)
+            time.sleep(5 * metrics.RSS_INTERVAL)
+            del buffer
+        with metrics.stage("small"):
+            time.sleep(2 * metrics.RSS_INTERVAL)
+    records = {record["stage"]: record for record in metrics.STAGES}
+    big, small = records["big"], records["small"]
+    assert big["peak_rss_mb"] >= big["rss_start_mb"] + 50
+    # The peak of an earlier stage does not leak into the next one, unlike the lifetime peak
+    assert small["peak_rss_mb"] < big["peak_rss_mb"] - 50
+    assert small["peak_rss_lifetime_mb"] >= big["peak_rss_mb"] - 1
+    assert records["outer"]["peak_rss_mb"] >= big["peak_rss_mb"]
+    assert records["big"]["parent"] == "outer"
+    metrics.reset()
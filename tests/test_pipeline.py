@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import pandas as pd
+
+import dashboard_cache
+import fcd_data
+import pipeline
+from fcd_data import CATALOG_FILE, FDWindows
+
+
+def _experiments(exp_folder):
+    return {name for name in os.listdir(exp_folder) if os.path.isdir(os.path.join(exp_folder, name))}
+
+
+def test_rerun_clears_stale_experiments(sumo_output, tmp_path, monkeypatch):
+    shutil.copy(sumo_output / "fcd.xml", tmp_path / "fcd.xml")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(fcd_data.LINK_PARAMS, "PENERATION_RATE", 0.5)
+    pipeline.run_pipeline(str(tmp_path / "fcd.xml"), fd_dir=str(sumo_output))
+    first = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    # The raster is written where the dashboard reads it
+    assert os.path.exists(dashboard_cache.raster_path(fcd_data.LINK_PARAMS["LINK_NAME"]))
+
+    monkeypatch.setitem(fcd_data.LINK_PARAMS, "PENERATION_RATE", 0.2)
+    manifest = pipeline.run_pipeline(str(tmp_path / "fcd.xml"), fd_dir=str(sumo_output))
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert manifest["experiments"]["params"]["PENERATION_RATE"] == 0.2
+    assert len(catalog) < len(first)
+    assert set(catalog["path"]) == _experiments(tmp_path / "exp")
+
+
+def test_follow_mode_rows_are_partial_without_fd(sumo_output, probe_data, detect_data, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pipeline.follow_fcd(str(sumo_output / "fcd.xml"), poll_interval=0.05, idle_timeout=0.2)
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert len(catalog) and catalog["partial"].all()
+
+    ## A batch run writes them again with the FD
+    fcd_data.generate_expData(catalog["probe_id"].tolist(), probe_data, detect_data,
+                              fd_windows=FDWindows(fd_dir=str(sumo_output)))
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert not catalog["partial"].any()
+
+
+def test_follow_mode_with_fd(sumo_output, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pipeline.follow_fcd(str(sumo_output / "fcd.xml"), fd_windows=FDWindows(fd_dir=str(sumo_output)),
+                        poll_interval=0.05, idle_timeout=0.2)
+    catalog = pd.read_feather(tmp_path / "exp" / CATALOG_FILE)
+    assert len(catalog) and not catalog["partial"].any()
+    assert os.path.exists(tmp_path / "exp" / catalog["path"].iloc[0] / "outflow-8sec.csv")
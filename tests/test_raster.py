@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from raster import RASTER_DT, rasterize, build_levels, save_raster, load_raster, raster_image
+
+ROAD = 0.43
+
+
+def test_levels_add_up_the_finest_bins(detect_data):
+    raster = rasterize(detect_data, road_space=(0, ROAD))
+    assert raster["count"].sum() == detect_data["speed"].notna().sum()
+    levels = build_levels(raster)
+    for k, (count, speed_sum) in enumerate(levels):
+        fine = raster["count"]
+        padded = np.pad(fine, ((0, -len(fine) % 2**k), (0, 0)))
+        expected = padded.reshape(-1, 2**k, fine.shape[1]).sum(axis=1)
+        assert np.array_equal(count, expected)
+        assert np.isclose(speed_sum.sum(), raster["speed_sum"].sum(), rtol=1e-5)
+
+
+def test_raster_image_matches_the_rows_of_its_bins(detect_data, tmp_path):
+    save_raster(str(tmp_path / "raster.npz"), rasterize(detect_data, road_space=(0, ROAD)))
+    raster = load_raster(str(tmp_path / "raster.npz"))
+
+    ## Whole day: a coarse level; a short window: the finest level
+    assert raster_image(raster, t_range=(0, 24))[3] > 0
+    t0, t1 = 0.1, 0.15
+    time, pos, image, level = raster_image(raster, "speed", (t0, t1))
+    assert level == 0
+    assert image.shape == (len(pos), len(time))
+
+    ## Mean speed of every bin by brute force, on the whole seconds of the rows
+    second = np.round(detect_data["time"].to_numpy() * 3600).astype(int)
+    for j, t in enumerate(time):
+        rows = detect_data[second // round(RASTER_DT * 3600) == int(t / RASTER_DT)]
+        for i, x in enumerate(pos):
+            cell = rows[(rows["pos"] >= x - raster["dx"] / 2) & (rows["pos"] < x + raster["dx"] / 2)]
+            if len(cell):
+                assert image[i, j] == pytest.approx(cell["speed"].mean(), rel=1e-4)
+            else:
+                assert np.isnan(image[i, j])
+
+    density = raster_image(raster, "density", (t0, t1))[2]
+    assert np.all(density[np.isnan(image)] == 0)